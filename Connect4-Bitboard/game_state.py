@@ -1,87 +1,131 @@
 import sys
 import numpy as np
 
+# Positions are plain integers: the AI's stones, every stone (7 bits per column, row 6 a sentinel)
+# and the number of moves played. The functions below work on those integers directly so the
+# search does not need a State per node; State wraps them for the game loop.
+
+BOARD_MASK = sum(0b111111 << (7 * column) for column in range(7)) # Every playable cell, no sentinel row
+TOP_ROW = sum(1 << (7 * column + 5) for column in range(7))
+# Select column starting from the middle and then to the edges index order [3,2,4,1,5,0,6]
+COLUMN_ORDER = tuple(3 + (1 - 2 * (i % 2)) * (i + 1) // 2 for i in range(7))
+
+ONGOING = 3 # Set an arbitrary status number
+AI_WIN = -1
+PLAYER_WIN = 1
+DRAW = 0
+
+def four_in_a_row(bitboard):
+    # Horizontal check
+    m = bitboard & (bitboard >> 7)
+    if m & (m >> 14):
+        return True
+    # Diagonal \
+    m = bitboard & (bitboard >> 6)
+    if m & (m >> 12):
+        return True
+    # Diagonal /
+    m = bitboard & (bitboard >> 8)
+    if m & (m >> 16):
+        return True
+    # Vertical
+    m = bitboard & (bitboard >> 1)
+    if m & (m >> 2):
+        return True
+    # Nothing found
+    return False
+
+def winning_cells(position, mask):
+    """ Empty cells that would give `position` 4 in a row """
+    # Vertical
+    r = (position << 1) & (position << 2) & (position << 3)
+    # Horizontal and both diagonals
+    for shift in (7, 6, 8):
+        p = (position << shift) & (position << 2 * shift)
+        r |= p & (position << 3 * shift)
+        r |= p & (position >> shift)
+        p = (position >> shift) & (position >> 2 * shift)
+        r |= p & (position << shift)
+        r |= p & (position >> 3 * shift)
+    return r & (BOARD_MASK ^ mask)
+
+def ai_to_move(who_went_first, depth):
+    """ Check if the AI makes the move after `depth` moves """
+    return (who_went_first == -1 and depth % 2 == 0) or (who_went_first == 0 and depth % 2 == 1)
+
+def terminal_status(ai_bitboard, game_bitboard):
+    """ AI_WIN, PLAYER_WIN, DRAW or ONGOING """
+    if four_in_a_row(ai_bitboard):
+        return AI_WIN
+    elif four_in_a_row(ai_bitboard ^ game_bitboard):
+        return PLAYER_WIN
+    elif game_bitboard & TOP_ROW == TOP_ROW:
+        return DRAW
+    return ONGOING
+
+def heuristic(status, depth):
+    """
+    Score based on who can win. Score computed as 22 minus number of moves played
+    i.e. AI wins with 4th move, score = 22 - 4 = 18
+    """
+    if status == AI_WIN:
+        # AI Wins
+        return 22 - (depth // 2)
+    elif status == PLAYER_WIN:
+        # Player Wins
+        return -1 * (22 - (depth // 2))
+    elif status == DRAW:
+        # Draw
+        return 0
+    elif depth % 2 == 0:
+        # MAX node returns
+        return sys.maxsize
+    else:
+        # MIN node returns
+        return -sys.maxsize
+
 class State:
 
-    status = 3 # Set an arbitrary status number 
+    __slots__ = ("ai_bitboard", "game_bitboard", "depth", "status")
 
     def __init__(self, ai_bitboard, game_bitboard, depth=0):
         self.ai_bitboard = ai_bitboard
         self.game_bitboard = game_bitboard
         self.depth = depth
+        self.status = ONGOING
 
     @property
     def human_bitboard(self):
         return self.ai_bitboard ^ self.game_bitboard
 
     def four_in_a_row(self, bitboard):
-        # Horizontal check
-        m = bitboard & (bitboard >> 7)
-        if m & (m >> 14):
-            return True
-        # Diagonal \
-        m = bitboard & (bitboard >> 6)
-        if m & (m >> 12):
-            return True
-        # Diagonal /
-        m = bitboard & (bitboard >> 8)
-        if m & (m >> 16):
-            return True
-        # Vertical
-        m = bitboard & (bitboard >> 1)
-        if m & (m >> 2):
-            return True
-        # Nothing found
-        return False
+        return four_in_a_row(bitboard)
+
+    def winning_cells(self, position, mask):
+        """ Empty cells that would give `position` 4 in a row """
+        return winning_cells(position, mask)
+
+    def ai_to_move(self, who_went_first):
+        """ Check if the AI makes the next move, the same rule as generate_children """
+        return ai_to_move(who_went_first, self.depth)
 
     def is_draw(self, bitboard):
-        return all(bitboard & (1 << (7 * column + 5)) for column in range(0, 7))
+        return bitboard & TOP_ROW == TOP_ROW
 
     def terminal_node_test(self):
         """ Test if current state is a terminal node """
-        if self.four_in_a_row(self.ai_bitboard):
-            # AI Wins
-            self.status = -1
-            return True
-        elif self.four_in_a_row(self.human_bitboard):
-            # Player Wins
-            self.status = 1
-            return True
-        elif self.is_draw(self.game_bitboard):
-            # Draw
-            self.status = 0
-            return True
-        else:
-            return False
+        self.status = terminal_status(self.ai_bitboard, self.game_bitboard)
+        return self.status != ONGOING
 
     def calculate_heuristic(self):
-        """
-        Score based on who can win. Score computed as 22 minus number of moves played
-        i.e. AI wins with 4th move, score = 22 - 4 = 18
-        """
-        if self.status == -1:
-            # AI Wins
-            return 22 - (self.depth // 2)
-        elif self.status == 1:
-            # Player Wins
-            return -1 * (22 - (self.depth // 2))
-        elif self.status == 0:
-            # Draw
-            return 0
-        elif self.depth % 2 == 0:
-            # MAX node returns
-            return sys.maxsize
-        else:
-            # MIN node returns
-            return -sys.maxsize
+        """ Score of the status found by terminal_node_test(), see heuristic() """
+        return heuristic(self.status, self.depth)
 
     def generate_children(self, who_went_first):
         """ For each column entry, generate a new State if the new position is valid"""
-        for i in range(0, 7):
-            # Select column starting from the middle and then to the edges index order [3,2,4,1,5,0,6]
-            column = 3 + (1 - 2 * (i % 2)) * (i + 1) // 2
+        for column in COLUMN_ORDER:
             if not self.game_bitboard & (1 << (7 * column + 5)):
-                if (who_went_first == -1 and self.depth % 2 == 0) or (who_went_first == 0 and self.depth % 2 == 1):
+                if self.ai_to_move(who_went_first):
                     # AI (MAX) Move
                     new_ai_position, new_game_position = self.make_move(self.ai_bitboard, self.game_bitboard, column)
                 else:
@@ -94,12 +138,17 @@ class State:
         """ At position 0, format int to binary using 49 digits zero padding. We don't need to use all 64 digits. """
         return '{0:049b}'.format(self.ai_bitboard) + ' ; ' + '{0:049b}'.format(self.game_bitboard)
 
+    @property
+    def key(self):
+        """ Unique integer of the position (49 bits): the AI's stones plus every stone """
+        return self.ai_bitboard + self.game_bitboard
+
     def __hash__(self):
-        return hash((self.ai_bitboard, self.game_bitboard, self.depth % 2))
+        return self.ai_bitboard + self.game_bitboard
 
     def __eq__(self, other):
-        return (self.ai_bitboard, self.game_bitboard, self.depth % 2) == (
-            other.ai_bitboard, other.game_bitboard, other.depth % 2)
+        return self.ai_bitboard == other.ai_bitboard and self.game_bitboard == other.game_bitboard and \
+            (self.depth - other.depth) % 2 == 0
     
     def make_move(self, position, mask, col):
         """ Helper method to make a move and return new position along with new board position """
@@ -1,62 +1,225 @@
 import sys
+from time import time, perf_counter
+from game_state import State, COLUMN_ORDER, ONGOING, winning_cells, ai_to_move, terminal_status, heuristic
+from transposition_cache import TranspositionCache, EXACT, LOWER_BOUND, UPPER_BOUND
 
-def alphabeta_search(state, turn=-1, d=7):
-    """Search game state to determine best action; use alpha-beta pruning. """
+class SearchTimeout(Exception):
+    """ Raised from inside the search once the deadline has passed """
+
+# Move ordering scores: wins, then blocks, then threats created, killers and history
+TT_SCORE = 1 << 61
+WIN_SCORE = 1 << 60
+BLOCK_SCORE = 1 << 59
+THREAT_WEIGHT = 1 << 40
+KILLER_SCORES = (1 << 36, 1 << 35)
+
+# Per column: the bottom cell (added to the mask to find the next free cell) and all cells of the column
+BOTTOM = tuple(1 << (7 * column) for column in range(7))
+COLUMN = tuple(0b111111 << (7 * column) for column in range(7))
+TOP = tuple(1 << (7 * column + 5) for column in range(7))
+
+def alphabeta_search(state, turn=-1, d=7, deadline=None, first_move=None, cache=None, stats=None):
+    """Search game state to determine best action; use alpha-beta pruning.
+    Returns the best child state, its score and the node count. Raises SearchTimeout when `deadline` (a time() value) passes. `first_move` is searched first.
+    Pass the same `cache` (a TranspositionCache) for every search of one game to reuse the work of earlier moves.
+    `stats` collects statistics when given: a dict of per-ply lists by counter name plus a one-item "eval_time" list,
+    such as search_stats.create_counters() of the main project. Without it the search counts nothing.
+    Below the root a node is just the integers (ai_bitboard, game_bitboard, ply) and a move is the bit of its new stone. """
+
+    def order_moves(ai, mask, ply, depth, tt_move=None):
+        """ Moves of a node, best first: the cached move, wins, blocks, then threats, killers and history """
+        moves = [(mask + BOTTOM[column]) & COLUMN[column] for column in COLUMN_ORDER if not mask & TOP[column]]
+        if depth >= d:
+            # The children are leaves, scoring them costs more than ordering could save
+            return moves
+        ai_move = ai_to_move(turn, ply)
+        position = ai if ai_move else ai ^ mask
+        own_wins = winning_cells(position, mask)
+        opponent_wins = winning_cells(position ^ mask, mask)
+        move_killers = killers.get(depth, ())
+        move_history = history[ai_move]
+        scored = []
+        for cell in moves:
+            if cell == tt_move:
+                score = TT_SCORE
+            elif cell & own_wins:
+                score = WIN_SCORE
+            elif cell & opponent_wins:
+                score = BLOCK_SCORE
+            else:
+                score = bin(winning_cells(position | cell, mask | cell)).count("1") * THREAT_WEIGHT + move_history.get(cell, 0)
+                for slot, killer in enumerate(move_killers):
+                    if killer == cell:
+                        score += KILLER_SCORES[slot]
+            scored.append((score, cell))
+        # sort() is stable, so equal scores keep the center first COLUMN_ORDER
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [cell for _, cell in scored]
+
+    def record_cutoff(ply, cell, depth):
+        """ Remember the move that caused a cutoff as a killer of its depth and in the history """
+        slots = killers.get(depth, ())
+        if not slots or slots[0] != cell:
+            killers[depth] = (cell,) + slots[:1]
+        move_history = history[ai_to_move(turn, ply)]
+        move_history[cell] = move_history.get(cell, 0) + (d - depth + 1) ** 2
+
+    def evaluate_leaf(ply):
+        """ heuristic() of a leaf below the search depth, counted and timed when collecting stats """
+        if stats is None:
+            return heuristic(ONGOING, ply)
+        t1 = perf_counter()
+        value = heuristic(ONGOING, ply)
+        stats["eval_time"][0] += perf_counter() - t1
+        stats["leaf_evals"][ply] += 1
+        return value
+
+    def probe(key, draft, alpha, beta, ply):
+        """ Cached (value or None, alpha, beta, move) of a node """
+        entry = cache.probe(key)
+        if stats is not None:
+            stats["cache_hits" if entry is not None else "cache_misses"][ply] += 1
+        if entry is None:
+            return None, alpha, beta, None
+        entry_draft, flag, value, tt_move = entry
+        if entry_draft >= draft:
+            if flag == EXACT:
+                return value, alpha, beta, tt_move
+            elif flag == LOWER_BOUND:
+                alpha = max(alpha, value)
+            elif flag == UPPER_BOUND:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value, alpha, beta, tt_move
+        return None, alpha, beta, tt_move
+
+    def count_cutoff(ply, i):
+        """ Count a cutoff by the i-th move searched """
+        if stats is not None:
+            stats["cutoffs"][ply] += 1
+            if i == 0:
+                stats["first_move_cutoffs"][ply] += 1
 
     # Functions used by alpha beta
-    def max_value(state, alpha, beta, depth, cnt):
-        if cutoff_search(state, depth):
-            return state.calculate_heuristic(), cnt + 1
+    def max_value(ai, mask, ply, alpha, beta, depth, cnt):
+        if deadline is not None and time() > deadline:
+            raise SearchTimeout
+        if stats is not None:
+            stats["nodes"][ply] += 1
+        if depth > d:
+            return evaluate_leaf(ply), cnt + 1
+        status = terminal_status(ai, mask)
+        if status != ONGOING:
+            if stats is not None:
+                stats["terminals"][ply] += 1
+            return heuristic(status, ply), cnt + 1
+
+        # Reuse an earlier search of this position that went at least as deep
+        draft = d + 1 - depth
+        key = ai + mask
+        value, alpha, beta, tt_move = probe(key, draft, alpha, beta, ply)
+        if value is not None:
+            return value, cnt + 1
+        alpha_orig = alpha
 
+        ai_move = ai_to_move(turn, ply)
         v = -sys.maxsize
-        for child in state.generate_children(turn):
-            if child in seen:
-                continue
-            temp_v, cnt = min_value(child, alpha, beta, depth + 1, cnt)
+        best_move = None
+        if stats is not None:
+            stats["expanded"][ply] += 1
+        for i, cell in enumerate(order_moves(ai, mask, ply, depth, tt_move)):
+            temp_v, cnt = min_value(ai | cell if ai_move else ai, mask | cell, ply + 1, alpha, beta, depth + 1, cnt)
+            if temp_v > v or best_move is None:
+                best_move = cell
             v = max(v, temp_v)
-            seen[child] = alpha
             if v >= beta:
+                record_cutoff(ply, cell, depth)
+                count_cutoff(ply, i)
+                cache.store(key, draft, LOWER_BOUND, v, best_move)
                 # Min is going to completely ignore this route
                 # since v will not get any lower than beta
                 return v, cnt + 1
             alpha = max(alpha, v)
         if v == -sys.maxsize:
             # If win/loss/draw not found, don't return -infinity to MIN node
-            return sys.maxsize, cnt + 1
+            v = sys.maxsize
+        flag = UPPER_BOUND if v <= alpha_orig else LOWER_BOUND if v >= beta else EXACT
+        cache.store(key, draft, flag, v, best_move)
         return v, cnt + 1
 
-    def min_value(state, alpha, beta, depth, cnt):
-        if cutoff_search(state, depth):
-            return state.calculate_heuristic(), cnt + 1
+    def min_value(ai, mask, ply, alpha, beta, depth, cnt):
+        if deadline is not None and time() > deadline:
+            raise SearchTimeout
+        if stats is not None:
+            stats["nodes"][ply] += 1
+        if depth > d:
+            return evaluate_leaf(ply), cnt + 1
+        status = terminal_status(ai, mask)
+        if status != ONGOING:
+            if stats is not None:
+                stats["terminals"][ply] += 1
+            return heuristic(status, ply), cnt + 1
 
+        draft = d + 1 - depth
+        key = ai + mask
+        value, alpha, beta, tt_move = probe(key, draft, alpha, beta, ply)
+        if value is not None:
+            return value, cnt + 1
+        beta_orig = beta
+
+        ai_move = ai_to_move(turn, ply)
         v = sys.maxsize
-        for child in state.generate_children(turn):
-            if child in seen:
-                continue
-            temp_v, cnt = max_value(child, alpha, beta, depth + 1, cnt)
+        best_move = None
+        if stats is not None:
+            stats["expanded"][ply] += 1
+        for i, cell in enumerate(order_moves(ai, mask, ply, depth, tt_move)):
+            temp_v, cnt = max_value(ai | cell if ai_move else ai, mask | cell, ply + 1, alpha, beta, depth + 1, cnt)
+            if temp_v < v or best_move is None:
+                best_move = cell
             v = min(v, temp_v)
-            seen[child] = alpha
             if v <= alpha:
+                record_cutoff(ply, cell, depth)
+                count_cutoff(ply, i)
+                cache.store(key, draft, UPPER_BOUND, v, best_move)
                 # Max is going to completely ignore this route
                 # since v will not get any higher than alpha
                 return v, cnt + 1
             beta = min(beta, v)
         if v == sys.maxsize:
             # If win/loss/draw not found, don't return infinity to MAX node
-            return -sys.maxsize, cnt + 1
+            v = -sys.maxsize
+        flag = LOWER_BOUND if v >= beta_orig else UPPER_BOUND if v <= alpha else EXACT
+        cache.store(key, draft, flag, v, best_move)
         return v, cnt + 1
 
-    # Keep track of seen states using their hash
-    seen = {}
+    if cache is None:
+        cache = TranspositionCache()
+
+    # Killer moves by depth and history scores by side (AI or not) and cell, for this search
+    killers = {}
+    history = {False: {}, True: {}}
 
     # Body of alpha beta_search:
-    cutoff_search = (lambda state, depth: depth > d or state.terminal_node_test())
+    ai, mask, ply = state.ai_bitboard, state.game_bitboard, state.depth
+    ai_move = ai_to_move(turn, ply)
+    if stats is not None:
+        stats["nodes"][ply] += 1
+        stats["expanded"][ply] += 1
     best_score = -sys.maxsize
     beta = sys.maxsize
-    best_action = None
-    for child in state.generate_children(turn):
-        v, cnt = min_value(child, best_score, beta, 1, 0) # Initialize node_count == 0
-        if v > best_score:
+    best_move = None
+    entry = cache.probe(ai + mask)
+    moves = order_moves(ai, mask, ply, 0, entry[3] if entry is not None else None)
+    if first_move is not None and first_move.game_bitboard ^ mask in moves:
+        # Search the previous iteration's best move first
+        moves.remove(first_move.game_bitboard ^ mask)
+        moves.insert(0, first_move.game_bitboard ^ mask)
+    cnt = 0
+    for cell in moves:
+        v, cnt = min_value(ai | cell if ai_move else ai, mask | cell, ply + 1, best_score, beta, 1, cnt)
+        if v > best_score or best_move is None:
             best_score = v
-            best_action = child
-    return best_action, cnt
\ No newline at end of file
+            best_move = cell
+    if best_move is None:
+        return None, best_score, cnt
+    return State(ai | best_move if ai_move else ai, mask | best_move, ply + 1), best_score, cnt
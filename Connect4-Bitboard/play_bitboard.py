@@ -1,9 +1,13 @@
 import os
+import sys
 import numpy as np
 from time import time
 from game_state import State
-from minimax_alphabeta import alphabeta_search
+from minimax_alphabeta import alphabeta_search, SearchTimeout
 from minimax import basic_minimax
+from transposition_cache import TranspositionCache
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from position_store import open_store, store_path
 from colorama import Fore
 
 class Game:
@@ -15,7 +19,10 @@ class Game:
         self.turn = self.PLAYER
         self.first = self.turn
         self.rounds = 0
-        self.depth = 7
+        self.depth = 0
+        self.time_budget = 1.0 # seconds per AI move
+        self.cache = TranspositionCache() # Kept for the whole game
+        self.store = open_store(store_path("bitboard")) # Results of earlier batch analysis, if any
         self.node_count = 0
         self.compute_time = 0
 
@@ -40,9 +47,7 @@ class Game:
     def next_turn(self):
         if self.turn == self.AI:
             self.rounds += 1
-            if self.rounds % 5 == 0 and self.depth < 10:
-                self.depth += 1
-            self.query_AI(self.depth)
+            self.query_AI()
         else:
             self.query_player()
         self.turn = ~self.turn
@@ -67,13 +72,39 @@ class Game:
                                                     self.current_state.game_bitboard, column)
         self.current_state = State(self.current_state.ai_bitboard, new_game_bitboard, self.current_state.depth + 1)
 
-    def query_AI(self, depth):
-        """ AI Bot chooses next best move from current state """
+    def query_AI(self):
+        """ AI Bot chooses next best move from current state, deepening the search until the time budget runs out """
         t1 = time()
-        self.current_state, node_count = alphabeta_search(self.current_state, self.first, d=depth)
+        deadline = t1 + self.time_budget
+        empty_cells = 42 - bin(self.current_state.game_bitboard).count("1")
+        best_state = None
+        self.node_count = 0
+        self.cache.new_search()
+        stored = self.store.lookup(self.current_state.key) if self.store else None
+        if stored:
+            # The AI is the side to move, so its stones are the `position` half of the store key
+            column, _, self.depth = stored
+            ai_bitboard, game_bitboard = self.current_state.make_move(self.current_state.ai_bitboard,
+                                                                      self.current_state.game_bitboard, column)
+            self.current_state = State(ai_bitboard, game_bitboard, self.current_state.depth + 1)
+            self.compute_time = round(time() - t1, 2)
+            return
+        for depth in range(1, empty_cells + 1):
+            try:
+                # The first iteration has no deadline so there is always a move to play
+                state, _, node_count = alphabeta_search(self.current_state, self.first, d=depth,
+                                                     deadline=deadline if best_state else None, first_move=best_state,
+                                                     cache=self.cache)
+            except SearchTimeout:
+                break
+            best_state = state
+            self.node_count += node_count
+            self.depth = depth
+            if time() >= deadline:
+                break
+        # self.current_state, node_count = basic_minimax(self.current_state, self.first, d=self.depth)
+        self.current_state = best_state
         self.compute_time = round(time() - t1, 2)
-        # self.current_state, node_count = basic_minimax(self.current_state, self.first, d=depth)
-        self.node_count = node_count
 
     def pretty_print_board(self, gridboard):
 
@@ -83,6 +114,9 @@ class Game:
         print(f"AI search depth: {self.depth}")
         print(f"Nodes searched: {self.node_count}")
         print(f"Compute time: {self.compute_time} sec")
+        print(f"Cache hit rate: {self.cache.hit_rate():.1%} of {self.cache.probes} probes")
+        if self.store:
+            print(f"Position store: {self.store.hits} hits, {self.store.misses} misses")
         print('')
         print("\t      1   2   3   4   5   6   7 ")
         print("\t      -   -   -   -   -   -   - ")
@@ -0,0 +1,42 @@
+
+EXACT = 0
+LOWER_BOUND = 1 # The true value is at least the stored value (the search failed high)
+UPPER_BOUND = 2 # The true value is at most the stored value (the search failed low)
+
+class TranspositionCache:
+    """ Bounded table of alpha beta results, kept for a whole game.
+    One slot per index; a slot is replaced by a search at least as deep, or by any search once its
+    entry is older than the current move. """
+
+    def __init__(self, size=1048573):
+        # A prime size spreads the keys, whose low bits are all in the first columns
+        self.size = size
+        self.entries = [None] * size
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        """ Start a new move: older entries stay usable but become replaceable """
+        self.age += 1
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key):
+        """ The stored (draft, flag, value, move) of a position key, or None """
+        self.probes += 1
+        entry = self.entries[key % self.size]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1:5]
+        return None
+
+    def store(self, key, draft, flag, value, move):
+        """ Save the result of a search `draft` plies deep; move is the bit of the best move's stone """
+        index = key % self.size
+        entry = self.entries[index]
+        if entry is None or entry[0] == key or entry[5] != self.age or draft >= entry[1]:
+            self.entries[index] = (key, draft, flag, value, move, self.age)
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0.0
@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional
+from base_game import create_board, is_valid_column, get_next_open_row, drop_piece, check_for_win, SCORE_WEIGHTS
+from bitboard import from_array
+from iterative_deepening import iterative_deepening, new_stop_flag
+from search_stats import create_stats, create_counters, SearchStats
+
+# A file that holds the batch analysis entry point: score many positions with one engine, no input() loop.
+#
+# A position is one line of text, either a move sequence such as "4453" (columns 1-7, player 1 first)
+# or a JSON 6x7 array in the layout of base_game.create_board (row 0 at the bottom, pieces 1 and 2).
+# Every engine searches for the side to move, and every result is one JSON line:
+#
+#   {"position": "4453", "engine": "alphabeta", "move": 3, "score": 24, "nodes": 8391, "depth": 7, "time": 0.02}
+#
+# `move` is a column 1-7 like the input. Scores are reported as each engine computes them, in the same
+# search model as its start_game: the root score of minimax_basic/minimax_alphabeta, the root score of
+# play_online's minimax (its own SCORE_WEIGHTS and WIN_SCORE) for online, the win rate of the side to move
+# for montecarlo and the terminal score of Connect4-Bitboard for bitboard.
+# With --stats the depth-first engines also report their search statistics (see search_stats.py).
+# A position that cannot be analyzed gets an "error" instead.
+
+ENGINES = ("basic", "alphabeta", "online", "montecarlo", "bitboard")
+PLAYER_PIECE = 1 # The engines' opponent
+AI_PIECE = 2 # The engines search for this piece, so the side to move is relabeled to it
+
+def parse_position(text:str) -> np.ndarray:
+    """ Read one position
+
+    Args:
+        text (str): a move sequence (columns 1-7) or a JSON 6x7 array with row 0 at the bottom
+
+    Returns:
+        np.ndarray: game board with the pieces of the input
+
+    Raises:
+        ValueError: the text is not a legal, unfinished position
+    """
+    text = text.strip()
+    if text.startswith("["):
+        board = np.array(json.loads(text), dtype=np.float64)
+        if board.shape != (6, 7) or not np.isin(board, (0, 1, 2)).all():
+            raise ValueError("A board must be a 6x7 array of 0, 1 and 2")
+        for col in range(7):
+            stones = board[:, col] != 0
+            if not stones[:np.count_nonzero(stones)].all():
+                raise ValueError(f"Column {col + 1} has a floating stone")
+        if np.count_nonzero(board == 1) - np.count_nonzero(board == 2) not in (0, 1):
+            raise ValueError("Player 1 moves first, so it has as many stones as player 2 or one more")
+    else:
+        board = create_board()
+        piece = PLAYER_PIECE
+        for char in text:
+            if not char.isdigit() or not 1 <= int(char) <= 7 or not is_valid_column(board, int(char) - 1):
+                raise ValueError(f"Invalid move {char}")
+            col = int(char) - 1
+            board = drop_piece(board, get_next_open_row(board, col), col, piece)
+            piece = AI_PIECE if piece == PLAYER_PIECE else PLAYER_PIECE
+    if check_for_win(board, PLAYER_PIECE) or check_for_win(board, AI_PIECE):
+        raise ValueError("The game is already won")
+    if np.count_nonzero(board) == 42:
+        raise ValueError("The board is full")
+    return board
+
+def side_to_move(board:np.ndarray) -> int:
+    """ Player 1 moves whenever both players have the same number of stones """
+    return PLAYER_PIECE if np.count_nonzero(board == PLAYER_PIECE) == np.count_nonzero(board == AI_PIECE) else AI_PIECE
+
+def relabel(board:np.ndarray) -> np.ndarray:
+    """ Swap the pieces so the side to move plays AI_PIECE, the piece every engine searches for """
+    if side_to_move(board) == AI_PIECE:
+        return board
+    return np.where(board == 0, 0, 3 - board)
+
+def search_minimax(board:np.ndarray, engine:str, depth:Optional[int], time_budget:float, stats:np.ndarray) -> tuple:
+    """ Run play_minimax_basic or play_minimax_alphabeta the way their start_game does, counting into `stats` """
+    empty_cells = 42 - np.count_nonzero(board)
+    position, mask = from_array(board, PLAYER_PIECE)
+    evaluator = create_evaluator(position ^ mask, position, SCORE_WEIGHTS)
+    if engine == "basic":
+        search = lambda depth, stop: minimax_basic(position, mask, depth, True, 0, evaluator, stop, stats)
+    else:
+        table = create_table()
+        key = zobrist_hash(board, True)
+        ordering = create_ordering()
+        search = lambda depth, stop: minimax_alphabeta(position, mask, depth, -sys.maxsize, sys.maxsize, True, 0, key, table, evaluator, ordering, stop, stats)
+    if depth is not None:
+        depth = min(depth, empty_cells)
+        col, score, node_count = search(depth, new_stop_flag())
+        return col, score, node_count, depth
+    return iterative_deepening(search, time_budget, empty_cells, WIN_SCORE)
+
+def search_online(board:np.ndarray, depth:Optional[int], time_budget:float, stats:np.ndarray) -> tuple:
+    """ Run play_online's search the way its start_game does, counting into `stats` """
+    empty_cells = 42 - np.count_nonzero(board)
+    search = create_online_search(board, stats)
+    if depth is not None:
+        depth = min(depth, empty_cells)
+        col, score, node_count = search(depth, new_stop_flag())
+        return col, score, node_count, depth
+    return iterative_deepening(search, time_budget, empty_cells, ONLINE_WIN_SCORE)
+
+def search_montecarlo(board:np.ndarray, playouts:Optional[int], time_budget:float) -> tuple:
+    """ Run one UCT tree; a playout budget makes the search repeatable, unless time_budget runs out first """
+    position, mask = from_array(board, AI_PIECE)
+    if playouts is not None:
+        seed(0)
+        col, win_rate, node_count, depth = montecarlo(position, mask, time_budget, playouts)
+    else:
+        col, win_rate, node_count, depth = montecarlo(position, mask, time_budget)
+    return col, round(win_rate, 4), node_count, depth
+
+def search_bitboard(board:np.ndarray, depth:Optional[int], time_budget:float, stats:Optional[dict]) -> tuple:
+    """ Run Connect4-Bitboard's alphabeta_search, deepening like play_bitboard.Game.query_AI, counting into `stats` when given """
+    ai_bitboard, game_bitboard = (int(b) for b in from_array(board, AI_PIECE))
+    plies = int(np.count_nonzero(board))
+    state = State(ai_bitboard, game_bitboard, plies)
+    first = Game.AI if plies % 2 == 0 else Game.PLAYER
+    cache = TranspositionCache()
+    if depth is not None:
+        best_state, score, node_count = alphabeta_search(state, first, d=depth, cache=cache, stats=stats)
+    else:
+        deadline = time.time() + time_budget
+        best_state = None
+        node_count = 0
+        for depth in range(1, 42 - plies + 1):
+            try:
+                iteration_state, iteration_score, nodes = alphabeta_search(state, first, d=depth,
+                                                    deadline=deadline if best_state else None, first_move=best_state,
+                                                    cache=cache, stats=stats)
+            except SearchTimeout:
+                depth -= 1
+                break
+            best_state, score = iteration_state, iteration_score
+            node_count += nodes
+            if time.time() >= deadline:
+                break
+    if best_state is None:
+        raise ValueError("The engine returned no move")
+    col = ((best_state.game_bitboard ^ game_bitboard).bit_length() - 1) // 7
+    return col, score, node_count, depth
+
+def analyze_position(text:str, engine:str, depth:Optional[int]=None, playouts:Optional[int]=None,
+                     time_budget:float=1.0, stats:bool=False) -> dict:
+    """ Score one position
+
+    Args:
+        text (str): the position, see parse_position()
+        engine (str): one of ENGINES
+        depth (int): fixed search depth for the minimax and online engines; None to deepen until time_budget runs out
+        playouts (int): fixed number of montecarlo playouts; None to search for time_budget
+        time_budget (float): seconds per position when there is no fixed depth or playout count, and the
+                             most a fixed playout count may take
+        stats (bool): also return the search statistics of the basic, alphabeta, online and bitboard engines
+
+    Returns:
+        dict: position, engine, move (1-7), score, nodes, depth, time and stats if asked for,
+              or position, engine and error
+    """
+    result = {"position": text.strip(), "engine": engine}
+    try:
+        board = relabel(parse_position(text))
+    except ValueError as error:
+        result["error"] = str(error)
+        return result
+
+    t1 = time.time()
+    try:
+        if engine in ("basic", "alphabeta"):
+            counters = create_stats(stats)
+            col, score, node_count, completed_depth = search_minimax(board, engine, depth, time_budget, counters)
+            search_stats = SearchStats(counters, np.count_nonzero(board), time.time() - t1) if stats else None
+        elif engine == "online":
+            counters = create_stats() # Always on: play_online's search counts its nodes in the table
+            col, score, node_count, completed_depth = search_online(board, depth, time_budget, counters)
+            search_stats = SearchStats(counters, np.count_nonzero(board), time.time() - t1) if stats else None
+        elif engine == "montecarlo":
+            col, score, node_count, completed_depth = search_montecarlo(board, playouts, time_budget)
+            search_stats = None # Playouts, not a depth-first search: nodes is all there is to count
+        else:
+            counters = create_counters() if stats else None
+            col, score, node_count, completed_depth = search_bitboard(board, depth, time_budget, counters)
+            search_stats = SearchStats.from_counters(counters, np.count_nonzero(board), time.time() - t1) if stats else None
+    except ValueError as error:
+        result["error"] = str(error)
+        return result
+    result.update({"move": int(col) + 1, "score": score if isinstance(score, float) else int(score),
+                   "nodes": int(node_count), "depth": int(completed_depth), "time": round(time.time() - t1, 4)})
+    if search_stats is not None:
+        result["stats"] = search_stats.to_dict()
+    return result
+
+def init_worker(engine:str) -> None:
+    """ Import only the chosen engine, so a run does not need the other engines' dependencies """
+    global create_evaluator, minimax_basic, minimax_alphabeta, create_table, zobrist_hash, create_ordering, WIN_SCORE
+    global create_online_search, ONLINE_WIN_SCORE
+    global seed, montecarlo, State, Game, alphabeta_search, SearchTimeout, TranspositionCache
+    if engine in ("basic", "alphabeta"):
+        from incremental_evaluation import create_evaluator
+        from play_minimax_basic import minimax_basic
+        from play_minimax_alphabeta import minimax_alphabeta
+        from transposition_table import create_table, zobrist_hash
+        from move_ordering import create_ordering
+        WIN_SCORE = 100000 # Same as start_game(): stop deepening once the game is decided
+    elif engine == "online":
+        from play_online import create_search as create_online_search
+        ONLINE_WIN_SCORE = 1000000 # Same as play_online.start_game()
+    elif engine == "montecarlo":
+        from play_montecarlo import seed, montecarlo
+    else:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Connect4-Bitboard"))
+        from game_state import State
+        from play_bitboard import Game
+        from minimax_alphabeta import alphabeta_search, SearchTimeout
+        from transposition_cache import TranspositionCache
+    # Compile the numba functions now, so the first position does not spend its time budget on it
+    analyze_position("", engine, depth=1, playouts=1)
+
+def analyze_worker(args:tuple) -> dict:
+    """ analyze_position() with its arguments packed, for pool.map() """
+    return analyze_position(*args)
+
+def analyze_positions(positions:Iterable[str], engine:str, depth:Optional[int]=None, playouts:Optional[int]=None,
+                      time_budget:float=1.0, workers:int=os.cpu_count() or 1, stats:bool=False) -> Iterator[dict]:
+    """ Score many positions in a pool of worker processes
+
+    Args:
+        positions (Iterable[str]): one position per item, see parse_position(); blank items are skipped
+        engine (str): one of ENGINES
+        depth (int): see analyze_position()
+        playouts (int): see analyze_position()
+        time_budget (float): see analyze_position()
+        workers (int): number of processes; 1 runs in this process
+        stats (bool): see analyze_position()
+
+    Returns:
+        Iterator[dict]: one result per position, in input order, as soon as it is ready
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, choose from {', '.join(ENGINES)}")
+    tasks = ((text, engine, depth, playouts, time_budget, stats) for text in positions if text.strip())
+    if workers <= 1:
+        init_worker(engine)
+        yield from map(analyze_worker, tasks)
+        return
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(engine,)) as pool:
+        # Bounded chunks keep the input streaming instead of reading all of it up front
+        chunk = []
+        for task in tasks:
+            chunk.append(task)
+            if len(chunk) == 64 * workers:
+                yield from pool.map(analyze_worker, chunk)
+                chunk = []
+        yield from pool.map(analyze_worker, chunk)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze Connect 4 positions in batch and print JSON lines.")
+    parser.add_argument("input", nargs="?", default="-", help="file with one position per line, - for stdin")
+    parser.add_argument("--engine", choices=ENGINES, default="alphabeta")
+    parser.add_argument("--depth", type=int, help="fixed search depth (minimax, online and bitboard engines)")
+    parser.add_argument("--playouts", type=int, help="fixed number of playouts (montecarlo engine)")
+    parser.add_argument("--time", type=float, default=1.0, help="seconds per position otherwise, and at most with --playouts")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--stats", action="store_true", help="add the search statistics to every result")
+    args = parser.parse_args()
+
+    lines = sys.stdin if args.input == "-" else open(args.input)
+    with lines:
+        for result in analyze_positions(lines, args.engine, args.depth, args.playouts, args.time, args.workers, args.stats):
+            print(json.dumps(result), flush=True)
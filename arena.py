@@ -0,0 +1,208 @@
+import argparse
+import json
+import math
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+from base_game import create_board, get_valid_columns, get_next_open_row, drop_piece, check_for_win_at
+from analyze import ENGINES, PLAYER_PIECE, AI_PIECE, analyze_position, init_worker
+
+# A file that holds the headless arena: two engine configurations play each other with no input() loop.
+#
+# An engine configuration is written "engine:key=value,...", for example "alphabeta:depth=6",
+# "montecarlo:playouts=5000" or "bitboard:time=0.2". The keys are the search limits of
+# analyze.analyze_position (depth, playouts, time). Every random opening is played twice so both
+# configurations get to move first in it. An engine that fails to return a move loses the game.
+
+Z_95 = 1.96 # Normal quantile of a two-sided 95% confidence interval
+
+def parse_engine(spec:str) -> Tuple[str, dict]:
+    """ Split "engine:key=value,..." into the engine name and analyze_position() limits """
+    engine, _, options = spec.partition(":")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, choose from {', '.join(ENGINES)}")
+    limits = {}
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition("=")
+        if key in ("depth", "playouts"):
+            limits[key] = int(value)
+        elif key == "time":
+            limits["time_budget"] = float(value)
+        else:
+            raise ValueError(f"Unknown option {key} in {spec}, use depth, playouts or time")
+    return engine, limits
+
+def random_openings(num_openings:int, plies:int, seed:int=0) -> List[str]:
+    """ Distinct random move sequences of `plies` moves that do not end the game """
+    rng = np.random.default_rng(seed)
+    openings = []
+    attempts = 0
+    while len(openings) < num_openings:
+        attempts += 1
+        board = create_board()
+        moves = ""
+        for ply in range(plies):
+            col = int(rng.choice(list(get_valid_columns(board))))
+            piece = PLAYER_PIECE if ply % 2 == 0 else AI_PIECE
+            row = get_next_open_row(board, col)
+            board = drop_piece(board, row, col, piece)
+            moves += str(col + 1)
+            if check_for_win_at(board, row, col):
+                break
+        else:
+            # Allow repeats only once the small opening trees run out of new lines
+            if moves not in openings or attempts > 100 * num_openings:
+                openings.append(moves)
+    return openings
+
+def init_arena(engines:Tuple[str, str]) -> None:
+    """ Import and compile both engines in a worker process """
+    for engine in set(engines):
+        init_worker(engine)
+
+def play_game(opening:str, specs:Tuple[str, str], first:int) -> dict:
+    """ Play one game from an opening
+
+    Args:
+        opening (str): moves played before the engines take over
+        specs (Tuple[str, str]): the two engine configurations
+        first (int): index in specs of the engine that moves after the opening
+
+    Returns:
+        dict: opening, first, all moves, score of specs[0] (1, 0.5 or 0) and, per engine,
+              move times, nodes and forfeits
+    """
+    configs = [parse_engine(spec) for spec in specs]
+    board = create_board()
+    for ply, char in enumerate(opening):
+        col = int(char) - 1
+        board = drop_piece(board, get_next_open_row(board, col), col, PLAYER_PIECE if ply % 2 == 0 else AI_PIECE)
+
+    moves = opening
+    stats = [{"times": [], "nodes": 0, "forfeits": 0} for _ in specs]
+    turn = first
+    score = 0.5
+    while len(moves) < 42:
+        engine, limits = configs[turn]
+        result = analyze_position(moves, engine, **limits)
+        if "error" in result:
+            stats[turn]["forfeits"] += 1
+            score = 0.0 if turn == 0 else 1.0
+            break
+        stats[turn]["times"].append(result["time"])
+        stats[turn]["nodes"] += result["nodes"]
+
+        col = result["move"] - 1
+        piece = PLAYER_PIECE if len(moves) % 2 == 0 else AI_PIECE
+        row = get_next_open_row(board, col)
+        board = drop_piece(board, row, col, piece)
+        moves += str(col + 1)
+        if check_for_win_at(board, row, col):
+            score = 1.0 if turn == 0 else 0.0
+            break
+        turn = 1 - turn
+    return {"opening": opening, "first": first, "moves": moves, "score": score, "stats": stats}
+
+def play_game_worker(args:tuple) -> dict:
+    """ play_game() with its arguments packed, for pool.map() """
+    return play_game(*args)
+
+def elo_difference(score:float) -> float:
+    """ Elo difference that predicts this expected score """
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+def summarize(specs:Tuple[str, str], games:List[dict]) -> dict:
+    """ Results of specs[0] against specs[1] and the cost of each configuration
+
+    Args:
+        specs (Tuple[str, str]): the two engine configurations
+        games (List[dict]): play_game() results
+
+    Returns:
+        dict: wins, draws, losses, score and Elo with 95% confidence intervals, and per engine the
+              move time percentiles (seconds), nodes per second and forfeits
+    """
+    scores = np.array([game["score"] for game in games])
+    mean = scores.mean()
+    # Normal approximation of the score; the per game variance already includes the draws
+    margin = Z_95 * scores.std() / math.sqrt(len(scores))
+    summary = {
+        "games": len(games),
+        "wins": int(np.count_nonzero(scores == 1)),
+        "draws": int(np.count_nonzero(scores == 0.5)),
+        "losses": int(np.count_nonzero(scores == 0)),
+        "score": round(float(mean), 4),
+        "score_interval": [round(float(max(mean - margin, 0)), 4), round(float(min(mean + margin, 1)), 4)],
+        "elo": round(elo_difference(mean), 1),
+        "elo_interval": [round(elo_difference(mean - margin), 1), round(elo_difference(mean + margin), 1)],
+        "engines": {},
+    }
+    for i, spec in enumerate(specs):
+        times = np.array([t for game in games for t in game["stats"][i]["times"]])
+        nodes = sum(game["stats"][i]["nodes"] for game in games)
+        summary["engines"][spec] = {
+            "moves": len(times),
+            "latency_p50": round(float(np.percentile(times, 50)), 4) if len(times) else None,
+            "latency_p90": round(float(np.percentile(times, 90)), 4) if len(times) else None,
+            "latency_p99": round(float(np.percentile(times, 99)), 4) if len(times) else None,
+            "nodes_per_second": round(nodes / max(times.sum(), 1e-9)) if len(times) else None,
+            "forfeits": sum(game["stats"][i]["forfeits"] for game in games),
+        }
+    return summary
+
+def run_match(specs:Tuple[str, str], num_games:int, opening_plies:int=4, seed:int=0,
+              workers:int=os.cpu_count() or 1) -> dict:
+    """ Play a match in a pool of worker processes
+
+    Args:
+        specs (Tuple[str, str]): the two engine configurations, see parse_engine()
+        num_games (int): number of games, rounded up to an even number (each opening is played twice)
+        opening_plies (int): random moves before the engines take over
+        seed (int): seed of the openings
+        workers (int): number of processes; 1 plays in this process
+
+    Returns:
+        dict: see summarize()
+    """
+    engines = tuple(parse_engine(spec)[0] for spec in specs)
+    openings = random_openings((num_games + 1) // 2, opening_plies, seed)
+    tasks = [(opening, specs, first) for opening in openings for first in (0, 1)]
+    if workers <= 1:
+        init_arena(engines)
+        games = list(map(play_game_worker, tasks))
+    else:
+        with ProcessPoolExecutor(workers, initializer=init_arena, initargs=(engines,)) as pool:
+            games = list(pool.map(play_game_worker, tasks))
+    return summarize(specs, games)
+
+def print_summary(specs:Tuple[str, str], summary:dict) -> None:
+    """ Print a match summary for people """
+    print(f"{specs[0]} vs {specs[1]}: {summary['games']} games")
+    print(f"+{summary['wins']} ={summary['draws']} -{summary['losses']}, "
+          f"score {summary['score']:.1%} (95% CI {summary['score_interval'][0]:.1%} - {summary['score_interval'][1]:.1%})")
+    print(f"Elo difference: {summary['elo']:+.0f} (95% CI {summary['elo_interval'][0]:+.0f} - {summary['elo_interval'][1]:+.0f})")
+    for spec, cost in summary["engines"].items():
+        print(f"{spec}: {cost['moves']} moves, latency p50/p90/p99 {cost['latency_p50']}/{cost['latency_p90']}/"
+              f"{cost['latency_p99']} sec, {cost['nodes_per_second']} nodes/sec, {cost['forfeits']} forfeits")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play two Connect 4 engine configurations against each other.")
+    parser.add_argument("engine1", help='engine configuration, e.g. "alphabeta:depth=6"')
+    parser.add_argument("engine2", help='engine configuration, e.g. "montecarlo:playouts=5000"')
+    parser.add_argument("--games", type=int, default=20, help="number of games (even)")
+    parser.add_argument("--opening", type=int, default=4, help="random plies before the engines take over")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random openings")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    specs = (args.engine1, args.engine2)
+    for spec in specs:
+        parse_engine(spec)
+    summary = run_match(specs, args.games, args.opening, args.seed, args.workers)
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print_summary(specs, summary)
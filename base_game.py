@@ -8,6 +8,33 @@ from colorama import Fore
 
 # A file that holds all the shared base game functions.
 
+# The window weights of score_window() for the bitboard evaluators:
+# [4 own, 3 own + 1 empty, 2 own + 2 empty, 4 opponent, 3 opponent + 1 empty, 2 opponent + 2 empty]
+SCORE_WEIGHTS = np.array([100, 24, 12, 100, 12, 6], dtype=np.int64)
+
+def _build_lines() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ The cells of all 69 lines of 4 on a 6x7 board, and the lines through every cell
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: rows and columns of each line's 4 cells (69x4 each),
+            and per [row, col] the indices of the lines through it, padded with -1 (6x7x16)
+    """
+    lines = []
+    for row in range(6):
+        for col in range(7):
+            for d_row, d_col in ((0, 1), (1, 0), (1, 1), (-1, 1)): # Same order as bitboard.WINDOW_MASKS
+                if 0 <= row + 3 * d_row < 6 and col + 3 * d_col < 7:
+                    lines.append([(row + i * d_row, col + i * d_col) for i in range(4)])
+    line_cells = np.array(lines, dtype=np.int64)
+    cell_lines = np.full((6, 7, 16), -1, dtype=np.int64)
+    for row in range(6):
+        for col in range(7):
+            through = [line for line in range(len(lines)) if (row, col) in lines[line]]
+            cell_lines[row, col, :len(through)] = through
+    return np.ascontiguousarray(line_cells[:, :, 0]), np.ascontiguousarray(line_cells[:, :, 1]), cell_lines
+
+LINE_ROWS, LINE_COLS, CELL_LINES = _build_lines()
+
 def create_board() -> np.ndarray:
     return np.zeros((6, 7))
 
@@ -16,12 +43,12 @@ def drop_piece(board:np.ndarray, row:int, col:int, piece:int) -> np.ndarray:
     board[row, col] = piece
     return board
 
-@njit
+@njit(cache=True)
 def is_valid_column(board:np.ndarray, col:int) -> bool:
     """ Check if this is column is not full """
     return board[6 - 1, col] == 0
 
-@njit
+@njit(cache=True)
 def get_valid_columns(board:np.ndarray) -> List[int]:
     """ Get a list of all non-full columns """
     valid_locations = []
@@ -30,7 +57,7 @@ def get_valid_columns(board:np.ndarray) -> List[int]:
             valid_locations.append(col)
     return typed.List(valid_locations)
 
-@njit
+@njit(cache=True)
 def get_next_open_row(board:np.ndarray, col:int) -> int:
     """ Get the next open row index in this column """
     for row in range(6):
@@ -38,37 +65,39 @@ def get_next_open_row(board:np.ndarray, col:int) -> int:
             return row
     return -1
 
-@njit
+@njit(cache=True)
 def check_for_win(board:np.ndarray, piece:int) -> bool:
-    """ Check for 4 in a row with brute force """
-    # check horizontal locations for a win
-    for r in range(6):
-        for c in range(7 - 3):
-            if board[r, c] == piece and board[r, c + 1] == piece and board[r, c + 2] == piece and board[r, c + 3] == piece:
-                return True
-    
-    # check vertical locations for a win
-    for r in range(6 - 3):
-        for c in range(7):
-            if board[r, c] == piece and board[r + 1, c] == piece and board[r + 2, c] == piece and board[r + 3, c] == piece:
-                return True
-
-    # check positively sloped diagonals
-    for r in range(6 - 3):        
-        for c in range(7 - 3):
-            if board[r, c] == piece and board[r + 1, c + 1] == piece and board[r + 2, c + 2] == piece and board[r + 3, c + 3] == piece:
-                return True
-
-    # check negatively sloped diagonals
-    for r in range(3, 6):
-        for c in range(7 - 3):
-            if board[r, c] == piece and board[r - 1, c + 1] == piece and board[r - 2, c + 2] == piece and board[r - 3, c + 3] == piece:
-                return True
+    """ Check every line of the board for 4 in a row """
+    for line in range(LINE_ROWS.shape[0]):
+        if line_is_complete(board, line, piece):
+            return True
+    return False
+
+@njit(cache=True)
+def check_for_win_at(board:np.ndarray, row:int, col:int) -> bool:
+    """ Check if the piece at [row, col] is part of 4 in a row; after a move only its lines can have changed """
+    piece = board[row, col]
+    if piece == 0:
+        return False
+    for i in range(CELL_LINES.shape[2]):
+        line = CELL_LINES[row, col, i]
+        if line < 0:
+            break
+        if line_is_complete(board, line, piece):
+            return True
     return False
 
-@njit
+@njit(cache=True)
+def line_is_complete(board:np.ndarray, line:int, piece:int) -> bool:
+    """ Check if all 4 cells of a line hold the piece """
+    for i in range(4):
+        if board[LINE_ROWS[line, i], LINE_COLS[line, i]] != piece:
+            return False
+    return True
+
+@njit(cache=True)
 def evaluate_position(board:np.ndarray, piece:int) -> int:
-    """ Calculate the score of the current board state by brute force
+    """ Calculate the score of the current board state over every line
 
     Args:
         board (np.ndarray): game board
@@ -78,51 +107,37 @@ def evaluate_position(board:np.ndarray, piece:int) -> int:
         int: the score of the current board state
     """
     score = 0
-
-    # Score horizontal
-    for r in range(6):
-        row_array = [int(i) for i in list(board[r, :])]
-        for c in range(7 - 3):
-            window = row_array[c: c + 4]
-            score += score_window(window, piece)
-
-    # Score vertical
-    for c in range(7):
-        col_array = [int(i) for i in list(board[:, c])]
-        for r in range(6 - 3):
-            window = col_array[r: r + 4]
-            score += score_window(window, piece)
-
-    # Score positive diagonal
-    for r in range(6 - 3):
-        for c in range(7 - 3):
-            window = [board[r + i, c + i] for i in range(4)]
-            score += score_window(window, piece)
-
-    # Score negative diagonal
-    for r in range(6 - 3):
-        for c in range(7 - 3):
-            window = [board[r + 3 - i, c + i] for i in range(4)]
-            score += score_window(window, piece)
+    opponent_piece = piece % 2 + 1
+    for line in range(LINE_ROWS.shape[0]):
+        num_offense = 0
+        num_defense = 0
+        for i in range(4):
+            cell = board[LINE_ROWS[line, i], LINE_COLS[line, i]]
+            if cell == piece:
+                num_offense += 1
+            elif cell == opponent_piece:
+                num_defense += 1
+        score += score_counts(num_offense, num_defense)
     return score
 
-@njit
+@njit(cache=True)
 def score_window(window:List[int], piece:int) -> int:
     """ Quantify a 4 block window
 
     Args:
-        window (List[int]): [description]
-        piece (int): [description]
+        window (List[int]): a 4 block window
+        piece (int): the player being scored
 
     Returns:
-        int: [description]
+        int: the score of this window
     """
-    score = 0
-    opponent_piece = piece % 2 + 1
+    return score_counts(window.count(piece), window.count(piece % 2 + 1))
 
-    num_offense = window.count(piece)
-    num_defense = window.count(opponent_piece)
-    num_empty = window.count(0)
+@njit(cache=True)
+def score_counts(num_offense:int, num_defense:int) -> int:
+    """ Score of a window holding num_offense of the scored player's pieces and num_defense of the opponent's """
+    score = 0
+    num_empty = 4 - num_offense - num_defense
 
     if num_offense == 4:
         score += 100
@@ -137,11 +152,9 @@ def score_window(window:List[int], piece:int) -> int:
         score -= 12
     elif num_defense == 2 and num_empty == 2:
         score -= 6
-    return score 
-
-
+    return score
 
-def pretty_print_board(gridboard, rounds, depth, node_count, computation_time, endgame):
+def pretty_print_board(gridboard, rounds, depth, node_count, computation_time, endgame, stats=None):
 
     #clear console/terminal screen
     os.system('cls' if os.name == 'nt' else 'clear')
@@ -149,6 +162,9 @@ def pretty_print_board(gridboard, rounds, depth, node_count, computation_time, e
     print(f"AI search depth: {depth}")
     print(f"Nodes searched: {node_count}")
     print(f"Computation time: {computation_time} sec")
+    if stats:
+        for label, value in stats.items():
+            print(f"{label}: {value}")
     if endgame:
         print(endgame)
     #emptyLocations = 42 - np.count_nonzero(self.gridboard) #get empty locations
@@ -0,0 +1,63 @@
+import numpy as np
+from numba import njit, prange
+from bitboard import WIDTH, HEIGHT, WINDOW_MASKS, popcount
+from incremental_evaluation import window_score_table
+from base_game import LINE_ROWS, LINE_COLS
+
+# A file that holds the batch evaluators: the window score of many boards at once.
+#
+# Both give the same score as base_game.evaluate_position() and bitboard.evaluate(), but for a
+# whole array of positions per call. evaluate_boards() works on (N, 6, 7) arrays with NumPy
+# gathers through WINDOW_CELLS, the lines of base_game flattened; evaluate_bitboards() works on
+# arrays of bitboards and spreads the boards over threads with prange. The window scores come from
+# the same 5x5 table as the incremental evaluator, so the rules live in one place.
+#
+# Searches keep the incremental evaluator, which scores a leaf in a few lookups. These are for
+# callers that already hold many positions, such as a frontier layer or a batch analysis job.
+
+# For every line of 4, its cells as indices into a flattened 6x7 board
+WINDOW_CELLS = LINE_ROWS * WIDTH + LINE_COLS
+
+def evaluate_boards(boards:np.ndarray, piece:int, weights:np.ndarray) -> np.ndarray:
+    """ Score a stack of boards by brute force, vectorized over every board and window
+
+    Args:
+        boards (np.ndarray): (N, 6, 7) boards, or one (6, 7) board
+        piece (int): the player being scored (human or AI)
+        weights (np.ndarray): window weights, see incremental_evaluation.window_score_table()
+
+    Returns:
+        np.ndarray: N scores (int64)
+    """
+    cells = boards.reshape(-1, HEIGHT * WIDTH)[:, WINDOW_CELLS] # (N, 69, 4)
+    num_offense = np.count_nonzero(cells == piece, axis=2)
+    num_defense = np.count_nonzero(cells == piece % 2 + 1, axis=2)
+    return window_score_table(weights)[num_offense, num_defense].sum(axis=1)
+
+def boards_to_bitboards(boards:np.ndarray, piece:int) -> tuple:
+    """ Convert (N, 6, 7) boards to bitboards: the stones of `piece` and every stone """
+    bits = np.uint64(1) << (7 * np.arange(WIDTH, dtype=np.uint64)[None, :] + np.arange(HEIGHT, dtype=np.uint64)[:, None])
+    boards = boards.reshape(-1, HEIGHT, WIDTH)
+    own = np.bitwise_or.reduce(np.where(boards == piece, bits, np.uint64(0)).reshape(len(boards), -1), axis=1)
+    mask = np.bitwise_or.reduce(np.where(boards != 0, bits, np.uint64(0)).reshape(len(boards), -1), axis=1)
+    return own, mask
+
+@njit(parallel=True, cache=True)
+def evaluate_bitboards(own:np.ndarray, opponent:np.ndarray, table:np.ndarray) -> np.ndarray:
+    """ Score arrays of bitboard positions, one thread per chunk of boards
+
+    Args:
+        own (np.ndarray): uint64 stones of the player being scored, one per board
+        opponent (np.ndarray): uint64 stones of the other player
+        table (np.ndarray): 5x5 window scores from incremental_evaluation.window_score_table()
+
+    Returns:
+        np.ndarray: one score per board (int64)
+    """
+    scores = np.zeros(own.shape[0], dtype=np.int64)
+    for n in prange(own.shape[0]):
+        score = 0
+        for w in range(WINDOW_MASKS.shape[0]):
+            score += table[popcount(own[n] & WINDOW_MASKS[w]), popcount(opponent[n] & WINDOW_MASKS[w])]
+        scores[n] = score
+    return scores
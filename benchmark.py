@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import numba
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+import warmup # Prefers the OpenMP threading layer: TBB, started by the batch evaluators, hangs the exit after forking
+from base_game import check_for_win, evaluate_position, SCORE_WEIGHTS
+from batch_evaluation import evaluate_boards, evaluate_bitboards, boards_to_bitboards
+from incremental_evaluation import window_score_table
+from analyze import ENGINES, parse_position, analyze_position, init_worker
+
+# A file that holds the benchmark suite: fixed positions searched at fixed depths by every engine.
+#
+# Every engine runs in its own fresh process, so the peak memory of one engine does not hide in another's.
+# Per position and depth it records the node count, the time to finish that depth and the effective
+# branching factor (nodes of this depth / nodes of the previous depth). Times include the per position
+# set-up of the engine, such as a fresh transposition table, like analyze.py. The board helpers of base_game
+# are timed on their own because every array based caller depends on them.
+
+# Curated positions as move sequences (columns 1-7), none of them decided yet
+POSITIONS = {
+    "opening": ["", "4", "44", "4453"],
+    "midgame": ["755756621327", "71461614633262", "7444544766553742"],
+    "endgame": ["62751141147467654424327112", "757263415652427724765516412464", "7665365576333216613774727531242115"],
+}
+
+# Deepest fixed depth per engine (montecarlo uses playouts instead of depths)
+DEPTHS = {"basic": 6, "alphabeta": 9, "online": 9, "bitboard": 6}
+PLAYOUTS = [1000, 10000, 50000]
+
+HELPER_REPEATS = 2000 # Calls per board for the base_game helpers
+
+def peak_memory() -> int:
+    """ Peak resident set size of this process in bytes """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # Linux reports kilobytes
+
+def benchmark_engine(engine:str, max_depth:int) -> dict:
+    """ Search every position at every depth (or playout count) with one engine
+
+    Args:
+        engine (str): one of analyze.ENGINES
+        max_depth (int): deepest depth for the depth limited engines
+
+    Returns:
+        dict: per phase and position a list of {depth or playouts, nodes, time, nodes_per_second,
+              branching_factor}, the totals and the peak memory of the process
+    """
+    t1 = time.time()
+    init_worker(engine)
+    results = {"engine": engine, "warmup_time": round(time.time() - t1, 4), "phases": {}}
+    total_nodes = 0
+    total_time = 0.0
+    for phase, positions in POSITIONS.items():
+        results["phases"][phase] = {}
+        for moves in positions:
+            runs = []
+            limits = [{"playouts": n} for n in PLAYOUTS] if engine == "montecarlo" else \
+                     [{"depth": d} for d in range(1, max_depth + 1)]
+            for limit in limits:
+                result = analyze_position(moves, engine, **limit)
+                if "error" in result:
+                    runs.append({**limit, "error": result["error"]})
+                    continue
+                run = {**limit, "nodes": result["nodes"], "time": result["time"], "move": result["move"],
+                       "nodes_per_second": round(result["nodes"] / max(result["time"], 1e-9))}
+                if runs and "depth" in limit and runs[-1].get("nodes"):
+                    run["branching_factor"] = round(result["nodes"] / runs[-1]["nodes"], 2)
+                runs.append(run)
+                total_nodes += result["nodes"]
+                total_time += result["time"]
+            results["phases"][phase][moves] = runs
+    results["total_nodes"] = total_nodes
+    results["total_time"] = round(total_time, 4)
+    results["nodes_per_second"] = round(total_nodes / max(total_time, 1e-9))
+    results["peak_memory"] = peak_memory()
+    return results
+
+def benchmark_helpers() -> dict:
+    """ Calls per second of base_game.check_for_win and base_game.evaluate_position over all positions,
+    and boards per second of the batch evaluators on all of them stacked HELPER_REPEATS times """
+    boards = [parse_position(moves) for positions in POSITIONS.values() for moves in positions]
+    check_for_win(boards[0], 1) # Compile
+    evaluate_position(boards[0], 2)
+    results = {}
+    for name, function in (("check_for_win", check_for_win), ("evaluate_position", evaluate_position)):
+        t1 = time.perf_counter()
+        for board in boards:
+            for _ in range(HELPER_REPEATS):
+                function(board, 2)
+        elapsed = time.perf_counter() - t1
+        results[name] = {"calls": len(boards) * HELPER_REPEATS,
+                         "calls_per_second": round(len(boards) * HELPER_REPEATS / elapsed)}
+
+    stacked = np.repeat(np.array(boards), HELPER_REPEATS, axis=0)
+    own, mask = boards_to_bitboards(stacked, 2)
+    table = window_score_table(SCORE_WEIGHTS)
+    evaluate_bitboards(own[:1], (own ^ mask)[:1], table) # Compile
+    for name, function in (("evaluate_boards", lambda: evaluate_boards(stacked, 2, SCORE_WEIGHTS)),
+                           ("evaluate_bitboards", lambda: evaluate_bitboards(own, own ^ mask, table))):
+        t1 = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - t1
+        results[name] = {"calls": len(stacked), "calls_per_second": round(len(stacked) / elapsed)}
+    return results
+
+def run_benchmark(engines:List[str], depths:dict=DEPTHS) -> dict:
+    """ Benchmark the base_game helpers and every engine, each engine in a fresh process
+
+    Args:
+        engines (List[str]): engines to run
+        depths (dict): deepest fixed depth per engine
+
+    Returns:
+        dict: environment, helpers and one benchmark_engine() result per engine
+    """
+    results = {
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "numba": numba.__version__,
+                        "machine": platform.machine(), "cpus": os.cpu_count()},
+        "helpers": benchmark_helpers(),
+        "engines": {},
+    }
+    for engine in engines:
+        with ProcessPoolExecutor(1) as pool:
+            results["engines"][engine] = pool.submit(benchmark_engine, engine, depths.get(engine, 0)).result()
+    return results
+
+def print_results(results:dict) -> None:
+    """ Print a summary table for people """
+    for name, helper in results["helpers"].items():
+        print(f"{name}: {helper['calls_per_second']} calls/sec")
+    for engine, result in results["engines"].items():
+        print('')
+        print(f"{engine}: {result['nodes_per_second']} nodes/sec, {result['total_time']} sec, "
+              f"peak memory {result['peak_memory'] // 2**20} MiB, warm-up {result['warmup_time']} sec")
+        for phase, positions in result["phases"].items():
+            for moves, runs in positions.items():
+                cells = []
+                for run in runs:
+                    limit = f"d{run['depth']}" if "depth" in run else f"{run['playouts']}p"
+                    cells.append(f"{limit}: error" if "error" in run else f"{limit}: {run['time']}s")
+                print(f"  {phase:8} {moves or '(empty)':36} {'  '.join(cells)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Connect 4 engines on fixed positions.")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    parser.add_argument("--depth", type=int, help="deepest fixed depth for every depth limited engine")
+    parser.add_argument("--output", default="benchmark_results.json", help="file for the JSON results")
+    args = parser.parse_args()
+
+    depths = DEPTHS if args.depth is None else {engine: args.depth for engine in DEPTHS}
+    results = run_benchmark(args.engines, depths)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print_results(results)
+    print('')
+    print(f"Results written to {args.output}")
@@ -0,0 +1,250 @@
+import numpy as np
+from typing import Tuple
+from numba import njit
+
+# A file that holds the bitboard core shared by every numba engine.
+#
+# The layout is the same as Connect4-Bitboard/game_state.State: 7 bits per column,
+# bit index = 7 * col + row, row 0 at the bottom and row 6 an always empty sentinel.
+#
+#    6 13 20 27 34 41 48
+#    5 12 19 26 33 40 47
+#    4 11 18 25 32 39 46
+#    3 10 17 24 31 38 45
+#    2  9 16 23 30 37 44
+#    1  8 15 22 29 36 43
+#    0  7 14 21 28 35 42
+#
+# A position is two uint64 numbers: `position` holds the stones of the side to move
+# and `mask` holds every stone on the board. The opponent's stones are position ^ mask.
+
+WIDTH = 7
+HEIGHT = 6
+
+BOTTOM_MASK = np.uint64(sum(1 << (7 * col) for col in range(WIDTH)))
+BOARD_MASK = np.uint64(int(BOTTOM_MASK) * ((1 << HEIGHT) - 1))
+
+# Favor middle columns to be better (same order as base_game.get_valid_columns)
+MOVE_ORDER = np.array([3, 4, 2, 5, 1, 6, 0], dtype=np.int64)
+
+def _build_window_masks() -> np.ndarray:
+    """ Build one mask per 4 block window (69 windows on a 6x7 board) """
+    windows = []
+    for row in range(HEIGHT):
+        for col in range(WIDTH):
+            for d_row, d_col in ((0, 1), (1, 0), (1, 1), (-1, 1)):
+                end_row = row + 3 * d_row
+                end_col = col + 3 * d_col
+                if 0 <= end_row < HEIGHT and end_col < WIDTH:
+                    windows.append(sum(1 << (7 * (col + i * d_col) + row + i * d_row) for i in range(4)))
+    return np.array(windows, dtype=np.uint64)
+
+WINDOW_MASKS = _build_window_masks()
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+@njit(cache=True)
+def popcount(bitboard:np.uint64) -> int:
+    """ Count the set bits of a bitboard """
+    x = bitboard - ((bitboard >> np.uint64(1)) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return int((x * _H01) >> np.uint64(56))
+
+@njit(cache=True)
+def bottom_mask(col:int) -> np.uint64:
+    """ The bottom cell of a column """
+    return np.uint64(1) << np.uint64(7 * col)
+
+@njit(cache=True)
+def top_mask(col:int) -> np.uint64:
+    """ The top playable cell of a column """
+    return np.uint64(1) << np.uint64(7 * col + HEIGHT - 1)
+
+@njit(cache=True)
+def column_mask(col:int) -> np.uint64:
+    """ All playable cells of a column """
+    return np.uint64((1 << HEIGHT) - 1) << np.uint64(7 * col)
+
+@njit(cache=True)
+def can_play(mask:np.uint64, col:int) -> bool:
+    """ Check if this column is not full """
+    return (mask & top_mask(col)) == 0
+
+@njit(cache=True)
+def legal_moves(mask:np.uint64) -> np.uint64:
+    """ The cell each non-full column would play into, as one bitboard """
+    return (mask + BOTTOM_MASK) & BOARD_MASK
+
+@njit(cache=True)
+def column_height(mask:np.uint64, col:int) -> int:
+    """ Number of stones in a column, i.e. the row the next stone lands on """
+    return popcount(mask & column_mask(col))
+
+@njit(cache=True)
+def play(position:np.uint64, mask:np.uint64, col:int) -> Tuple[np.uint64, np.uint64]:
+    """ Drop a stone for the side to move. The returned position belongs to the opponent. """
+    return position ^ mask, mask | (mask + bottom_mask(col))
+
+@njit(cache=True)
+def undo(position:np.uint64, mask:np.uint64, col:int) -> Tuple[np.uint64, np.uint64]:
+    """ Take back the top stone of a column, reversing play() """
+    stones = mask & column_mask(col)
+    last_stone = (stones + bottom_mask(col)) >> np.uint64(1)
+    mask ^= last_stone
+    return position ^ mask, mask
+
+@njit(cache=True)
+def is_win(bitboard:np.uint64) -> bool:
+    """ Check for 4 in a row with shifts """
+    # Horizontal
+    m = bitboard & (bitboard >> np.uint64(7))
+    if m & (m >> np.uint64(14)):
+        return True
+    # Diagonal \
+    m = bitboard & (bitboard >> np.uint64(6))
+    if m & (m >> np.uint64(12)):
+        return True
+    # Diagonal /
+    m = bitboard & (bitboard >> np.uint64(8))
+    if m & (m >> np.uint64(16)):
+        return True
+    # Vertical
+    m = bitboard & (bitboard >> np.uint64(1))
+    if m & (m >> np.uint64(2)):
+        return True
+    return False
+
+@njit(cache=True)
+def is_full(mask:np.uint64) -> bool:
+    """ Check if every column is full """
+    return mask == BOARD_MASK
+
+def from_array(board:np.ndarray, piece:int) -> Tuple[np.uint64, np.uint64]:
+    """ Convert a 6x7 board (row 0 at the bottom) to bitboards.
+    Not jitted on purpose: numba would hand the bitboards back as python ints.
+
+    Args:
+        board (np.ndarray): game board
+        piece (int): the player whose stones go into `position`
+
+    Returns:
+        Tuple[np.uint64, np.uint64]: position, mask
+    """
+    position = 0
+    mask = 0
+    for r in range(HEIGHT):
+        for c in range(WIDTH):
+            if board[r, c] != 0:
+                bit = 1 << (7 * c + r)
+                mask |= bit
+                if board[r, c] == piece:
+                    position |= bit
+    return np.uint64(position), np.uint64(mask)
+
+@njit(cache=True)
+def evaluate(own:np.uint64, opponent:np.uint64, weights:np.ndarray) -> int:
+    """ Score every 4 block window of a bitboard position
+
+    Args:
+        own (np.uint64): stones of the player being scored
+        opponent (np.uint64): stones of the other player
+        weights (np.ndarray): [4 own, 3 own + 1 empty, 2 own + 2 empty,
+                               4 opponent, 3 opponent + 1 empty, 2 opponent + 2 empty]
+
+    Returns:
+        int: the score of the position
+    """
+    score = 0
+    for i in range(WINDOW_MASKS.shape[0]):
+        window = WINDOW_MASKS[i]
+        num_offense = popcount(own & window)
+        num_defense = popcount(opponent & window)
+        num_empty = 4 - num_offense - num_defense
+
+        if num_offense == 4:
+            score += weights[0]
+        elif num_offense == 3 and num_empty == 1:
+            score += weights[1]
+        elif num_offense == 2 and num_empty == 2:
+            score += weights[2]
+
+        if num_defense == 4:
+            score -= weights[3]
+        elif num_defense == 3 and num_empty == 1:
+            score -= weights[4]
+        elif num_defense == 2 and num_empty == 2:
+            score -= weights[5]
+    return score
+
+@njit(cache=True)
+def winning_cells(position:np.uint64, mask:np.uint64) -> np.uint64:
+    """ Empty cells (playable now or later) that would give `position` 4 in a row """
+    # Vertical
+    r = (position << np.uint64(1)) & (position << np.uint64(2)) & (position << np.uint64(3))
+
+    # Horizontal and both diagonals
+    for shift in (7, 6, 8):
+        s1 = np.uint64(shift)
+        s2 = np.uint64(2 * shift)
+        s3 = np.uint64(3 * shift)
+        p = (position << s1) & (position << s2)
+        r |= p & (position << s3)
+        r |= p & (position >> s1)
+        p = (position >> s1) & (position >> s2)
+        r |= p & (position << s1)
+        r |= p & (position >> s3)
+    return r & (BOARD_MASK ^ mask)
+
+@njit(cache=True)
+def can_win_next(position:np.uint64, mask:np.uint64) -> bool:
+    """ Check if the side to move has a winning column """
+    return (winning_cells(position, mask) & legal_moves(mask)) != 0
+
+@njit(cache=True)
+def winning_column(position:np.uint64, mask:np.uint64) -> int:
+    """ A column (in MOVE_ORDER) where the side to move wins at once, -1 if there is none """
+    wins = winning_cells(position, mask) & legal_moves(mask)
+    for col in MOVE_ORDER:
+        if wins & column_mask(col):
+            return col
+    return -1
+
+@njit(cache=True)
+def non_losing_moves(position:np.uint64, mask:np.uint64) -> np.uint64:
+    """ The playable cells that neither leave an opponent win open nor play under one.
+    Zero when every move loses. Assumes the side to move cannot win at once. """
+    possible = legal_moves(mask)
+    opponent_wins = winning_cells(position ^ mask, mask)
+    forced = possible & opponent_wins
+    if forced:
+        if forced & (forced - np.uint64(1)): # More than one threat to block
+            return np.uint64(0)
+        possible = forced
+    return possible & ~(opponent_wins >> np.uint64(1))
+
+@njit(cache=True)
+def mirror(bitboard:np.uint64) -> np.uint64:
+    """ Flip a bitboard left to right """
+    result = np.uint64(0)
+    column = np.uint64(0x7F)
+    for col in range(WIDTH):
+        bits = (bitboard >> np.uint64(7 * col)) & column
+        result |= bits << np.uint64(7 * (WIDTH - 1 - col))
+    return result
+
+def from_moves(moves:str) -> Tuple[np.uint64, np.uint64]:
+    """ Convert a move sequence such as "4453" (columns 1-7) to bitboards of the side to move """
+    position, mask = np.uint64(0), np.uint64(0)
+    for char in moves:
+        col = int(char) - 1
+        if not 0 <= col < WIDTH or not can_play(mask, col):
+            raise ValueError(f"Invalid move {char} in {moves}")
+        position, mask = play(position, mask, col)
+        position, mask = np.uint64(position), np.uint64(mask)
+        if is_win(position ^ mask):
+            raise ValueError(f"The game is already won before the end of {moves}")
+    return position, mask
@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+import threading
+import time
+import numpy as np
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+from analyze import ENGINES, parse_position, analyze_worker
+from arena import init_arena
+from search_stats import SearchStats, prometheus_text
+
+# A file that holds the move service: the engines behind a local HTTP API instead of the input() loops.
+#
+#   POST /move     {"position": "4453", "engine": "alphabeta", "time": 0.5}
+#                  -> {"position": "4453", "engine": "alphabeta", "move": 3, "score": 24, "nodes": 8391,
+#                      "depth": 7, "time": 0.5, "source": "search"}
+#   POST /move     [request, request, ...] -> [answer, answer, ...], searched side by side
+#   GET  /metrics  request counts, cache and coalescing hits, queue depth, latency percentiles and the
+#                  search statistics of every engine (see search_stats.py); ?format=prometheus for
+#                  the Prometheus text format
+#
+# A request is one position of analyze.parse_position() (moves or a JSON board) for one of
+# analyze.ENGINES, limited by "depth" (minimax, online and bitboard engines, up to MAX_DEPTH), "playouts"
+# (montecarlo, up to MAX_PLAYOUTS) or "time" in seconds, which also bounds a playout count. The answer is analyze.analyze_position()'s, so it means the same as a line of
+# analyze.py output, plus where it came from: a new search, a search already running for the same
+# position and budget (coalesced), or the cache of recent answers. The positions are compared as
+# boards, so a move sequence and the JSON array of the same board share their answer. "stats": true
+# adds the search statistics of the answer's search.
+# A bad request is answered with status 400 and a failed search with 500, each with an "error";
+# a batch is answered with 200 and the errors inside its answers.
+#
+# Every worker process imports and compiles all engines when the pool starts (see arena.init_arena),
+# so no request pays for compiling. The service speaks plain HTTP from the standard library; a client
+# that wants to stream requests keeps the connection alive instead of opening a WebSocket.
+
+MAX_TIME = 10.0 # Longest time budget a request may ask for, in seconds
+# Deepest fixed depth a request may ask for, by engine: each finishes on an empty board in about MAX_TIME
+MAX_DEPTH = {"basic": 9, "alphabeta": 16, "online": 13, "bitboard": 11}
+MAX_PLAYOUTS = 5000000 # Most montecarlo playouts a request may ask for, also about MAX_TIME on an empty board
+MAX_BATCH = 64 # Most requests in one POST
+LATENCY_WINDOW = 1000 # Latency percentiles are over this many recent requests
+
+def parse_request(request:dict) -> Tuple[str, str, Optional[int], Optional[int], float]:
+    """ Check one request and return the arguments of analyze.analyze_position()
+
+    Raises:
+        ValueError: the request is not a legal position, engine and budget
+    """
+    if not isinstance(request, dict):
+        raise ValueError("A request must be a JSON object")
+    position = request.get("position", "")
+    text = json.dumps(position) if isinstance(position, list) else str(position)
+    engine = request.get("engine", "alphabeta")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, choose from {', '.join(ENGINES)}")
+    depth = request.get("depth")
+    playouts = request.get("playouts")
+    time_budget = request.get("time", 1.0)
+    # bool is a subclass of int, so true and false must be turned away on their own
+    if depth is not None and (not isinstance(depth, int) or isinstance(depth, bool) or depth < 1 or engine == "montecarlo"):
+        raise ValueError("depth must be a positive integer, for the minimax, online and bitboard engines")
+    if depth is not None and depth > MAX_DEPTH[engine]:
+        raise ValueError(f"depth must be at most {MAX_DEPTH[engine]} for the {engine} engine")
+    if playouts is not None and (not isinstance(playouts, int) or isinstance(playouts, bool) or playouts < 1 or engine != "montecarlo"):
+        raise ValueError("playouts must be a positive integer, for the montecarlo engine")
+    if playouts is not None and playouts > MAX_PLAYOUTS:
+        raise ValueError(f"playouts must be at most {MAX_PLAYOUTS}")
+    if not isinstance(time_budget, (int, float)) or isinstance(time_budget, bool) or not 0 < time_budget <= MAX_TIME:
+        raise ValueError(f"time must be a number of seconds up to {MAX_TIME}")
+    parse_position(text)
+    return text, engine, depth, playouts, float(time_budget)
+
+def request_key(text:str, engine:str, depth:Optional[int], playouts:Optional[int], time_budget:float) -> tuple:
+    """ Requests with equal keys get the same answer: the same board, engine and budget """
+    board = parse_position(text)
+    # A fixed depth is the whole budget; the time matters without one, and also bounds a playout count
+    return board.tobytes(), engine, depth, playouts, time_budget if depth is None else None
+
+class MoveService:
+    """ The warm worker pool with request coalescing, a cache of recent answers and metrics """
+
+    def __init__(self, workers:int=os.cpu_count() or 1, cache_size:int=1024):
+        """
+        Args:
+            workers (int): search processes; 1 searches in a thread of this process
+            cache_size (int): number of recent answers kept
+        """
+        if workers <= 1:
+            self.pool = ThreadPoolExecutor(1, initializer=init_arena, initargs=(ENGINES,))
+        else:
+            self.pool = ProcessPoolExecutor(workers, initializer=init_arena, initargs=(ENGINES,))
+        self.workers = workers
+        self.cache_size = cache_size
+        self.cache = OrderedDict() # Request key -> answer, least recently used first
+        self.searching = {} # Request key -> Future of the search every equal request waits for
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counts = {"requests": 0, "searches": 0, "cache_hits": 0, "coalesced": 0, "errors": 0}
+        self.search_stats = {} # Engine -> SearchStats of all its searches
+        self.started = time.time()
+
+    def warm_up(self) -> None:
+        """ Block until every worker has compiled the engines """
+        for future in [self.pool.submit(time.sleep, 0) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, request:dict) -> Tuple[Future, str]:
+        """ Start answering one request
+
+        Returns:
+            Tuple[Future, str]: the future answer and its source: "cache", "coalesced" or "search"
+
+        Raises:
+            ValueError: see parse_request()
+        """
+        args = parse_request(request)
+        key = request_key(*args)
+        with self.lock:
+            self.counts["requests"] += 1
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.counts["cache_hits"] += 1
+                future = Future()
+                future.set_result(self.cache[key])
+                return future, "cache"
+            if key in self.searching:
+                self.counts["coalesced"] += 1
+                return self.searching[key], "coalesced"
+            self.counts["searches"] += 1
+            future = self.pool.submit(analyze_worker, (*args, True)) # Statistics are always collected for the metrics
+            self.searching[key] = future
+        future.add_done_callback(lambda future: self.finish(key, future))
+        return future, "search"
+
+    def finish(self, key:tuple, future:Future) -> None:
+        """ A search is done: stop coalescing on it, cache its answer and add up its statistics """
+        with self.lock:
+            self.searching.pop(key, None)
+            if future.cancelled(): # By shutdown(), before it started; exception() would raise
+                return
+            if future.exception() is None and "error" not in future.result():
+                result = future.result()
+                self.cache[key] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                if "stats" in result:
+                    stats = SearchStats.from_dict(result["stats"])
+                    engine = result["engine"]
+                    self.search_stats[engine] = self.search_stats[engine] + stats if engine in self.search_stats else stats
+
+    def answer(self, requests:List[dict]) -> List[Tuple[int, dict]]:
+        """ Answer some requests, searching them side by side
+
+        Returns:
+            List[Tuple[int, dict]]: one HTTP status and answer per request, in order: 200 and
+                analyze.analyze_position()'s result and its source, 400 and the request's position and
+                what is wrong with it, or 500 and the request's position and why its search failed
+        """
+        t1 = time.time()
+        started = []
+        for request in requests:
+            try:
+                started.append(self.submit(request))
+            except Exception as error: # ValueError: a bad request; anything else: a broken pool
+                started.append(error)
+        answers = []
+        for request, item in zip(requests, started):
+            position = request.get("position") if isinstance(request, dict) else None
+            if isinstance(item, ValueError):
+                status, answer = 400, {"position": position, "error": str(item)}
+            elif isinstance(item, Exception):
+                status, answer = 500, {"position": position, "error": f"Search failed: {item!r}"}
+            else:
+                future, source = item
+                try:
+                    result = future.result()
+                except Exception as error: # The worker raised, or its process died
+                    status, answer = 500, {"position": position, "error": f"Search failed: {error!r}"}
+                else:
+                    status = 400 if "error" in result else 200
+                    answer = dict(result, source=source)
+                    answer["position"] = position # A shared answer may have been asked with another notation
+                    if not request.get("stats"):
+                        answer.pop("stats", None)
+            if "error" in answer:
+                with self.lock:
+                    self.counts["errors"] += 1
+            answers.append((status, answer))
+        with self.lock:
+            self.latencies.extend([time.time() - t1] * len(requests))
+        return answers
+
+    def metrics(self) -> dict:
+        """ Counts since the start (requests are the valid ones, errors include the invalid ones),
+        queue depth and latency percentiles (seconds) of recent requests """
+        with self.lock:
+            latencies = np.array(self.latencies)
+            metrics = dict(self.counts)
+            metrics["queue_depth"] = len(self.searching) # Searches queued or running
+            metrics["cache_size"] = len(self.cache)
+        metrics["workers"] = self.workers
+        metrics["uptime"] = round(time.time() - self.started, 1)
+        metrics["latency_p50"] = round(float(np.percentile(latencies, 50)), 4) if len(latencies) else None
+        metrics["latency_p99"] = round(float(np.percentile(latencies, 99)), 4) if len(latencies) else None
+        with self.lock:
+            metrics["search"] = {engine: stats.to_dict() for engine, stats in self.search_stats.items()}
+        return metrics
+
+    def prometheus_metrics(self) -> str:
+        """ metrics() in the Prometheus text format """
+        metrics = self.metrics()
+        lines = []
+        for name, kind, help_text in (("requests", "counter", "Valid move requests"),
+                                      ("searches", "counter", "Requests that started a search"),
+                                      ("cache_hits", "counter", "Requests answered from the cache"),
+                                      ("coalesced", "counter", "Requests that shared a running search"),
+                                      ("errors", "counter", "Requests answered with an error"),
+                                      ("queue_depth", "gauge", "Searches queued or running"),
+                                      ("latency_p50", "gauge", "Median seconds per request, recent requests"),
+                                      ("latency_p99", "gauge", "99th percentile seconds per request, recent requests")):
+            if metrics[name] is not None:
+                metric = f"connect4_service_{name}_total" if kind == "counter" else f"connect4_service_{name}"
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}", f"{metric} {metrics[name]}"]
+        with self.lock:
+            samples = [({"engine": engine}, stats) for engine, stats in self.search_stats.items()]
+        return "\n".join(lines) + "\n" + prometheus_text(samples)
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(cancel_futures=True)
+
+class MoveHandler(BaseHTTPRequestHandler):
+    """ HTTP front of a MoveService, set as the class attribute `service` """
+    service = None
+    protocol_version = "HTTP/1.1" # Keep-alive, so a client can send many requests over one connection
+
+    def send_json(self, status:int, body) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.send_json(200, self.service.metrics())
+        elif self.path == "/metrics?format=prometheus":
+            data = self.service.prometheus_metrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.send_json(404, {"error": "Not found, use POST /move or GET /metrics"})
+
+    def do_POST(self):
+        if self.path != "/move":
+            self.send_json(404, {"error": "Not found, use POST /move or GET /metrics"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+        except ValueError:
+            self.send_json(400, {"error": "The body must be JSON"})
+            return
+        batch = isinstance(body, list)
+        requests = body if batch else [body]
+        if not requests or len(requests) > MAX_BATCH:
+            self.send_json(400, {"error": f"Send between 1 and {MAX_BATCH} requests"})
+            return
+        answers = self.service.answer(requests)
+        if batch:
+            self.send_json(200, [answer for _, answer in answers]) # Each answer carries its own error, if any
+        else:
+            self.send_json(*answers[0])
+
+    def log_message(self, format, *args):
+        pass # The metrics count the requests, one line per request would flood the terminal
+
+def serve(host:str="127.0.0.1", port:int=8004, workers:int=os.cpu_count() or 1, cache_size:int=1024) -> None:
+    """ Warm up the engines and serve until interrupted """
+    service = MoveService(workers, cache_size)
+    t1 = time.time()
+    service.warm_up()
+    print(f"Engines ready in {time.time() - t1:.2f} sec, serving on http://{host}:{port}")
+    MoveHandler.service = service
+    server = ThreadingHTTPServer((host, port), MoveHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve Connect 4 engine moves over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8004, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--cache", type=int, default=1024, help="number of recent answers kept")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.cache)
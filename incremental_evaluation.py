@@ -0,0 +1,102 @@
+import numpy as np
+from typing import Tuple
+from numba import njit
+from bitboard import WINDOW_MASKS, popcount
+
+# A file that holds the incremental evaluation used by the minimax engines.
+#
+# The evaluator keeps the number of stones of each side in every 4 block window and the
+# running score of bitboard.evaluate(). Dropping or removing a stone only updates the windows
+# through that cell (at most 13), so scoring a leaf is a lookup instead of a rescan of all 69.
+
+OWN = 0 # The side being scored
+OPPONENT = 1
+
+def _build_cell_windows() -> np.ndarray:
+    """ For every bit index, the windows through that cell, padded with -1 """
+    cell_windows = np.full((49, 16), -1, dtype=np.int64)
+    for bit in range(49):
+        windows = [w for w in range(len(WINDOW_MASKS)) if int(WINDOW_MASKS[w]) >> bit & 1]
+        cell_windows[bit, :len(windows)] = windows
+    return cell_windows
+
+CELL_WINDOWS = _build_cell_windows()
+
+def window_score_table(weights:np.ndarray) -> np.ndarray:
+    """ Score of a window by [own stones, opponent stones], the same rules as base_game.score_window
+
+    Args:
+        weights (np.ndarray): [4 own, 3 own + 1 empty, 2 own + 2 empty,
+                               4 opponent, 3 opponent + 1 empty, 2 opponent + 2 empty]
+
+    Returns:
+        np.ndarray: 5x5 table of window scores
+    """
+    table = np.zeros((5, 5), dtype=np.int64)
+    for num_offense in range(5):
+        for num_defense in range(5 - num_offense):
+            num_empty = 4 - num_offense - num_defense
+            score = 0
+            if num_offense == 4:
+                score += weights[0]
+            elif num_offense == 3 and num_empty == 1:
+                score += weights[1]
+            elif num_offense == 2 and num_empty == 2:
+                score += weights[2]
+
+            if num_defense == 4:
+                score -= weights[3]
+            elif num_defense == 3 and num_empty == 1:
+                score -= weights[4]
+            elif num_defense == 2 and num_empty == 2:
+                score -= weights[5]
+            table[num_offense, num_defense] = score
+    return table
+
+def create_evaluator(own:np.uint64, opponent:np.uint64, weights:np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Count every window of a position once; searches then keep it up to date
+
+    Args:
+        own (np.uint64): stones of the player being scored
+        opponent (np.uint64): stones of the other player
+        weights (np.ndarray): window weights, see window_score_table()
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: window counts, score table, running score
+    """
+    counts = np.zeros((2, len(WINDOW_MASKS)), dtype=np.int64)
+    for w in range(len(WINDOW_MASKS)):
+        counts[OWN, w] = popcount(own & WINDOW_MASKS[w])
+        counts[OPPONENT, w] = popcount(opponent & WINDOW_MASKS[w])
+    table = window_score_table(weights)
+    score = np.array([table[counts[OWN, w], counts[OPPONENT, w]] for w in range(len(WINDOW_MASKS))]).sum()
+    return counts, table, np.array([score], dtype=np.int64)
+
+@njit(cache=True)
+def add_stone(evaluator, bit:int, side:int) -> None:
+    """ Update the windows through cell `bit` for a stone of OWN or OPPONENT """
+    counts, table, score = evaluator
+    for i in range(CELL_WINDOWS.shape[1]):
+        w = CELL_WINDOWS[bit, i]
+        if w < 0:
+            break
+        old = table[counts[OWN, w], counts[OPPONENT, w]]
+        counts[side, w] += 1
+        score[0] += table[counts[OWN, w], counts[OPPONENT, w]] - old
+
+@njit(cache=True)
+def remove_stone(evaluator, bit:int, side:int) -> None:
+    """ Reverse add_stone() """
+    counts, table, score = evaluator
+    for i in range(CELL_WINDOWS.shape[1]):
+        w = CELL_WINDOWS[bit, i]
+        if w < 0:
+            break
+        old = table[counts[OWN, w], counts[OPPONENT, w]]
+        counts[side, w] -= 1
+        score[0] += table[counts[OWN, w], counts[OPPONENT, w]] - old
+
+@njit(cache=True)
+def current_score(evaluator) -> int:
+    """ The score bitboard.evaluate() would return for the current position """
+    return evaluator[2][0]
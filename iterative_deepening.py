@@ -0,0 +1,70 @@
+import numpy as np
+import threading
+from typing import Callable, Iterator, Tuple
+
+# A file that holds the iterative deepening driver shared by the minimax engines.
+#
+# The numba searches are compiled with nogil=True and poll a one element `stop` array at every node.
+# A timer thread raises the flag at the deadline, the search unwinds without storing anything,
+# and the result of the last completed depth is played.
+
+def new_stop_flag() -> np.ndarray:
+    """ The flag a search polls; stop[0] != 0 means abort """
+    return np.zeros(1, dtype=np.int8)
+
+def iterative_deepening(search:Callable, time_budget:float, max_depth:int, win_score:int=None) -> Tuple[int, int, int, int]:
+    """ Search depth 1, 2, 3... until the time budget runs out
+
+    Args:
+        search (Callable): search(depth, stop) -> (best_column, best_score, node_count)
+        time_budget (float): seconds until the running iteration is aborted
+        max_depth (int): deepest iteration, usually the number of empty cells
+        win_score (int): stop deepening once abs(score) reaches this (the game is decided)
+
+    Returns:
+        Tuple[int, int, int, int]: best_column, best_score, node_count, completed_depth
+    """
+    stop = new_stop_flag()
+    timer = threading.Timer(time_budget, stop.fill, (1,))
+    timer.start()
+    node_count = 0
+    try:
+        # Depth 1 always completes so there is a move to play
+        col, score, nodes = search(1, new_stop_flag())
+        node_count += nodes
+        completed_depth = 1
+        for depth in range(2, max_depth + 1):
+            if stop[0] or (win_score is not None and abs(score) >= win_score):
+                break
+            iteration_col, iteration_score, nodes = search(depth, stop)
+            node_count += nodes
+            if stop[0]: # The iteration was cut short, its result is meaningless
+                break
+            col, score = iteration_col, iteration_score
+            completed_depth = depth
+    finally:
+        timer.cancel()
+    return col, score, node_count, completed_depth
+
+def deepening(search:Callable, max_depth:int, win_score:int=None, stop:np.ndarray=None) -> Iterator[Tuple[int, int, int, int]]:
+    """ Iterative deepening without a time budget, one depth per step, for pondering.Ponder
+
+    Args:
+        search (Callable): search(depth, stop) -> (best_column, best_score, node_count)
+        max_depth (int): deepest iteration, usually the number of empty cells
+        win_score (int): stop deepening once abs(score) reaches this (the game is decided)
+        stop (np.ndarray): abort flag; an aborted depth is never yielded
+
+    Yields:
+        Tuple[int, int, int, int]: best_column, best_score, node_count, completed_depth after every depth
+    """
+    stop = new_stop_flag() if stop is None else stop
+    node_count = 0
+    for depth in range(1, max_depth + 1):
+        col, score, nodes = search(depth, stop)
+        node_count += nodes
+        if stop[0]:
+            return
+        yield col, score, node_count, depth
+        if win_score is not None and abs(score) >= win_score:
+            return
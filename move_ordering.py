@@ -0,0 +1,101 @@
+import numpy as np
+from typing import Tuple
+from numba import njit
+from bitboard import WIDTH, MOVE_ORDER, bottom_mask, column_mask, winning_cells, popcount
+
+# A file that holds the dynamic move ordering of the alpha beta searches.
+#
+# Moves are searched in this order: the transposition table move, immediate wins, forced blocks,
+# then the rest by the number of threats (cells that would complete 4) they create, the killer moves
+# of their ply and the history heuristic. Ties keep the center first MOVE_ORDER.
+#
+# Killers and history live for one search (one AI move). Each ply has its own row of the move buffer,
+# so ordering a node never allocates.
+
+MAX_PLY = 43 # Stones on the board at a node, 0 - 42
+KILLER_SLOTS = 2
+
+TT_SCORE = 1 << 60
+WIN_SCORE = 1 << 59
+BLOCK_SCORE = 1 << 58
+THREAT_WEIGHT = 1 << 40
+KILLER_SCORES = (1 << 36, 1 << 35) # By killer slot
+HISTORY_LIMIT = 1 << 33 # History scores are halved past this to stay below the killers
+
+def create_ordering() -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ Fresh killers, history and per ply move buffers for one search
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: killers[ply, slot] (columns, -1 when empty),
+            history[side, bit], moves[ply, 7] and their scores[ply, 7]
+    """
+    killers = np.full((MAX_PLY, KILLER_SLOTS), -1, dtype=np.int64)
+    history = np.zeros((2, 7 * WIDTH), dtype=np.int64)
+    moves = np.zeros((MAX_PLY, WIDTH), dtype=np.int64)
+    scores = np.zeros((MAX_PLY, WIDTH), dtype=np.int64)
+    return killers, history, moves, scores
+
+@njit(cache=True)
+def order_moves(ordering, position:np.uint64, mask:np.uint64, allowed:np.uint64, side:int, tt_move:int) -> int:
+    """ Sort the allowed columns of a node into moves[ply], best first
+
+    Args:
+        ordering (Tuple): see create_ordering()
+        position (np.uint64): bitboard of the side to move
+        mask (np.uint64): bitboard of every stone on the board
+        allowed (np.uint64): the playable cells to order, e.g. bitboard.non_losing_moves()
+        side (int): history row of the side to move (0 or 1)
+        tt_move (int): column stored in the transposition table, -1 for none
+
+    Returns:
+        int: number of moves written to moves[ply], where ply = stones on the board
+    """
+    killers, history, moves, scores = ordering
+    ply = popcount(mask)
+    own_wins = winning_cells(position, mask)
+    opponent_wins = winning_cells(position ^ mask, mask)
+
+    num_moves = 0
+    for col in MOVE_ORDER:
+        cell = (mask + bottom_mask(col)) & column_mask(col) & allowed
+        if not cell:
+            continue
+        if col == tt_move:
+            score = TT_SCORE
+        elif cell & own_wins:
+            score = WIN_SCORE
+        elif cell & opponent_wins:
+            score = BLOCK_SCORE
+        else:
+            score = popcount(winning_cells(position | cell, mask | cell)) * THREAT_WEIGHT
+            for slot in range(KILLER_SLOTS):
+                if killers[ply, slot] == col:
+                    score += KILLER_SCORES[slot]
+            score += history[side, 7 * col + popcount(mask & column_mask(col))]
+
+        # Insertion sort, stable so equal scores keep MOVE_ORDER
+        i = num_moves
+        while i > 0 and scores[ply, i - 1] < score:
+            moves[ply, i] = moves[ply, i - 1]
+            scores[ply, i] = scores[ply, i - 1]
+            i -= 1
+        moves[ply, i] = col
+        scores[ply, i] = score
+        num_moves += 1
+    return num_moves
+
+@njit(cache=True)
+def record_cutoff(ordering, mask:np.uint64, side:int, col:int, depth:int) -> None:
+    """ Remember a column that caused a beta cutoff at this ply, weighted by the remaining depth """
+    killers, history, moves, scores = ordering
+    ply = popcount(mask)
+    if killers[ply, 0] != col:
+        killers[ply, 1] = killers[ply, 0]
+        killers[ply, 0] = col
+
+    bit = 7 * col + popcount(mask & column_mask(col))
+    history[side, bit] += depth * depth
+    if history[side, bit] > HISTORY_LIMIT:
+        for s in range(2):
+            for b in range(history.shape[1]):
+                history[s, b] //= 2
@@ -0,0 +1,116 @@
+import json
+import os
+import pathlib
+import numpy as np
+from typing import List
+
+# A file that holds the board observer of the online game.
+#
+# Everything the AI needs from the page (the board, whose turn it is and the game end message) is read
+# by one script that runs inside the browser, instead of downloading the page source and parsing it
+# with BeautifulSoup once per question. Waiting for the human is event driven: a MutationObserver in
+# the page wakes the AI as soon as the DOM changes, instead of polling every half second.
+#
+# The selectors follow connect-4.org. stand_in/index.html is a local copy of its board with a scripted
+# opponent, so the client can be run and its response time measured without the real site.
+
+HUMAN_TURN_TEXT = "It's your opponent's turn" # Shown to the AI while the human is to move
+OUTCOMES = {"You Won": "won", "You Lost": "lost", "Draw": "draw"} # Game end messages, as seen by the AI
+
+# Defines snapshot(): the board rows top to bottom (0 empty, 1 red human, 2 blue AI), the turn text and the end message
+SNAPSHOT_SCRIPT = """
+function snapshot() {
+    const board = [];
+    for (const row of document.querySelectorAll("tr.ng-star-inserted")) {
+        board.push(Array.from(row.querySelectorAll("td"), cell => {
+            const div = cell.querySelector("div");
+            const html = div ? div.outerHTML : "";
+            if (!html.includes("background-color")) return 0;
+            return html.includes("red") ? 1 : html.includes("blue") ? 2 : 0;
+        }));
+    }
+    const turn = document.querySelector("div.current-turn-container p");
+    const end = document.querySelector("app-game-end mat-card-content p");
+    return JSON.stringify({board: board, turn: turn ? turn.textContent : "", end: end ? end.textContent : ""});
+}
+"""
+
+READ_SCRIPT = SNAPSHOT_SCRIPT + "return snapshot();"
+
+# Resolves with the first snapshot that differs from arguments[0], or with the unchanged one after arguments[1] ms
+WAIT_SCRIPT = SNAPSHOT_SCRIPT + """
+const previous = arguments[0];
+const done = arguments[arguments.length - 1];
+const current = snapshot();
+if (current !== previous) {
+    done(current);
+} else {
+    const observer = new MutationObserver(() => {
+        const changed = snapshot();
+        if (changed !== previous) {
+            observer.disconnect();
+            clearTimeout(timer);
+            done(changed);
+        }
+    });
+    const timer = setTimeout(() => { observer.disconnect(); done(previous); }, arguments[1]);
+    observer.observe(document.body, {subtree: true, childList: true, attributes: true, characterData: true});
+}
+"""
+
+CLICK_SCRIPT = 'document.querySelectorAll("table.center-table tr")[arguments[0]].querySelectorAll("td")[arguments[1]].click();'
+
+def to_state(snapshot:str) -> dict:
+    """ Turn a page snapshot into the board (row 0 at the bottom), whose turn it is and the outcome """
+    page = json.loads(snapshot)
+    board = np.zeros((6, 7))
+    if len(page["board"]) == 6:
+        board = np.flip(np.array(page["board"], dtype=np.float64), axis=0)
+    return {"board": board,
+            "ready": len(page["board"]) == 6,
+            "human_turn": page["turn"].strip() == HUMAN_TURN_TEXT,
+            "outcome": OUTCOMES.get(page["end"].strip(), "continue"),
+            "snapshot": snapshot}
+
+def read_state(driver) -> dict:
+    """ The current state of the page, in one script call """
+    return to_state(driver.execute_script(READ_SCRIPT))
+
+def wait_for_change(driver, state:dict, timeout:float=30.0) -> dict:
+    """ Block until the page differs from `state`, or until the timeout
+
+    Args:
+        driver (WebDriver): browser showing the game
+        state (dict): the last state read, see read_state()
+        timeout (float): seconds to wait for a change
+
+    Returns:
+        dict: the new state, or the same state when nothing changed in time
+    """
+    driver.set_script_timeout(timeout + 5)
+    return to_state(driver.execute_async_script(WAIT_SCRIPT, state["snapshot"], int(timeout * 1000)))
+
+def wait_until_ready(driver, timeout:float=30.0) -> dict:
+    """ Wait for the page to draw its board """
+    state = read_state(driver)
+    while not state["ready"]:
+        state = wait_for_change(driver, state, timeout)
+    return state
+
+def click_cell(driver, row:int, col:int) -> None:
+    """ Click a cell of the board; `row` counts from the top like the page's table """
+    driver.execute_script(CLICK_SCRIPT, row, col)
+
+def stand_in_url(first:str="human", delay:int=300) -> str:
+    """ URL of the local stand-in site
+
+    Args:
+        first (str): "human" or "ai", who moves first
+        delay (int): milliseconds the scripted human waits before each move
+    """
+    path = pathlib.Path(os.path.dirname(os.path.abspath(__file__)), "stand_in", "index.html")
+    return f"{path.as_uri()}?first={first}&delay={delay}"
+
+def stand_in_latencies(driver) -> List[float]:
+    """ Seconds from each hand over of the turn to the AI's click, as recorded by the stand-in site """
+    return [ms / 1000 for ms in driver.execute_script("return window.latencies || [];")]
@@ -0,0 +1,299 @@
+import argparse
+import json
+import os
+import threading
+import time
+import numpy as np
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+from iterative_deepening import iterative_deepening
+from bitboard import from_array
+from position_store import open_store, store_path, position_key
+from online_observer import wait_until_ready, wait_for_change, click_cell, stand_in_url, stand_in_latencies
+from play_online import is_valid_column, get_next_open_row, create_search, open_driver, warm_up
+
+# A file that holds the multi-room online bot: one process that plays many online games at once.
+#
+# Every room gets a thread and a browser of its own, which only talk to the page (see online_observer).
+# Searches are not run in the room threads: they go to one shared pool of worker processes, through a
+# SearchScheduler. It hands the workers out first come, first served and a room has at most one search
+# queued, so every room waiting for a move gets one before any room gets two. A search gets its time
+# budget when a worker frees up: whatever is left of `latency_target` after waiting, and no more than
+# its share when more rooms are waiting than there are workers, so a move still takes about
+# `latency_target` seconds under load instead of growing with the number of rooms.
+#
+# The search is play_online's minimax with iterative deepening; pondering is left out, since every
+# core already searches for some room. python online_rooms.py --stand-in 8 plays 8 local stand-in games.
+
+WIN_SCORE = 1000000 # Same as play_online.start_game(): stop deepening once the game is decided
+OUTCOMES = ("won", "lost", "draw") # Game results, as seen by the AI
+
+def search_board(board:np.ndarray, time_budget:float) -> Tuple[int, int]:
+    """ play_online's search for the AI to move on `board`, run in a worker
+
+    Returns:
+        Tuple[int, int]: best_column, completed_depth
+    """
+    col, _, _, depth = iterative_deepening(create_search(board), time_budget, 42 - np.count_nonzero(board), WIN_SCORE)
+    return col, depth
+
+class SearchScheduler:
+    """ Runs the searches of every room on one shared pool and keeps their latency bounded """
+
+    def __init__(self, pool:Executor, workers:int, time_budget:float=1.0, latency_target:float=2.0, min_budget:float=0.1):
+        """
+        Args:
+            pool (Executor): worker pool
+            workers (int): number of searches the pool runs at the same time
+            time_budget (float): seconds per search when the pool keeps up
+            latency_target (float): seconds a move may take, waiting for a worker included
+            min_budget (float): seconds per search however loaded the pool is
+        """
+        self.pool = pool
+        self.workers = workers
+        self.time_budget = time_budget
+        self.latency_target = latency_target
+        self.min_budget = min_budget
+        self.ready = threading.Condition()
+        self.next_ticket = 0 # Tickets are handed out and served in arrival order
+        self.serving = 0
+        self.waiting = 0
+        self.running = 0
+
+    @property
+    def pending(self) -> int:
+        """ Searches waiting for a worker or running """
+        return self.waiting + self.running
+
+    def budget(self, waited:float, pending:int) -> float:
+        """ Time budget of a search that waited `waited` seconds, when `pending` searches (itself included) share the workers """
+        # Whatever is left of the target, and no more than its share: the pending searches take
+        # about pending / workers budgets to get through the pool
+        share = self.latency_target * self.workers / pending
+        return min(self.time_budget, max(self.min_budget, min(self.latency_target - waited, share)))
+
+    def search(self, board:np.ndarray) -> Tuple[int, int, float]:
+        """ Search `board` in the pool, first come first served, and block the room until it is done
+
+        Returns:
+            Tuple[int, int, float]: best_column, completed_depth and the time budget it got
+        """
+        t1 = time.time()
+        with self.ready:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.waiting += 1
+            while ticket != self.serving or self.running == self.workers:
+                self.ready.wait()
+            self.serving += 1
+            self.waiting -= 1
+            self.running += 1
+            # The budget is set when a worker is free, so it knows how long this search waited
+            budget = self.budget(time.time() - t1, self.pending)
+            self.ready.notify_all()
+        try:
+            col, depth = self.pool.submit(search_board, board, budget).result()
+        finally:
+            with self.ready:
+                self.running -= 1
+                self.ready.notify_all()
+        return col, depth, budget
+
+class Room:
+    """ One online game room and what the bot measured in it """
+
+    def __init__(self, name:str, url:str):
+        self.name = name
+        self.url = url
+        self.latencies = [] # Seconds from seeing the AI's turn to the click
+        self.page_latencies = [] # The same, as measured by the stand-in site
+        self.depths = []
+        self.budgets = []
+        self.outcomes = {outcome: 0 for outcome in OUTCOMES}
+        self.error = None
+
+def play_room(room:Room, make_driver:Callable, scheduler:SearchScheduler, store, games:int) -> None:
+    """ Play `games` games in a room, one after the other, in the calling thread
+
+    Args:
+        room (Room): the room; its statistics are updated as the games go
+        make_driver (Callable): make_driver() -> WebDriver, one browser per room
+        scheduler (SearchScheduler): shared search pool
+        store (PositionStore): analyzed positions looked up before searching, or None
+        games (int): number of games to play
+    """
+    PLAYER_PIECE = 1
+    driver = None
+    try:
+        driver = make_driver()
+        for _ in range(games):
+            driver.get(room.url)
+            state = wait_until_ready(driver)
+            while True:
+                while state["human_turn"] and state["outcome"] == "continue":
+                    state = wait_for_change(driver, state) # Sleeps in the browser until the page changes
+                board = state["board"]
+                if state["outcome"] != "continue" or not any(is_valid_column(board, c) for c in range(7)):
+                    break
+
+                t1 = time.time()
+                position, mask = from_array(board, PLAYER_PIECE)
+                stored = store.lookup(position_key(position ^ mask, mask)) if store else None
+                if stored:
+                    col, _, depth = stored
+                    budget = 0.0
+                else:
+                    col, depth, budget = scheduler.search(board)
+                row = get_next_open_row(board, col)
+                click_cell(driver, board.shape[0] - 1 - row, col) # The page's table counts rows from the top
+                room.latencies.append(time.time() - t1)
+                room.depths.append(depth)
+                room.budgets.append(budget)
+
+                stones = np.count_nonzero(board)
+                while np.count_nonzero(state["board"]) <= stones or not (state["human_turn"] or state["outcome"] != "continue"):
+                    state = wait_for_change(driver, state) # Until the AI's piece is in and the turn has passed
+            outcome = state["outcome"] if state["outcome"] != "continue" else "draw"
+            room.outcomes[outcome] += 1
+            room.page_latencies += stand_in_latencies(driver)
+            print(f"Room {room.name}: game {sum(room.outcomes.values())} {outcome}")
+    except Exception as error: # One broken room must not stop the others
+        room.error = f"{type(error).__name__}: {error}"
+        print(f"Room {room.name}: stopped, {room.error}")
+    finally:
+        if driver is not None:
+            driver.quit()
+
+def latency_summary(latencies:List[float]) -> dict:
+    """ Percentiles and maximum of some move latencies, in seconds """
+    times = np.array(latencies)
+    if len(times) == 0:
+        return {"latency_p50": None, "latency_p90": None, "latency_p99": None, "latency_max": None}
+    return {"latency_p50": round(float(np.percentile(times, 50)), 4),
+            "latency_p90": round(float(np.percentile(times, 90)), 4),
+            "latency_p99": round(float(np.percentile(times, 99)), 4),
+            "latency_max": round(float(times.max()), 4)}
+
+def summarize(rooms:List[Room], elapsed:float) -> dict:
+    """ Throughput and latency of every room and of all rooms together
+
+    Args:
+        rooms (List[Room]): the rooms played
+        elapsed (float): seconds since the bot started
+
+    Returns:
+        dict: per room and in total the games, results, moves, moves per second, latency percentiles
+              (seconds), mean search depth and time budget; the stand-in's own latency measurements
+              when there are any, and each room's error
+    """
+    def stats(rooms:List[Room]) -> dict:
+        latencies = [t for room in rooms for t in room.latencies]
+        page_latencies = [t for room in rooms for t in room.page_latencies]
+        depths = [d for room in rooms for d in room.depths]
+        budgets = [b for room in rooms for b in room.budgets]
+        summary = {outcome: sum(room.outcomes[outcome] for room in rooms) for outcome in OUTCOMES}
+        summary["games"] = sum(summary[outcome] for outcome in OUTCOMES)
+        summary["moves"] = len(latencies)
+        summary["moves_per_second"] = round(len(latencies) / max(elapsed, 1e-9), 3)
+        summary.update(latency_summary(latencies))
+        summary["mean_depth"] = round(float(np.mean(depths)), 1) if depths else None
+        summary["mean_budget"] = round(float(np.mean(budgets)), 3) if budgets else None
+        if page_latencies:
+            summary["page_latency_p90"] = latency_summary(page_latencies)["latency_p90"]
+        return summary
+
+    summary = {"elapsed": round(elapsed, 2), "rooms": {}, "all": stats(rooms)}
+    for room in rooms:
+        summary["rooms"][room.name] = stats([room])
+        summary["rooms"][room.name]["error"] = room.error
+    return summary
+
+def print_summary(summary:dict) -> None:
+    """ Print a summarize() result for people """
+    def line(name:str, stats:dict) -> str:
+        text = (f"{name}: {stats['games']} games (+{stats['won']} ={stats['draw']} -{stats['lost']}), "
+                f"{stats['moves']} moves, {stats['moves_per_second']} moves/sec, latency p50/p90/p99/max "
+                f"{stats['latency_p50']}/{stats['latency_p90']}/{stats['latency_p99']}/{stats['latency_max']} sec, "
+                f"depth {stats['mean_depth']}, budget {stats['mean_budget']} sec")
+        if "page_latency_p90" in stats:
+            text += f", page latency p90 {stats['page_latency_p90']} sec"
+        if stats.get("error"):
+            text += f", stopped: {stats['error']}"
+        return text
+
+    for name, stats in summary["rooms"].items():
+        print(line(f"Room {name}", stats))
+    print(line(f"All {len(summary['rooms'])} rooms in {summary['elapsed']} sec", summary["all"]))
+
+def run_rooms(rooms:List[Room], make_driver:Callable, games:int=1, workers:int=os.cpu_count() or 1,
+              time_budget:float=1.0, latency_target:float=2.0, report_every:Optional[float]=10.0) -> dict:
+    """ Play every room at the same time, one thread per room and one shared search pool
+
+    Args:
+        rooms (List[Room]): the rooms to play
+        make_driver (Callable): make_driver() -> WebDriver, called once in every room's thread
+        games (int): games per room
+        workers (int): search processes; 1 searches in a thread of this process
+        time_budget (float): seconds per search when the pool keeps up
+        latency_target (float): seconds a move may take under load, see SearchScheduler
+        report_every (float): seconds between progress lines, None for none
+
+    Returns:
+        dict: see summarize()
+    """
+    # Each process compiles (or loads) the search once, before its first move
+    if workers <= 1:
+        pool = ThreadPoolExecutor(1, initializer=warm_up)
+    else:
+        pool = ProcessPoolExecutor(workers, initializer=warm_up)
+    scheduler = SearchScheduler(pool, workers, time_budget, latency_target)
+    warming = [pool.submit(time.sleep, 0) for _ in range(workers)] # Start the workers while the browsers start
+    store = open_store(store_path("online")) # From analyze.py --engine online: this search has its own SCORE_WEIGHTS and WIN_SCORE
+    t1 = time.time()
+    threads = [threading.Thread(target=play_room, args=(room, make_driver, scheduler, store, games), daemon=True)
+               for room in rooms]
+    for thread in threads:
+        thread.start()
+    for future in warming:
+        future.result()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(report_every)
+                if report_every and thread.is_alive():
+                    total = summarize(rooms, time.time() - t1)["all"]
+                    print(f"{time.time() - t1:.0f} sec: {total['games']} games, {total['moves']} moves, "
+                          f"{total['moves_per_second']} moves/sec, latency p90 {total['latency_p90']} sec, "
+                          f"{scheduler.pending} searches pending")
+    finally:
+        pool.shutdown(cancel_futures=True)
+    return summarize(rooms, time.time() - t1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play many online Connect 4 games at once from one process.")
+    parser.add_argument("rooms", nargs="*", help="4 digit connect-4.org game rooms")
+    parser.add_argument("--stand-in", type=int, default=0, metavar="N", help="also play N rooms of the local stand-in site")
+    parser.add_argument("--first", choices=["human", "ai"], default="human", help="who moves first on the stand-in site")
+    parser.add_argument("--delay", type=int, default=300, help="milliseconds the stand-in human thinks per move")
+    parser.add_argument("--games", type=int, default=1, help="games per room")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of search processes")
+    parser.add_argument("--time", type=float, default=1.0, help="seconds per search when the workers keep up")
+    parser.add_argument("--latency", type=float, default=2.0, help="seconds a move may take under load")
+    parser.add_argument("--report", type=float, default=10.0, help="seconds between progress lines")
+    parser.add_argument("--headless", action="store_true", help="run the browsers without windows")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    rooms = [Room(room, f"http://connect-4.org/?lb{room}") for room in args.rooms]
+    rooms += [Room(f"stand-in-{i + 1}", stand_in_url(args.first, args.delay)) for i in range(args.stand_in)]
+    if not rooms:
+        parser.error("give some game rooms or --stand-in N")
+    if not os.path.exists(f"{os.getcwd()}/chromedriver"):
+        parser.error("Chromedriver not found!")
+
+    summary = run_rooms(rooms, lambda: open_driver(args.headless), args.games, args.workers,
+                        args.time, args.latency, args.report)
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print_summary(summary)
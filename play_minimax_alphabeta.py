@@ -1,25 +1,43 @@
 import numpy as np
 import sys
 import time
-from typing import List, Tuple
-from numba import njit, typed
-from base_game import create_board, is_valid_column, get_valid_columns, \
-    get_next_open_row, drop_piece, check_for_win, pretty_print_board, \
-    evaluate_position
+from typing import Callable, List, Tuple
+from numba import njit
+from base_game import create_board, is_valid_column, get_next_open_row, \
+    drop_piece, check_for_win_at, pretty_print_board, SCORE_WEIGHTS
+from bitboard import MOVE_ORDER, can_play, column_height, popcount, play, is_full, from_array, \
+    winning_column, non_losing_moves
+from incremental_evaluation import OWN, OPPONENT, create_evaluator, add_stone, remove_stone, current_score
+from iterative_deepening import iterative_deepening, deepening, new_stop_flag
+from move_ordering import create_ordering, order_moves, record_cutoff
+from position_store import open_store, store_path, position_key
+from transposition_table import ZOBRIST_KEYS, ZOBRIST_SIDE, EXACT, LOWER_BOUND, UPPER_BOUND, PROBES, \
+    create_table, new_search, hit_rate, zobrist_hash, probe_table, store_table
+from warmup import Warmup, warm_up_base_game
+from search_stats import NODES, EXPANDED, CUTOFFS, FIRST_MOVE_CUTOFFS, LEAF_EVALS, TERMINALS, CACHE_HITS, CACHE_MISSES, \
+    count, create_stats, SearchStats
+from pondering import Ponder, reply_boards
 
 # The main file for playing minimax alphabeta AI.
 
-@njit
-def minimax_alphabeta(board:np.ndarray, depth:int, alpha:int, beta:int, maxTurn:bool, node_count:int) -> Tuple[int, int, int]:
-    """ Implementation of Minimax Alpha Beta Pruning
+@njit(nogil=True, cache=True)
+def minimax_alphabeta(position:np.uint64, mask:np.uint64, depth:int, alpha:int, beta:int, maxTurn:bool, node_count:int, key:np.uint64, table, evaluator, ordering, stop:np.ndarray, stats:np.ndarray) -> Tuple[int, int, int]:
+    """ Implementation of Minimax Alpha Beta Pruning with a transposition table
 
     Args:
-        board (np.ndarray): game board
+        position (np.uint64): bitboard of the side to move (the player on max turn, the AI on min turn)
+        mask (np.uint64): bitboard of every stone on the board
         depth (int): recursive search depth
         alpha (int): initialized as negative infinity
         beta (int): initialized as positive infinity
         maxTurn (bool): True if it's max turn; False if it's min turn
         node_count (int): The accumulator node_count
+        key (np.uint64): zobrist key of the board, updated as pieces are dropped
+        table (Tuple[np.ndarray, np.ndarray, np.ndarray]): the transposition table
+        evaluator (Tuple[np.ndarray, np.ndarray, np.ndarray]): incremental evaluation of the board, scored for the AI
+        ordering (Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]): killers, history and move buffers of this search
+        stop (np.ndarray): abort the search as soon as stop[0] is set
+        stats (np.ndarray): search statistics, counted by ply (see search_stats.py)
 
     Returns:
         Tuple[int, int, int]: best_column, best_score, node_count
@@ -31,75 +49,154 @@ def minimax_alphabeta(board:np.ndarray, depth:int, alpha:int, beta:int, maxTurn:
     TIE = -1
     AGING_PENALTY = 3
 
-    # First, check for possible winning move -> Stop recursing and return the minimax_alphabeta score
-    if check_for_win(board, PLAYER_PIECE):
-        score = WIN_SCORE + depth * AGING_PENALTY # If there are multiple win possibilites, choose the faster one.
-        return typed.List([0, score, node_count])
+    if stop[0]:
+        return 0, 0, node_count
+    ply = popcount(mask)
+    count(stats, ply, NODES)
 
-    if check_for_win(board, AI_PIECE):
-        score = -WIN_SCORE - depth * AGING_PENALTY # If there are multiple win possibilites, choose the faster one.
-        return typed.List([0, score, node_count])
+    # No win check: only the last move could have won, and the parent plays a winning move at
+    # once (see the tactics below) instead of searching it, so no node is ever reached after a win
 
     # If the board is full -> return tie
-    if len(get_valid_columns(board)) == 0:
-        return typed.List([0, TIE, node_count])
+    if is_full(mask):
+        count(stats, ply, TERMINALS)
+        return 0, TIE, node_count
 
     # If search depth == 0 -> Stop recursing and return the minimax_alphabeta score
     if depth == 0:
-        bestCol = get_valid_columns(board)[0]
-        return typed.List([bestCol, evaluate_position(board, AI_PIECE), node_count])
-    
+        bestCol = 0
+        for col in MOVE_ORDER:
+            if can_play(mask, col):
+                bestCol = col
+                break
+        count(stats, ply, LEAF_EVALS)
+        return bestCol, current_score(evaluator), node_count
+
+    # Tactics before expanding: win at once, else only the moves that do not hand the opponent a win
+    win_sign = 1 if maxTurn else -1
+    col = winning_column(position, mask)
+    if col >= 0:
+        count(stats, ply, TERMINALS)
+        return col, win_sign * (WIN_SCORE + (depth - 1) * AGING_PENALTY), node_count
+    allowed = non_losing_moves(position, mask)
+    if allowed == 0: # Every move lets the opponent win next turn
+        for col in MOVE_ORDER:
+            if can_play(mask, col):
+                break
+        count(stats, ply, TERMINALS)
+        return col, -win_sign * (WIN_SCORE + max(depth - 2, 0) * AGING_PENALTY), node_count
+
+    # Reuse the result of an earlier search of this position when it was searched at least as deep
+    found, tt_value, tt_depth, tt_flag, tt_move = probe_table(table, key)
+    count(stats, ply, CACHE_HITS if found else CACHE_MISSES)
+    if found and tt_depth >= depth:
+        if tt_flag == EXACT:
+            return tt_move, tt_value, node_count
+        elif tt_flag == LOWER_BOUND:
+            alpha = max(alpha, tt_value)
+        elif tt_flag == UPPER_BOUND:
+            beta = min(beta, tt_value)
+        if alpha >= beta:
+            return tt_move, tt_value, node_count
+    alpha_orig = alpha
+    beta_orig = beta
+
     if maxTurn:
+        piece = PLAYER_PIECE
+        side = OPPONENT
         value = -sys.maxsize
-        bestCol = 0
-        for col in get_valid_columns(board):
-            row = get_next_open_row(board, col)
-            temp_board = np.copy(board)
-            temp_board[row, col] = PLAYER_PIECE
-            _, score, node_count = minimax_alphabeta(temp_board, depth - 1, alpha, beta, False, node_count)
-            
+    else:
+        piece = AI_PIECE
+        side = OWN
+        value = sys.maxsize
+    bestCol = 0
+
+    # Stored best column, wins, blocks, then threats, killers and history
+    num_moves = order_moves(ordering, position, mask, allowed, side, tt_move)
+    count(stats, ply, EXPANDED)
+    for i in range(num_moves):
+        col = ordering[2][ply, i]
+        row = column_height(mask, col)
+        child_position, child_mask = play(position, mask, col)
+        child_key = key ^ ZOBRIST_KEYS[piece, row, col] ^ ZOBRIST_SIDE
+        add_stone(evaluator, 7 * col + row, side)
+        _, score, node_count = minimax_alphabeta(child_position, child_mask, depth - 1, alpha, beta, not maxTurn, node_count, child_key, table, evaluator, ordering, stop, stats)
+        remove_stone(evaluator, 7 * col + row, side)
+        if stop[0]: # Never store the result of an aborted search
+            return bestCol, 0, node_count
+
+        if maxTurn:
             if score > value:
                 value = score
                 bestCol = col
             alpha = max(alpha, value)
-            if alpha >= beta:
-                break
-        return typed.List([bestCol, value, node_count + 1])
-    
-    else:
-        value = sys.maxsize
-        bestCol = 0
-        for col in get_valid_columns(board):
-            row = get_next_open_row(board, col)
-            temp_board = np.copy(board)
-            temp_board[row, col] = AI_PIECE
-            _, score, node_count = minimax_alphabeta(temp_board, depth - 1, alpha, beta, True, node_count)
-    
+        else:
             if score < value:
                 value = score
                 bestCol = col
             beta = min(beta, value)
-            if alpha >= beta:
-                break
-        return typed.List([bestCol, value, node_count + 1])
+        if alpha >= beta:
+            record_cutoff(ordering, mask, side, col, depth)
+            count(stats, ply, CUTOFFS)
+            if i == 0:
+                count(stats, ply, FIRST_MOVE_CUTOFFS)
+            break
+
+    if value <= alpha_orig:
+        flag = UPPER_BOUND
+    elif value >= beta_orig:
+        flag = LOWER_BOUND
+    else:
+        flag = EXACT
+    store_table(table, key, value, depth, flag, bestCol)
+    return bestCol, value, node_count + 1
+
+def create_search(board:np.ndarray, table, stats:np.ndarray=None) -> Callable:
+    """ search(depth, stop) of the AI to move on `board`, with its own evaluator and move ordering,
+    counting into `stats` (a disabled table when None) """
+    PLAYER_PIECE = 1
+    key = zobrist_hash(board, True)
+    position, mask = from_array(board, PLAYER_PIECE)
+    evaluator = create_evaluator(position ^ mask, position, SCORE_WEIGHTS)
+    ordering = create_ordering()
+    stats = create_stats(False) if stats is None else stats
+    return lambda depth, stop: minimax_alphabeta(position, mask, depth, -sys.maxsize, sys.maxsize, True, 0, key, table, evaluator, ordering, stop, stats)
+
+def warm_up():
+    """ Compile the AI's numba functions on an empty board, see warmup.py """
+    warm_up_base_game()
+    board = create_board()
+    position, mask = from_array(board, 1)
+    evaluator = create_evaluator(position ^ mask, position, SCORE_WEIGHTS)
+    minimax_alphabeta(position, mask, 1, -sys.maxsize, sys.maxsize, True, 0, zobrist_hash(board, True), create_table(4),
+                      evaluator, create_ordering(), new_stop_flag(), create_stats())
 
 def start_game():
     """ 
     Initialize the game and play until the game is over.
     Human player goes first.
-    Starting search depth = 7 and increases on every 5th round.
-    Search depth is capped at 10.
+    The AI deepens its search one ply at a time until its time budget runs out.
+    The transposition table is kept for the whole game.
+    While the human thinks, the AI ponders every reply (see pondering.py).
     """
 
     PLAYER_PIECE = 1
     AI_PIECE = 2
     HUMAN_TURN = True
+    TIME_BUDGET = 1.0 # seconds per AI move
+    WIN_SCORE = 100000
 
     board = create_board()
     game_over = False
     rounds = 0
-    depth = 7
+    depth = 0
+    searched_depth = 0 # Depth of the last timed search, the bar for pondered results
     computation_time = 0
+    table = create_table()
+    store = open_store(store_path("alphabeta")) # Results of earlier batch analysis, if any
+    stats = None
+    ponder = None
+    warmup = Warmup(warm_up).start() # Compiles while the human picks the first move
 
     while not game_over:
         endgame = ''
@@ -110,31 +207,63 @@ def start_game():
                 row = get_next_open_row(board, col) 
                 board = drop_piece(board, row, col, PLAYER_PIECE)
 
-                if check_for_win(board, PLAYER_PIECE):
+                if check_for_win_at(board, row, col):
                     endgame = "Player 1 wins!"
                     game_over = True
 
         if not HUMAN_TURN:
             rounds += 1
+            compile_time = warmup.wait() # Only the first move can still be waiting
             t1 = time.time()
-            if rounds % 5 == 0 and depth < 10: # Cap the search depth at 10.
-                depth += 1
-            col, score, node_count = minimax_alphabeta(board, depth, -sys.maxsize, sys.maxsize, True, 0)
+            pondered = ponder.finish(col) if ponder else None # col is the human's move
+            new_search(table)
+            position, mask = from_array(board, PLAYER_PIECE)
+            stored = store.lookup(position_key(position ^ mask, mask)) if store else None
+            pondering = f"searched to depth {pondered[3]}" if pondered else "no result for this reply"
+            search_stats = None
+            if stored:
+                col, score, depth = stored
+                node_count = 0
+            elif pondered and pondered[3] >= searched_depth: # At least as deep as a search would get
+                col, score, node_count, depth = pondered
+                pondering = f"answered from depth {depth}"
+            else:
+                counters = create_stats()
+                search = create_search(board, table, counters)
+                col, score, node_count, depth = iterative_deepening(search, TIME_BUDGET, 42 - np.count_nonzero(board), WIN_SCORE)
+                searched_depth = depth
+                search_stats = SearchStats(counters, np.count_nonzero(board), time.time() - t1).to_dict()
             computation_time = round(time.time() - t1, 2)
+            stats = {"Table hit rate": f"{hit_rate(table):.1%} of {table[2][PROBES]} probes"}
+            if search_stats and search_stats["cutoffs"]:
+                stats["Cutoffs"] = f"{search_stats['cutoff_rate']:.1%} of expanded nodes, " \
+                                   f"{search_stats['first_move_cutoff_ratio']:.1%} by the first move"
+                stats["Branching factor"] = f"{search_stats['branching_factor']:.2f}, {search_stats['leaf_evals']} leaf evaluations"
+            if store:
+                stats["Position store"] = f"{store.hits} hits, {store.misses} misses"
+            if ponder:
+                stats["Pondering"] = pondering
+            if rounds == 1:
+                stats["Compile time"] = warmup.summary(compile_time)
             if score == -1: # Check for tie
                 endgame = "Tie!"
                 game_over = True
             row = get_next_open_row(board, col)
             board = drop_piece(board, row, col, AI_PIECE)
 
-            if check_for_win(board, AI_PIECE):
+            if check_for_win_at(board, row, col):
                 endgame = "Player 2 wins!"
                 game_over = True
-            pretty_print_board(np.flipud(board), rounds, depth, node_count, computation_time, endgame)
+            elif not game_over:
+                # Search every reply of the human until they move
+                replies = reply_boards(board, PLAYER_PIECE)
+                ponder = Ponder({reply: lambda stop, search=create_search(child, table), empty=42 - np.count_nonzero(child):
+                                 deepening(search, empty, WIN_SCORE, stop) for reply, child in replies.items()}).start()
+            pretty_print_board(np.flipud(board), rounds, depth, node_count, computation_time, endgame, stats)
 
         HUMAN_TURN = not HUMAN_TURN
 
-    pretty_print_board(np.flipud(board), rounds, depth, node_count, computation_time, endgame)
+    pretty_print_board(np.flipud(board), rounds, depth, node_count, computation_time, endgame, stats)
 
 if __name__ == "__main__":
     start_game()
\ No newline at end of file
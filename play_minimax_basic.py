@@ -1,97 +1,144 @@
 import numpy as np
 import sys
 import time
-from typing import List, Tuple
-from numba import njit, typed
-from base_game import create_board, is_valid_column, get_valid_columns, \
-    get_next_open_row, drop_piece, check_for_win, pretty_print_board, \
-    evaluate_position
+from typing import Callable, List, Tuple
+from numba import njit
+from base_game import create_board, is_valid_column, get_next_open_row, \
+    drop_piece, check_for_win_at, pretty_print_board, SCORE_WEIGHTS
+from iterative_deepening import iterative_deepening, deepening, new_stop_flag
+from bitboard import MOVE_ORDER, can_play, column_height, play, is_win, is_full, from_array
+from incremental_evaluation import OWN, OPPONENT, create_evaluator, add_stone, remove_stone, current_score
+from warmup import Warmup, warm_up_base_game
+from pondering import Ponder, reply_boards
+from search_stats import NODES, EXPANDED, LEAF_EVALS, TERMINALS, stats_ply, count, create_stats, SearchStats
 
 # The main file for playing minimax basic AI.
 
-@njit
-def minimax_basic(board:np.ndarray, depth:int, maxTurn:bool, node_count:int) -> Tuple[int, int, int]:
+@njit(nogil=True, cache=True)
+def minimax_basic(position:np.uint64, mask:np.uint64, depth:int, maxTurn:bool, node_count:int, evaluator, stop:np.ndarray, stats:np.ndarray) -> Tuple[int, int, int]:
     """ Implementation of Minimax Alpha Beta Pruning
 
     Args:
-        board (np.ndarray): game board
+        position (np.uint64): bitboard of the side to move (the player on max turn, the AI on min turn)
+        mask (np.uint64): bitboard of every stone on the board
         depth (int): recursive search depth
         maxTurn (bool): True if it's max turn; False if it's min turn
         node_count (int): The accumulator node_count
+        evaluator (Tuple[np.ndarray, np.ndarray, np.ndarray]): incremental evaluation of the board, scored for the AI
+        stop (np.ndarray): abort the search as soon as stop[0] is set
+        stats (np.ndarray): search statistics, counted by ply (see search_stats.py)
 
     Returns:
         Tuple[int, int, int]: best_column, best_score, node_count
     """
 
-    PLAYER_PIECE = 1
-    AI_PIECE = 2
     WIN_SCORE = 100000
     TIE = -1
     AGING_PENALTY = 3
 
-    # First, check for possible winning move -> Stop recursing and return the minimax_alphabeta score
-    if check_for_win(board, PLAYER_PIECE):
-        score = WIN_SCORE + depth * AGING_PENALTY # If there are multiple win possibilites, choose the faster one.
-        return typed.List([0, score, node_count])
+    if stop[0]:
+        return 0, 0, node_count
+    ply = stats_ply(stats, mask)
+    count(stats, ply, NODES)
 
-    if check_for_win(board, AI_PIECE):
-        score = -WIN_SCORE - depth * AGING_PENALTY # If there are multiple win possibilites, choose the faster one.
-        return typed.List([0, score, node_count])
+    # Only the side that made the last move can have just won; position ^ mask holds its stones
+    if is_win(position ^ mask):
+        count(stats, ply, TERMINALS)
+        # If there are multiple win possibilites, choose the faster one.
+        if maxTurn: # The AI moved last
+            return 0, -WIN_SCORE - depth * AGING_PENALTY, node_count
+        return 0, WIN_SCORE + depth * AGING_PENALTY, node_count
 
     # If the board is full -> return tie
-    if len(get_valid_columns(board)) == 0:
-        return typed.List([0, TIE, node_count])
+    if is_full(mask):
+        count(stats, ply, TERMINALS)
+        return 0, TIE, node_count
 
     # If search depth == 0 -> Stop recursing and return the minimax_alphabeta score
     if depth == 0:
-        bestCol = get_valid_columns(board)[0]
-        return typed.List([bestCol, evaluate_position(board, AI_PIECE), node_count])
-    
+        bestCol = 0
+        for col in MOVE_ORDER:
+            if can_play(mask, col):
+                bestCol = col
+                break
+        count(stats, ply, LEAF_EVALS)
+        return bestCol, current_score(evaluator), node_count
+    count(stats, ply, EXPANDED)
+
     if maxTurn:
         value = -sys.maxsize
         bestCol = 0
-        for col in get_valid_columns(board):
-            row = get_next_open_row(board, col)
-            temp_board = np.copy(board)
-            temp_board[row, col] = PLAYER_PIECE
-            _, score, node_count = minimax_basic(temp_board, depth - 1, False, node_count)
+        for col in MOVE_ORDER:
+            if not can_play(mask, col):
+                continue
+            bit = 7 * col + column_height(mask, col)
+            child_position, child_mask = play(position, mask, col)
+            add_stone(evaluator, bit, OPPONENT)
+            # not maxTurn rather than a literal False: one bool overload, which numba can cache safely
+            _, score, node_count = minimax_basic(child_position, child_mask, depth - 1, not maxTurn, node_count, evaluator, stop, stats)
+            remove_stone(evaluator, bit, OPPONENT)
             
             if score > value:
                 value = score
                 bestCol = col
-        return typed.List([bestCol, value, node_count + 1])
+        return bestCol, value, node_count + 1
     
     else:
         value = sys.maxsize
         bestCol = 0
-        for col in get_valid_columns(board):
-            row = get_next_open_row(board, col)
-            temp_board = np.copy(board)
-            temp_board[row, col] = AI_PIECE
-            _, score, node_count = minimax_basic(temp_board, depth - 1, True, node_count)
+        for col in MOVE_ORDER:
+            if not can_play(mask, col):
+                continue
+            bit = 7 * col + column_height(mask, col)
+            child_position, child_mask = play(position, mask, col)
+            add_stone(evaluator, bit, OWN)
+            _, score, node_count = minimax_basic(child_position, child_mask, depth - 1, not maxTurn, node_count, evaluator, stop, stats)
+            remove_stone(evaluator, bit, OWN)
     
             if score < value:
                 value = score
                 bestCol = col
-        return typed.List([bestCol, value, node_count + 1])
+        return bestCol, value, node_count + 1
+
+def create_search(board:np.ndarray, stats:np.ndarray=None) -> Callable:
+    """ search(depth, stop) of the AI to move on `board`, with its own evaluator,
+    counting into `stats` (a disabled table when None) """
+    PLAYER_PIECE = 1
+    position, mask = from_array(board, PLAYER_PIECE)
+    evaluator = create_evaluator(position ^ mask, position, SCORE_WEIGHTS)
+    stats = create_stats(False) if stats is None else stats
+    return lambda depth, stop: minimax_basic(position, mask, depth, True, 0, evaluator, stop, stats)
+
+def warm_up():
+    """ Compile the AI's numba functions on an empty board, see warmup.py """
+    warm_up_base_game()
+    position, mask = from_array(create_board(), 1)
+    evaluator = create_evaluator(position ^ mask, position, SCORE_WEIGHTS)
+    minimax_basic(position, mask, 1, True, 0, evaluator, new_stop_flag(), create_stats())
 
 def start_game():
     """ 
     Initialize the game and play until the game is over.
     Human player goes first.
-    Starting search depth = 7 and increases on every 5th round.
-    Search depth is capped at 10.
+    The AI deepens its search one ply at a time until its time budget runs out.
+    While the human thinks, the AI ponders every reply (see pondering.py).
     """
 
     PLAYER_PIECE = 1
     AI_PIECE = 2
     HUMAN_TURN = True
+    TIME_BUDGET = 1.0 # seconds per AI move
+    WIN_SCORE = 100000
 
     board = create_board()
     game_over = False
     rounds = 0
-    depth = 7
+    depth = 0
+    searched_depth = 0 # Depth of the last timed search, the bar for pondered results
     computation_time = 0
+    stats = None
+    ponder = None
+    warmup = Warmup(warm_up).start() # Compiles while the human picks the first move
 
     while not game_over:
         endgame = ''
@@ -102,31 +149,51 @@ def start_game():
                 row = get_next_open_row(board, col) 
                 board = drop_piece(board, row, col, PLAYER_PIECE)
 
-                if check_for_win(board, PLAYER_PIECE):
+                if check_for_win_at(board, row, col):
                     endgame = "Player 1 wins!"
                     game_over = True
 
         if not HUMAN_TURN:
             rounds += 1
+            compile_time = warmup.wait() # Only the first move can still be waiting
             t1 = time.time()
-            if rounds % 5 == 0 and depth < 10: # Cap the search depth at 10.
-                depth += 1
-            col, score, node_count = minimax_basic(board, depth, True, 0)
+            pondered = ponder.finish(col) if ponder else None # col is the human's move
+            pondering = f"searched to depth {pondered[3]}" if pondered else "no result for this reply"
+            search_stats = None
+            if pondered and pondered[3] >= searched_depth: # At least as deep as a search would get
+                col, score, node_count, depth = pondered
+                pondering = f"answered from depth {depth}"
+            else:
+                counters = create_stats()
+                search = create_search(board, counters)
+                col, score, node_count, depth = iterative_deepening(search, TIME_BUDGET, 42 - np.count_nonzero(board), WIN_SCORE)
+                searched_depth = depth
+                search_stats = SearchStats(counters, np.count_nonzero(board), time.time() - t1).to_dict()
             computation_time = round(time.time() - t1, 2)
+            stats = {"Pondering": pondering} if ponder else {}
+            if search_stats:
+                stats["Branching factor"] = f"{search_stats['branching_factor']:.2f}, {search_stats['leaf_evals']} leaf evaluations"
+            if rounds == 1:
+                stats["Compile time"] = warmup.summary(compile_time)
             if score == -1: # Check for tie
                 endgame = "Tie!"
                 game_over = True
             row = get_next_open_row(board, col)
             board = drop_piece(board, row, col, AI_PIECE)
 
-            if check_for_win(board, AI_PIECE):
+            if check_for_win_at(board, row, col):
                 endgame = "Player 2 wins!"
                 game_over = True
-            pretty_print_board(np.flipud(board), rounds, depth, node_count, computation_time, endgame)
+            elif not game_over:
+                # Search every reply of the human until they move
+                replies = reply_boards(board, PLAYER_PIECE)
+                ponder = Ponder({reply: lambda stop, search=create_search(child), empty=42 - np.count_nonzero(child):
+                                 deepening(search, empty, WIN_SCORE, stop) for reply, child in replies.items()}).start()
+            pretty_print_board(np.flipud(board), rounds, depth, node_count, computation_time, endgame, stats)
 
         HUMAN_TURN = not HUMAN_TURN
 
-    pretty_print_board(np.flipud(board), rounds, depth, node_count, computation_time, endgame)
+    pretty_print_board(np.flipud(board), rounds, depth, node_count, computation_time, endgame, stats)
 
 if __name__ == "__main__":
     start_game()
\ No newline at end of file
@@ -1,101 +1,355 @@
 import numpy as np
+import os
 import sys
 import time
-from typing import List, Tuple
-from numba import njit, typed
-from base_game import create_board, is_valid_column, get_valid_columns, \
-    get_next_open_row, drop_piece, check_for_win, pretty_print_board, \
-    evaluate_position
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+from numba import njit, prange
+from base_game import create_board, is_valid_column, get_next_open_row, \
+    drop_piece, check_for_win_at, pretty_print_board
+from bitboard import WIDTH, can_play, play, is_win, is_full, from_array, column_mask, legal_moves, winning_cells, \
+    winning_column, non_losing_moves
+from warmup import Warmup, warm_up_base_game
+from pondering import Ponder, reply_boards
 
 # The main file for playing montecarlo AI
 
-@njit
-def montecarlo(board:np.ndarray, depth:int, maxTurn:bool, node_count:int) -> Tuple[int, int, int]:
-    """ Implementation of Minimax Alpha Beta Pruning
+EXPLORATION = 1.41 # UCT exploration constant, about sqrt(2)
+PLAYOUT_BATCH = 256 # Playouts run between two checks of the clock
+PONDER_STEP = 0.05 # Seconds one pondered tree grows before the next reply's turn
+
+# Node status
+ONGOING = 0
+WIN = 1 # The player who moved into the node has won
+DRAW = 2
+
+# Slots of the tree counters
+NUM_NODES = 0
+MAX_DEPTH = 1
+
+def create_tree(position:np.uint64, mask:np.uint64, capacity:int=500000) -> Tuple:
+    """ Allocate the node pool. Every node is one index into a set of flat arrays.
 
     Args:
-        board (np.ndarray): game board
-        depth (int): recursive search depth
-        alpha (int): initialized as negative infinity
-        beta (int): initialized as positive infinity
-        maxTurn (bool): True if it's max turn; False if it's min turn
-        node_count (int): The accumulator node_count
+        position (np.uint64): bitboard of the side to move at the root
+        mask (np.uint64): bitboard of every stone on the board
+        capacity (int): maximum number of nodes
 
     Returns:
-        Tuple[int, int, int]: best_column, best_score, node_count
+        Tuple: positions, masks, parents, children, untried, visits, wins, status, counters
     """
+    positions = np.zeros(capacity, dtype=np.uint64)
+    masks = np.zeros(capacity, dtype=np.uint64)
+    parents = np.full(capacity, -1, dtype=np.int32)
+    children = np.full((capacity, WIDTH), -1, dtype=np.int32) # Indexed by column
+    untried = np.zeros(capacity, dtype=np.int8) # Bit c is set while column c has not been expanded
+    visits = np.zeros(capacity, dtype=np.int32)
+    wins = np.zeros(capacity, dtype=np.float64) # From the point of view of the player who moved into the node
+    status = np.zeros(capacity, dtype=np.int8)
+    counters = np.zeros(2, dtype=np.int64)
+    tree = (positions, masks, parents, children, untried, visits, wins, status, counters)
+    add_node(tree, -1, position, mask)
+    return tree
 
-    PLAYER_PIECE = 1
-    AI_PIECE = 2
-    WIN_SCORE = 100000
-    TIE = -1
-    AGING_PENALTY = 3
-
-    # First, check for possible winning move -> Stop recursing and return the minimax_alphabeta score
-    if check_for_win(board, PLAYER_PIECE):
-        score = WIN_SCORE + depth * AGING_PENALTY # If there are multiple win possibilites, choose the faster one.
-        return typed.List([0, score, node_count])
-
-    if check_for_win(board, AI_PIECE):
-        score = -WIN_SCORE - depth * AGING_PENALTY # If there are multiple win possibilites, choose the faster one.
-        return typed.List([0, score, node_count])
-
-    # If the board is full -> return tie
-    if len(get_valid_columns(board)) == 0:
-        return typed.List([0, TIE, node_count])
-
-    # If search depth == 0 -> Stop recursing and return the minimax_alphabeta score
-    if depth == 0:
-        bestCol = np.random.choice(get_valid_columns(board))
-        return typed.List([bestCol, evaluate_position(board, AI_PIECE), node_count])
-    
-    if maxTurn:
-        value = -sys.maxsize
-        bestCol = 0
-
-        for col in get_valid_columns(board):
-            row = get_next_open_row(board, col)
-            temp_board = np.copy(board)
-            temp_board[row, col] = PLAYER_PIECE
-
-            _, score, node_count = montecarlo(temp_board, depth - 1, False, node_count)
-            
-            if score > value:
-                value = score
-                bestCol = col
-        return typed.List([bestCol, value, node_count + 1])
-    
+@njit(cache=True)
+def seed(value:int) -> None:
+    """ Seed numba's random generator, which is separate from numpy's """
+    np.random.seed(value)
+
+@njit(cache=True)
+def add_node(tree, parent:int, position:np.uint64, mask:np.uint64) -> int:
+    """ Take the next free node from the pool and return its index """
+    positions, masks, parents, children, untried, visits, wins, status, counters = tree
+    node = counters[NUM_NODES]
+    counters[NUM_NODES] += 1
+    positions[node] = position
+    masks[node] = mask
+    parents[node] = parent
+    if parent >= 0 and is_win(position ^ mask):
+        status[node] = WIN
+    elif is_full(mask):
+        status[node] = DRAW
     else:
-        value = sys.maxsize
-        bestCol = 0
-        for col in get_valid_columns(board):
-            row = get_next_open_row(board, col)
-            temp_board = np.copy(board)
-            temp_board[row, col] = AI_PIECE
-            _, score, node_count = montecarlo(temp_board, depth - 1, True, node_count)
-    
-            if score < value:
-                value = score
-                bestCol = col
-        return typed.List([bestCol, value, node_count + 1])
+        # Only expand the winning move, else the moves that do not hand the opponent a win
+        win = winning_column(position, mask)
+        allowed = non_losing_moves(position, mask) if win < 0 else np.uint64(0)
+        moves = 0
+        for col in range(WIDTH):
+            if win >= 0:
+                if col == win:
+                    moves |= 1 << col
+            elif allowed == 0: # Every move loses, keep them all
+                if can_play(mask, col):
+                    moves |= 1 << col
+            elif allowed & column_mask(col):
+                moves |= 1 << col
+        untried[node] = moves
+    return node
+
+@njit(cache=True)
+def select_child(tree, node:int, exploration:float) -> int:
+    """ Pick the child with the highest upper confidence bound (UCT) """
+    positions, masks, parents, children, untried, visits, wins, status, counters = tree
+    log_visits = np.log(visits[node])
+    best_child = -1
+    best_value = -np.inf
+    for col in range(WIDTH):
+        child = children[node, col]
+        if child < 0:
+            continue
+        value = wins[child] / visits[child] + exploration * np.sqrt(log_visits / visits[child])
+        if value > best_value:
+            best_value = value
+            best_child = child
+    return best_child
+
+@njit(cache=True)
+def choose_rollout_move(position:np.uint64, mask:np.uint64, heuristic:bool) -> int:
+    """ Random column, or with the heuristic: win if possible, else block, else random """
+    if heuristic:
+        # All winning cells at once instead of trying every column
+        possible = legal_moves(mask)
+        targets = winning_cells(position, mask) & possible
+        if not targets:
+            targets = winning_cells(position ^ mask, mask) & possible
+        if targets:
+            for col in range(WIDTH):
+                if targets & column_mask(col):
+                    return col
+
+    num_valid = 0
+    for col in range(WIDTH):
+        if can_play(mask, col):
+            num_valid += 1
+    choice = np.random.randint(num_valid)
+    for col in range(WIDTH):
+        if can_play(mask, col):
+            if choice == 0:
+                return col
+            choice -= 1
+    return -1 # This is never actually returned, it's just done to satisfy Numba.
+
+@njit(cache=True)
+def rollout(position:np.uint64, mask:np.uint64, heuristic:bool) -> float:
+    """ Play the game out and return 1 if the side to move wins, 0 if it loses and 0.5 for a tie """
+    side = 0
+    while not is_full(mask):
+        col = choose_rollout_move(position, mask, heuristic)
+        position, mask = play(position, mask, col)
+        if is_win(position ^ mask):
+            return 1.0 if side == 0 else 0.0
+        side ^= 1
+    return 0.5
+
+@njit(parallel=True, cache=True)
+def rollout_batch(position:np.uint64, mask:np.uint64, heuristic:bool, num_rollouts:int) -> float:
+    """ Leaf parallelism: run num_rollouts rollouts from the same node across all threads """
+    total = 0.0
+    for _ in prange(num_rollouts):
+        total += rollout(position, mask, heuristic)
+    return total
+
+@njit(cache=True)
+def run_playouts(tree, num_playouts:int, exploration:float, heuristic:bool, leaf_rollouts:int) -> None:
+    """ Run selection, expansion, simulation and backpropagation num_playouts times.
+    Every simulation plays leaf_rollouts games out from the new leaf. """
+    positions, masks, parents, children, untried, visits, wins, status, counters = tree
+    capacity = positions.shape[0]
+
+    for _ in range(num_playouts):
+        # Selection: walk down fully expanded nodes
+        node = 0
+        depth = 0
+        while status[node] == ONGOING and untried[node] == 0:
+            node = select_child(tree, node, exploration)
+            depth += 1
+
+        # Expansion: add one random untried column
+        if status[node] == ONGOING and counters[NUM_NODES] < capacity:
+            moves = untried[node]
+            num_moves = 0
+            for col in range(WIDTH):
+                if moves & (1 << col):
+                    num_moves += 1
+            choice = np.random.randint(num_moves)
+            for col in range(WIDTH):
+                if moves & (1 << col):
+                    if choice == 0:
+                        break
+                    choice -= 1
+            untried[node] = moves & ~(1 << col)
+            child_position, child_mask = play(positions[node], masks[node], col)
+            child = add_node(tree, node, child_position, child_mask)
+            children[node, col] = child
+            node = child
+            depth += 1
+        counters[MAX_DEPTH] = max(counters[MAX_DEPTH], depth)
+
+        # Simulation: total result for the player who moved into the node
+        if status[node] == WIN:
+            result = 1.0 * leaf_rollouts
+        elif status[node] == DRAW:
+            result = 0.5 * leaf_rollouts
+        elif leaf_rollouts == 1:
+            result = 1.0 - rollout(positions[node], masks[node], heuristic)
+        else:
+            result = leaf_rollouts - rollout_batch(positions[node], masks[node], heuristic, leaf_rollouts)
+
+        # Backpropagation: flip the point of view at every level
+        while node >= 0:
+            visits[node] += leaf_rollouts
+            wins[node] += result
+            result = leaf_rollouts - result
+            node = parents[node]
+
+@njit(cache=True)
+def root_statistics(tree) -> Tuple[np.ndarray, np.ndarray]:
+    """ Visits and wins of every root column (zero for columns never expanded) """
+    positions, masks, parents, children, untried, visits, wins, status, counters = tree
+    root_visits = np.zeros(WIDTH, dtype=np.int64)
+    root_wins = np.zeros(WIDTH, dtype=np.float64)
+    for col in range(WIDTH):
+        child = children[0, col]
+        if child >= 0:
+            root_visits[col] = visits[child]
+            root_wins[col] = wins[child]
+    return root_visits, root_wins
+
+def best_move(root_visits:np.ndarray, root_wins:np.ndarray) -> Tuple[int, float]:
+    """ The most visited root column and its win rate """
+    col = int(np.argmax(root_visits))
+    return col, float(root_wins[col] / root_visits[col])
+
+def grow_tree(tree, time_budget:float, max_playouts:int, exploration:float, heuristic:bool, leaf_rollouts:int) -> int:
+    """ Run playouts in batches until the time or playout budget is used up. Returns the number of playouts. """
+    t1 = time.time()
+    playouts = 0
+    while playouts < max_playouts:
+        batch = min(PLAYOUT_BATCH, -(-(max_playouts - playouts) // leaf_rollouts))
+        run_playouts(tree, batch, exploration, heuristic, leaf_rollouts)
+        playouts += batch * leaf_rollouts
+        if time.time() - t1 >= time_budget:
+            break
+    return playouts
+
+def montecarlo(position:np.uint64, mask:np.uint64, time_budget:float=1.0, max_playouts:int=sys.maxsize,
+               exploration:float=EXPLORATION, heuristic:bool=True, capacity:int=500000,
+               leaf_rollouts:int=1) -> Tuple[int, float, int, int]:
+    """ Implementation of Monte Carlo Tree Search (UCT) with a bounded time or playout budget
+
+    Args:
+        position (np.uint64): bitboard of the side to move
+        mask (np.uint64): bitboard of every stone on the board
+        time_budget (float): seconds to search
+        max_playouts (int): stop earlier after this many playouts
+        exploration (float): UCT exploration constant
+        heuristic (bool): True to win/block in rollouts; False for uniformly random rollouts
+        capacity (int): maximum number of tree nodes
+        leaf_rollouts (int): rollouts per new leaf, run in parallel threads when > 1
+
+    Returns:
+        Tuple[int, float, int, int]: best_column, win_rate, playouts, tree_depth
+    """
+    tree = create_tree(position, mask, capacity)
+    playouts = grow_tree(tree, time_budget, max_playouts, exploration, heuristic, leaf_rollouts)
+    col, win_rate = best_move(*root_statistics(tree))
+    return col, win_rate, playouts, int(tree[-1][MAX_DEPTH])
+
+def search_worker(position:np.uint64, mask:np.uint64, time_budget:float, max_playouts:int, exploration:float,
+                  heuristic:bool, capacity:int, leaf_rollouts:int, random_seed:int) -> Tuple[np.ndarray, np.ndarray, int, int]:
+    """ Grow one independent tree in a worker process and return its root statistics """
+    seed(random_seed)
+    tree = create_tree(position, mask, capacity)
+    playouts = grow_tree(tree, time_budget, max_playouts, exploration, heuristic, leaf_rollouts)
+    root_visits, root_wins = root_statistics(tree)
+    return root_visits, root_wins, playouts, int(tree[-1][MAX_DEPTH])
+
+def parallel_montecarlo(position:np.uint64, mask:np.uint64, pool:Executor, workers:int, time_budget:float=1.0,
+                        max_playouts:int=sys.maxsize, exploration:float=EXPLORATION, heuristic:bool=True,
+                        capacity:int=500000, leaf_rollouts:int=1) -> Tuple[int, float, int, int]:
+    """ Root parallelism: search one tree per worker process and add up their root visit counts
+
+    Args:
+        position (np.uint64): bitboard of the side to move
+        mask (np.uint64): bitboard of every stone on the board
+        pool (Executor): process pool with at least `workers` processes
+        workers (int): number of independent trees
+        time_budget (float): seconds to search
+        max_playouts (int): playout budget of each worker
+        exploration (float): UCT exploration constant
+        heuristic (bool): True to win/block in rollouts; False for uniformly random rollouts
+        capacity (int): maximum number of nodes of each tree
+        leaf_rollouts (int): rollouts per new leaf inside each worker
+
+    Returns:
+        Tuple[int, float, int, int]: best_column, win_rate, playouts, tree_depth
+    """
+    base_seed = np.random.randint(2**31 - workers)
+    futures = [pool.submit(search_worker, position, mask, time_budget, max_playouts, exploration,
+                           heuristic, capacity, leaf_rollouts, base_seed + i) for i in range(workers)]
+    root_visits = np.zeros(WIDTH, dtype=np.int64)
+    root_wins = np.zeros(WIDTH, dtype=np.float64)
+    playouts = 0
+    depth = 0
+    for future in futures:
+        worker_visits, worker_wins, worker_playouts, worker_depth = future.result()
+        root_visits += worker_visits
+        root_wins += worker_wins
+        playouts += worker_playouts
+        depth = max(depth, worker_depth)
+    col, win_rate = best_move(root_visits, root_wins)
+    return col, win_rate, playouts, depth
+
+def ponder_steps(position:np.uint64, mask:np.uint64, stop:np.ndarray) -> Iterator[Tuple[int, float, int, int, tuple]]:
+    """ Grow one tree in short steps for pondering.Ponder
+
+    Yields:
+        Tuple[int, float, int, int, tuple]: best_column, win_rate, playouts, tree_depth and the tree itself,
+            so the AI can keep growing it once this reply is played
+    """
+    tree = create_tree(position, mask)
+    playouts = 0
+    while not stop[0]:
+        playouts += grow_tree(tree, PONDER_STEP, sys.maxsize, EXPLORATION, True, 1)
+        col, win_rate = best_move(*root_statistics(tree))
+        yield col, win_rate, playouts, int(tree[-1][MAX_DEPTH]), tree
+
+def warm_up(pool:Executor=None, workers:int=0):
+    """ Compile the AI's numba functions on an empty board, see warmup.py. Each worker process of `pool` compiles its own. """
+    warm_up_base_game()
+    position, mask = from_array(create_board(), 2)
+    futures = [pool.submit(search_worker, position, mask, 0.0, 1, EXPLORATION, True, 16, 1, 0) for _ in range(workers)] \
+        if pool is not None else []
+    montecarlo(position, mask, 0.0, 1, capacity=16)
+    for future in futures:
+        future.result()
 
 def start_game():
-    """ 
+    """
     Initialize the game and play until the game is over.
     Human player goes first.
-    Starting search depth = 7 and increases on every 5th round.
-    Search depth is capped at 10.
+    The AI searches for a fixed time budget on every move,
+    with one tree per CPU core when there is more than one.
+    While the human thinks, the AI grows a tree for every reply (see pondering.py).
     """
 
     PLAYER_PIECE = 1
     AI_PIECE = 2
     HUMAN_TURN = True
+    TIME_BUDGET = 1.0 # seconds per AI move
+    WORKERS = os.cpu_count() or 1
 
     board = create_board()
     game_over = False
     rounds = 0
-    depth = 7
+    depth = 0
+    node_count = 0
+    searched_playouts = 0 # Playouts of the last timed search, the bar for pondered results
     computation_time = 0
+    stats = None
+    ponder = None
+    pool = ProcessPoolExecutor(WORKERS) if WORKERS > 1 else None
+    warmup = Warmup(lambda: warm_up(pool, WORKERS)).start() # Compiles while the human picks the first move
 
     while not game_over:
         endgame = ''
@@ -103,34 +357,65 @@ def start_game():
             col = int(input("Player 1 make your selection (1-7): "))
             col = col - 1 # Humans read from 1-7 but computers read from base 0 (0-6)
             if is_valid_column(board, col):
-                row = get_next_open_row(board, col) 
+                row = get_next_open_row(board, col)
                 board = drop_piece(board, row, col, PLAYER_PIECE)
 
-                if check_for_win(board, PLAYER_PIECE):
+                if check_for_win_at(board, row, col):
                     endgame = "Player 1 wins!"
                     game_over = True
 
         if not HUMAN_TURN:
             rounds += 1
+            compile_time = warmup.wait() # Only the first move can still be waiting
             t1 = time.time()
-            if rounds % 5 == 0 and depth < 10: # Cap the search depth at 10.
-                depth += 1
-            col, score, node_count = montecarlo(board, depth, True, 0)
+            pondered = ponder.finish(col) if ponder else None # col is the human's move
+            pondering = f"{pondered[2]} playouts" if pondered else "no tree for this reply"
+            position, mask = from_array(board, AI_PIECE)
+            if pondered and pondered[2] >= searched_playouts: # At least as many playouts as a search would get
+                col, win_rate, node_count, depth, _ = pondered
+                pondering = f"answered from {node_count} playouts"
+            elif pondered and pool is None:
+                # Keep growing the pondered tree
+                tree = pondered[4]
+                node_count = pondered[2] + grow_tree(tree, TIME_BUDGET, sys.maxsize, EXPLORATION, True, 1)
+                col, win_rate = best_move(*root_statistics(tree))
+                depth = int(tree[-1][MAX_DEPTH])
+                searched_playouts = node_count - pondered[2]
+            elif pool is None:
+                col, win_rate, node_count, depth = montecarlo(position, mask, TIME_BUDGET)
+                searched_playouts = node_count
+            else:
+                col, win_rate, node_count, depth = parallel_montecarlo(position, mask, pool, WORKERS, TIME_BUDGET)
+                searched_playouts = node_count
             computation_time = round(time.time() - t1, 2)
-            if score == -1: # Check for tie
-                endgame = "Tie!"
-                game_over = True
+            stats = {"Win rate": f"{win_rate:.1%}"}
+            if not pondering.startswith("answered"):
+                stats["Playouts per second"] = round(searched_playouts / max(computation_time, 0.01))
+            if ponder:
+                stats["Pondering"] = pondering
+            if rounds == 1:
+                stats["Compile time"] = warmup.summary(compile_time)
             row = get_next_open_row(board, col)
             board = drop_piece(board, row, col, AI_PIECE)
 
-            if check_for_win(board, AI_PIECE):
+            if check_for_win_at(board, row, col):
                 endgame = "Player 2 wins!"
                 game_over = True
-            pretty_print_board(np.flipud(board), rounds, depth, node_count, computation_time, endgame)
+            elif not any(is_valid_column(board, c) for c in range(7)): # Check for tie
+                endgame = "Tie!"
+                game_over = True
+            else:
+                # Grow a tree for every reply of the human until they move
+                replies = reply_boards(board, PLAYER_PIECE)
+                ponder = Ponder({reply: lambda stop, bitboards=from_array(child, AI_PIECE): ponder_steps(*bitboards, stop)
+                                 for reply, child in replies.items()}).start()
+            pretty_print_board(np.flipud(board), rounds, depth, node_count, computation_time, endgame, stats)
 
         HUMAN_TURN = not HUMAN_TURN
 
-    pretty_print_board(np.flipud(board), rounds, depth, node_count, computation_time, endgame)
+    if pool is not None:
+        pool.shutdown()
+    pretty_print_board(np.flipud(board), rounds, depth, node_count, computation_time, endgame, stats)
 
 if __name__ == "__main__":
     start_game()
\ No newline at end of file
@@ -1,29 +1,44 @@
+import argparse
 import numpy as np
 import sys
 import os
 import time
-from typing import List, Tuple
+from typing import Callable, List, Tuple
 from numba import njit, typed
-from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from base_game import LINE_ROWS, LINE_COLS, line_is_complete
+from iterative_deepening import iterative_deepening, deepening, new_stop_flag
+from bitboard import MOVE_ORDER, can_play, column_height, column_mask, play, is_full, from_array, \
+    winning_column, non_losing_moves
+from position_store import open_store, store_path, position_key
+from incremental_evaluation import OWN, OPPONENT, create_evaluator, add_stone, remove_stone, current_score
+from warmup import Warmup
+from pondering import Ponder, reply_boards
+from search_stats import NODES, EXPANDED, CUTOFFS, FIRST_MOVE_CUTOFFS, LEAF_EVALS, TERMINALS, stats_ply, count, create_stats
+from online_observer import wait_until_ready, wait_for_change, click_cell, stand_in_url, stand_in_latencies
+
+# The window weights of score_window() for the bitboard evaluators:
+# [4 own, 3 own + 1 empty, 2 own + 2 empty, 4 opponent, 3 opponent + 1 empty, 2 opponent + 2 empty]
+SCORE_WEIGHTS = np.array([1000, 50, 10, 1000, 100, 10], dtype=np.int64)
 
 def create_board() -> np.ndarray:
     """ Create a board of 6 rows x 7 columns """
     return np.zeros((6, 7))
 
-@njit
+@njit(cache=True)
 def drop_piece(board:np.ndarray, row:int, col:int, piece:int) -> np.ndarray:
     """ Place the piece on the board at coordinates [row, col] """
     board[row, col] = piece
     return board
 
-@njit
+@njit(cache=True)
 def is_valid_column(board:np.ndarray, col:int) -> bool:
     """ Check if this is column is not full """
     return board[board.shape[0] - 1, col] == 0
 
-@njit
+@njit(cache=True)
 def get_valid_columns(board:np.ndarray) -> List[int]:
     """ Get a list of all non-full columns """
     valid_locations = []
@@ -32,7 +47,7 @@ def get_valid_columns(board:np.ndarray) -> List[int]:
             valid_locations.append(col)
     return typed.List(valid_locations)
 
-@njit
+@njit(cache=True)
 def get_next_open_row(board:np.ndarray, col:int) -> int:
     """ Get the next open row index in this column """
     for row in range(board.shape[0]):
@@ -40,37 +55,17 @@ def get_next_open_row(board:np.ndarray, col:int) -> int:
             return row
     return -1 # This is never actually returned, it's just done to satisfy Numba.
 
-@njit
+@njit(cache=True)
 def check_for_win(board:np.ndarray, piece:int) -> bool:
-    """ Check for 4 in a row via brute force """
-    # check horizontal locations for a win
-    for r in range(6):
-        for c in range(7 - 3):
-            if board[r, c] == piece and board[r, c + 1] == piece and board[r, c + 2] == piece and board[r, c + 3] == piece:
-                return True
-    
-    # check vertical locations for a win
-    for r in range(6 - 3):
-        for c in range(7):
-            if board[r, c] == piece and board[r + 1, c] == piece and board[r + 2, c] == piece and board[r + 3, c] == piece:
-                return True
-
-    # check positively sloped diagonals
-    for r in range(6 - 3):        
-        for c in range(7 - 3):
-            if board[r, c] == piece and board[r + 1, c + 1] == piece and board[r + 2, c + 2] == piece and board[r + 3, c + 3] == piece:
-                return True
-
-    # check negatively sloped diagonals
-    for r in range(3, 6):
-        for c in range(7 - 3):
-            if board[r, c] == piece and board[r - 1, c + 1] == piece and board[r - 2, c + 2] == piece and board[r - 3, c + 3] == piece:
-                return True
+    """ Check every line of the board for 4 in a row """
+    for line in range(LINE_ROWS.shape[0]):
+        if line_is_complete(board, line, piece):
+            return True
     return False
 
-@njit
+@njit(cache=True)
 def evaluate_position(board:np.ndarray, piece:int) -> int:
-    """ Calculate the score of the current board via brute force
+    """ Calculate the score of the current board over every line
 
     Args:
         board (np.ndarray): game board
@@ -80,37 +75,20 @@ def evaluate_position(board:np.ndarray, piece:int) -> int:
         int: the score of the current board state
     """
     score = 0
-    num_rows = board.shape[0]
-    num_cols = board.shape[1]
-
-    # Score horizontal
-    for r in range(num_rows):
-        row_array = [int(i) for i in list(board[r, :])]
-        for c in range(7 - 3):
-            window = row_array[c: c + 4]
-            score += score_window(window, piece)
-
-    # Score vertical
-    for c in range(num_cols):
-        col_array = [int(i) for i in list(board[:, c])]
-        for r in range(num_rows - 3):
-            window = col_array[r: r + 4]
-            score += score_window(window, piece)
-
-    # Score positive diagonal
-    for r in range(num_rows - 3):
-        for c in range(num_cols - 3):
-            window = [board[r + i, c + i] for i in range(4)]
-            score += score_window(window, piece)
-
-    # Score negative diagonal
-    for r in range(num_rows - 3):
-        for c in range(num_cols - 3):
-            window = [board[r + 3 - i, c + i] for i in range(4)]
-            score += score_window(window, piece)
+    opponent_piece = piece % 2 + 1
+    for line in range(LINE_ROWS.shape[0]):
+        num_offense = 0
+        num_defense = 0
+        for i in range(4):
+            cell = board[LINE_ROWS[line, i], LINE_COLS[line, i]]
+            if cell == piece:
+                num_offense += 1
+            elif cell == opponent_piece:
+                num_defense += 1
+        score += score_counts(num_offense, num_defense)
     return score
 
-@njit
+@njit(cache=True)
 def score_window(window:List[int], piece:int) -> int:
     """ Quantify a 4 block window
 
@@ -121,12 +99,13 @@ def score_window(window:List[int], piece:int) -> int:
     Returns:
         int: the score of this window
     """
-    score = 0
-    opponent_piece = piece % 2 + 1
+    return score_counts(window.count(piece), window.count(piece % 2 + 1))
 
-    num_offense = window.count(piece)
-    num_defense = window.count(opponent_piece)
-    num_empty = window.count(0)
+@njit(cache=True)
+def score_counts(num_offense:int, num_defense:int) -> int:
+    """ Score of a window holding num_offense of the scored player's pieces and num_defense of the opponent's """
+    score = 0
+    num_empty = 4 - num_offense - num_defense
 
     if num_offense == 4:
         score += 1000
@@ -141,192 +120,254 @@ def score_window(window:List[int], piece:int) -> int:
         score -= 100
     elif num_defense == 2 and num_empty == 2:
         score -= 10
-    return score 
+    return score
 
-@njit
-def minimax(board:np.ndarray, depth:int, alpha:int, beta:int, maxTurn:bool) -> Tuple[int, int]:
+@njit(nogil=True, cache=True)
+def minimax(position:np.uint64, mask:np.uint64, depth:int, alpha:int, beta:int, maxTurn:bool, ply:int, pv:np.ndarray, pv_table:np.ndarray, evaluator, stop:np.ndarray, stats:np.ndarray) -> Tuple[int, int]:
     """ Implementation of Minimax Alpha Beta Pruning
 
     Args:
-        board (np.ndarray): game board
+        position (np.uint64): bitboard of the side to move (the player on max turn, the AI on min turn)
+        mask (np.uint64): bitboard of every stone on the board
         depth (int): recursive search depth
         alpha (int): initialized as negative infinity
         beta (int): initialized as positive infinity
         maxTurn (bool): True if it's max turn; False if it's min turn
+        ply (int): distance from the root
+        pv (np.ndarray): principal variation of the previous iteration, searched first (-1 terminated).
+                         It is cleared below a node as soon as the search leaves that line.
+        pv_table (np.ndarray): triangular table the principal variation of this iteration is built in
+        evaluator (Tuple[np.ndarray, np.ndarray, np.ndarray]): incremental evaluation of the board, scored for the AI
+        stop (np.ndarray): abort the search as soon as stop[0] is set
+        stats (np.ndarray): search statistics, counted by ply (see search_stats.py)
 
     Returns:
         Tuple[int, int]: best_column, best_score
     """
-    PLAYER_PIECE = 1
-    AI_PIECE = 2
     WIN_SCORE = 1000000
     TIE = -1
     AGING_PENALTY = 3
 
-    # First, check for possible winning move -> Stop recursing and return the minimax score
-    if check_for_win(board, PLAYER_PIECE):
-        score = WIN_SCORE + depth * AGING_PENALTY # If there are multiple win possibilites, choose the faster one.
-        return 0, score
+    pv_table[ply, ply] = -1
+    if stop[0]:
+        return 0, 0
+    node_ply = stats_ply(stats, mask) # ply counts from the root, the stats table by stones on the board
+    count(stats, node_ply, NODES)
 
-    if check_for_win(board, AI_PIECE):
-        score = -WIN_SCORE - depth * AGING_PENALTY # If there are multiple win possibilites, choose the faster one.
-        return 0, score
+    # No win check: only the last move could have won, and the parent plays a winning move at
+    # once (see the tactics below) instead of searching it, so no node is ever reached after a win
 
     # If the board is full -> return tie
-    if len(get_valid_columns(board)) == 0:
+    if is_full(mask):
+        count(stats, node_ply, TERMINALS)
         return 0, TIE
 
     # If search depth == 0 -> Stop recursing and return the minimax score
     if depth == 0:
-        return 0, evaluate_position(board, AI_PIECE)
-    
+        count(stats, node_ply, LEAF_EVALS)
+        return 0, current_score(evaluator)
+
+    # Tactics before expanding: win at once, else only the moves that do not hand the opponent a win
+    win_sign = 1 if maxTurn else -1
+    col = winning_column(position, mask)
+    if col >= 0:
+        count(stats, node_ply, TERMINALS)
+        pv_table[ply, ply] = col
+        pv_table[ply, ply + 1] = -1
+        return col, win_sign * (WIN_SCORE + (depth - 1) * AGING_PENALTY)
+    allowed = non_losing_moves(position, mask)
+    if allowed == 0: # Every move lets the opponent win next turn
+        for col in MOVE_ORDER:
+            if can_play(mask, col):
+                break
+        count(stats, node_ply, TERMINALS)
+        return col, -win_sign * (WIN_SCORE + max(depth - 2, 0) * AGING_PENALTY)
+
     if maxTurn:
+        side = OPPONENT
         value = -sys.maxsize
-        bestCol = 0
-        for col in get_valid_columns(board):
-            row = get_next_open_row(board, col)
-            temp_board = np.copy(board)
-            temp_board = drop_piece(temp_board, row, col, PLAYER_PIECE)
-            score = minimax(temp_board, depth - 1, alpha, beta, False)[1]
-            if score > value:
-                value = score
-                bestCol = col
-            alpha = max(alpha, value)
-            if alpha >= beta:
-                break
-        return bestCol, value
-    
     else:
+        side = OWN
         value = sys.maxsize
-        bestCol = 0
-        for col in get_valid_columns(board):
-            row = get_next_open_row(board, col)
-            temp_board = np.copy(board)
-            temp_board = drop_piece(temp_board, row, col, AI_PIECE)
-            score = minimax(temp_board, depth - 1, alpha, beta, True)[1]
-            if score < value:
-                value = score
-                bestCol = col
+    bestCol = 0
+    count(stats, node_ply, EXPANDED)
+
+    # Search the previous iteration's move first (i == -1), then the rest in MOVE_ORDER
+    pv_move = pv[ply]
+    first_move = True
+    for i in range(-1, len(MOVE_ORDER)):
+        if i == -1:
+            col = pv_move
+        else:
+            col = MOVE_ORDER[i]
+            if col == pv_move:
+                continue
+        if col < 0 or not (allowed & column_mask(col)):
+            continue
+        bit = 7 * col + column_height(mask, col)
+        child_position, child_mask = play(position, mask, col)
+        if col != pv_move and pv[ply + 1] >= 0:
+            pv[ply + 1:] = -1 # Leaving the principal variation
+        add_stone(evaluator, bit, side)
+        score = minimax(child_position, child_mask, depth - 1, alpha, beta, not maxTurn, ply + 1, pv, pv_table, evaluator, stop, stats)[1]
+        remove_stone(evaluator, bit, side)
+        if stop[0]:
+            return bestCol, 0
+
+        if (maxTurn and score > value) or (not maxTurn and score < value):
+            value = score
+            bestCol = col
+            # The principal variation is this move followed by the child's
+            pv_table[ply, ply] = col
+            for p in range(ply + 1, pv_table.shape[1]):
+                pv_table[ply, p] = pv_table[ply + 1, p]
+                if pv_table[ply + 1, p] < 0:
+                    break
+        if maxTurn:
+            alpha = max(alpha, value)
+        else:
             beta = min(beta, value)
-            if alpha >= beta:
-                break
-        return bestCol, value
-
-def open_website(driver, url:str, wait_time:int=5) -> None:
-    driver.get(url)
-    time.sleep(wait_time) # Need to wait for all dynamic HTML elements to load
-
-def parse_page(driver) -> np.ndarray:
-    online_table = np.zeros((6,7))
-    html = driver.page_source
-    soup = BeautifulSoup(html, "html.parser")
-    table_rows = soup.find_all("tr", attrs={"class": "ng-star-inserted"})
-
-    for r, row in enumerate(table_rows):
-        target_col = row.find_all("td") # Filter by td tag.
-        for c, col in enumerate(target_col):
-            target = str(col.find("div"))
-            if len(target) > 2 and "background-color" in target:
-                if "red" in target: # Red is player 1 (human)
-                    online_table[r, c] = 1
-                if "blue" in target: # Blue is player 2 (AI)
-                    online_table[r, c] = 2
-            elif len(target) > 2:
-                online_table[r, c] = 0
-    return online_table
-
-def get_player_turn(driver) -> bool:
-    html = driver.page_source
-    soup = BeautifulSoup(html, "html.parser")
-    player_order = soup.find("div", attrs={"class": "current-turn-container"})
-    paragraph = player_order.find("p")
-    if paragraph.get_text() == "It's your opponent's turn":
-        return True # Human goes first
-    else:
-        return False # AI goes first
-
-def auto_click(driver, row:int, col:int) -> None:
-    table = driver.find_element_by_xpath("//table[@class='center-table']")
-    target_row = table.find_elements_by_xpath(".//tr")[row]
-    target_box = target_row.find_elements_by_xpath(".//td")[col]
-    target_box.click()
-    print(f"I clicked on [{row}, {col})]")
-
-def check_game_over(driver) -> str:
-    html = driver.page_source
-    soup = BeautifulSoup(html, "html.parser")
-    game_over_box = soup.find("app-game-end")
-    card_content = game_over_box.find("mat-card-content")
-    paragraph = card_content.find("p")
-    if paragraph.get_text() == "You Won":
-        return "won"
-    elif paragraph.get_text() == "You Lost":
-        return "lost"
-    else:
-        return "continue"
+        if alpha >= beta:
+            count(stats, node_ply, CUTOFFS)
+            if first_move:
+                count(stats, node_ply, FIRST_MOVE_CUTOFFS)
+            break
+        first_move = False
+    return bestCol, value
+
+def create_search(board:np.ndarray, stats:np.ndarray=None) -> Callable:
+    """ search(depth, stop) of the AI to move on `board`, ordered by the principal variation of the last depth,
+    counting into `stats` (a disabled table when None, which also reports 0 nodes) """
+    PLAYER_PIECE = 1
+    position, mask = from_array(board, PLAYER_PIECE)
+    pv_table = np.full((44, 44), -1, dtype=np.int64)
+    evaluator = create_evaluator(position ^ mask, position, SCORE_WEIGHTS)
+    stats = create_stats(False) if stats is None else stats
+    def search(depth, stop):
+        pv = pv_table[0].copy() # Order this iteration by the last one's principal variation
+        nodes = stats[:, NODES].sum()
+        col, score = minimax(position, mask, depth, -sys.maxsize, sys.maxsize, True, 0, pv, pv_table, evaluator, stop, stats)
+        return col, score, int(stats[:, NODES].sum() - nodes)
+    return search
+
+def warm_up():
+    """ Compile the AI's numba functions on an empty board, see warmup.py """
+    board = create_board()
+    is_valid_column(board, 3)
+    get_next_open_row(board, 3)
+    check_for_win(board, 2)
+    position, mask = from_array(board, 1)
+    evaluator = create_evaluator(position ^ mask, position, SCORE_WEIGHTS)
+    pv_table = np.full((44, 44), -1, dtype=np.int64)
+    minimax(position, mask, 1, -sys.maxsize, sys.maxsize, True, 0, pv_table[0].copy(), pv_table, evaluator, new_stop_flag(), create_stats())
+
+def open_driver(headless:bool=False):
+    """ Start Chrome through the chromedriver in the current directory, or return None when it is missing """
+    options = Options()
+    options.add_argument("start-maximized")
+    if headless:
+        options.add_argument("--headless=new")
+    if not os.path.exists(f"{os.getcwd()}/chromedriver"): # Check if chromedriver exists in current directory
+        return None
+    return webdriver.Chrome(service=Service(f"{os.getcwd()}/chromedriver"), options=options)
 
-def start_game():
+def start_game(url:str=None):
+    """
+    Open the game in Chrome and play until the game is over.
+    Without a url the human is asked for a connect-4.org game room.
+    The page is read through online_observer and the AI wakes up as soon as it changes.
+    While the human thinks, the AI ponders every reply (see pondering.py).
+    """
 
-    room = input("Enter the 4 digit game room: ")
-    url = f"http://connect-4.org/?lb{room}"
+    warmup = Warmup(warm_up).start() # Compiles while the browser starts and the human plays
+    if url is None:
+        room = input("Enter the 4 digit game room: ")
+        url = f"http://connect-4.org/?lb{room}"
 
+    PLAYER_PIECE = 1
     AI_PIECE = 2
 
-    options = Options()
-    options.add_argument("start-maximized")
-    if not os.path.exists(f"{os.getcwd()}/chromedriver"): # Check if chromedriver exists in current directory
+    driver = open_driver()
+    if driver is None:
         print("Error, Chromedriver not found!")
         return
-    driver = webdriver.Chrome(f"{os.getcwd()}/chromedriver", options=options)
-    open_website(driver, url, wait_time=4)
-    board = parse_page(driver)
+    driver.get(url)
+    state = wait_until_ready(driver) # Need to wait for all dynamic HTML elements to load
 
     game_over = False
     rounds = 0
-    depth = 5
-    HUMAN_TURN = get_player_turn(driver) # ONLINE FEATURE
+    TIME_BUDGET = 1.0 # seconds per AI move
+    WIN_SCORE = 1000000
+    store = open_store(store_path("online")) # From analyze.py --engine online: this search has its own SCORE_WEIGHTS and WIN_SCORE
+    first_move = True
+    searched_depth = 0 # Depth of the last timed search, the bar for pondered results
+    ponder = None
     while not game_over:
         rounds += 1
-        while HUMAN_TURN:
-            HUMAN_TURN = get_player_turn(driver) # Continously check the webpage for player turn
-            time.sleep(0.5)
-            board = parse_page(driver)
-            board = np.flip(board, axis = 0)
-            outcome = check_game_over(driver)
-            if outcome == "won": # The AI is checking whether it won or lost
-                print("Player 2 wins!")
-                game_over = True
-                break
-            elif outcome == "lost": 
-                print("Player 1 wins!")
-                game_over = True
-                break
-            else:
-                continue
-
-        if not HUMAN_TURN:
-            board = parse_page(driver)
-            board = np.flip(board, axis = 0)
-
-            if rounds % 2 == 0 and depth < 10: # Cap the search depth at 10.
-                depth += 1
-            print(f"The search depth is: {depth}")
-
-            t1 = time.time()
-            col = minimax(board, depth, -sys.maxsize, sys.maxsize, True)[0]
-            print(round(time.time() - t1, 3))
-            row = get_next_open_row(board, col)
-            
-            auto_click(driver, row, col)
-            time.sleep(0.1)
-            board = parse_page(driver)
-            board = np.flip(board, axis = 0)
-            if check_for_win(board, AI_PIECE):
-                print("Player 2 wins!")
-                game_over = True
-            HUMAN_TURN = True
+        while state["human_turn"] and state["outcome"] == "continue":
+            state = wait_for_change(driver, state) # Sleeps in the browser until the page changes
+        pondered = None
+        if ponder: # The human's move is the column that changed since the AI's move
+            changed = np.flatnonzero((state["board"] != ponder_board).any(axis=0))
+            # No new stone when the page reported an outcome, or stopped waiting, without one
+            pondered = ponder.finish(int(changed[0]) if len(changed) else None)
+            ponder = None
+        if state["outcome"] == "won": # The AI is checking whether it won or lost
+            print("Player 2 wins!")
+            break
+        elif state["outcome"] == "lost":
+            print("Player 1 wins!")
+            break
+        elif state["outcome"] == "draw" or not any(is_valid_column(state["board"], c) for c in range(7)):
+            print("Tie!")
+            break
+
+        board = state["board"]
+        compile_time = warmup.wait() # Only the first move can still be waiting
+        if first_move:
+            print(f"Compile time: {warmup.summary(compile_time)}")
+            first_move = False
+        t1 = time.time()
+        position, mask = from_array(board, PLAYER_PIECE)
+        stored = store.lookup(position_key(position ^ mask, mask)) if store else None
+        if stored:
+            col, _, depth = stored
+        elif pondered and pondered[3] >= searched_depth: # At least as deep as a search would get
+            col, _, _, depth = pondered
+            print(f"Answered from pondering at depth {depth}")
+        else:
+            col, _, _, depth = iterative_deepening(create_search(board), TIME_BUDGET, 42 - np.count_nonzero(board), WIN_SCORE)
+            searched_depth = depth
+        print(f"The search depth is: {depth}")
+        if store:
+            print(f"Position store: {store.hits} hits, {store.misses} misses")
+        print(round(time.time() - t1, 3))
+        row = get_next_open_row(board, col)
+
+        click_cell(driver, board.shape[0] - 1 - row, col) # The page's table counts rows from the top
+        print(f"I clicked on [{row}, {col}]")
+        stones = np.count_nonzero(board)
+        while np.count_nonzero(state["board"]) <= stones or not (state["human_turn"] or state["outcome"] != "continue"):
+            state = wait_for_change(driver, state) # Until the AI's piece is in and the turn has passed
+        if check_for_win(state["board"], AI_PIECE):
+            print("Player 2 wins!")
+            game_over = True
+        elif state["outcome"] == "continue":
+            # Search every reply of the human until they move
+            ponder_board = state["board"]
+            replies = reply_boards(ponder_board, PLAYER_PIECE)
+            ponder = Ponder({reply: lambda stop, search=create_search(child), empty=42 - np.count_nonzero(child):
+                             deepening(search, empty, WIN_SCORE, stop) for reply, child in replies.items()}).start()
+    latencies = stand_in_latencies(driver)
+    if latencies:
+        print(f"Response time: {np.mean(latencies):.3f} sec mean, {np.max(latencies):.3f} sec max over {len(latencies)} moves")
     time.sleep(1)
     driver.close()
 
 if __name__ == "__main__":
-    start_game()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Play Connect 4 online against the AI.")
+    parser.add_argument("--stand-in", action="store_true", help="play on the local stand-in site instead of connect-4.org")
+    parser.add_argument("--first", choices=["human", "ai"], default="human", help="who moves first on the stand-in site")
+    parser.add_argument("--delay", type=int, default=300, help="milliseconds the stand-in human thinks per move")
+    args = parser.parse_args()
+    start_game(stand_in_url(args.first, args.delay) if args.stand_in else None)
@@ -0,0 +1,60 @@
+import threading
+import numpy as np
+from typing import Callable, Dict, Optional
+from base_game import is_valid_column, get_next_open_row, check_for_win_at
+from iterative_deepening import new_stop_flag
+
+# A file that holds pondering: searching on the opponent's time.
+#
+# After the AI moves, a background thread searches the position after every reply the opponent can
+# make. Each reply has a generator of ever better results (one more depth of iterative deepening, or
+# one more batch of playouts) and the thread takes one step of each in turn, so the time is split
+# evenly between the replies. The numba searches release the GIL, so the game keeps waiting for the
+# human meanwhile. Once the opponent has moved, the thread is stopped and the game gets the last
+# result of the reply that was played. When it is as good as a normal search would be, the AI answers
+# at once; otherwise it searches as usual, with the caches the pondering warmed up.
+
+def reply_boards(board:np.ndarray, piece:int) -> Dict[int, np.ndarray]:
+    """ The board after every move of `piece` that does not end the game, by column """
+    boards = {}
+    for col in range(7):
+        if is_valid_column(board, col):
+            child = board.copy()
+            row = get_next_open_row(child, col)
+            child[row, col] = piece
+            if not check_for_win_at(child, row, col) and np.count_nonzero(child) < 42:
+                boards[col] = child
+    return boards
+
+class Ponder:
+    """ Runs one step generator per opponent reply, round robin, in a daemon thread """
+
+    def __init__(self, steps:Dict[int, Callable]):
+        """ steps[col](stop) yields results for the position after the opponent plays col,
+        and must return soon once stop[0] is set """
+        self.steps = steps
+        self.stop = new_stop_flag()
+        self.results = {}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> "Ponder":
+        self.thread.start()
+        return self
+
+    def run(self) -> None:
+        active = {col: steps(self.stop) for col, steps in self.steps.items()}
+        while active and not self.stop[0]:
+            for col in list(active):
+                try:
+                    self.results[col] = next(active[col])
+                except StopIteration: # Decided, or searched to the end of the game
+                    del active[col]
+                if self.stop[0]:
+                    break
+
+    def finish(self, col:Optional[int]) -> Optional[tuple]:
+        """ Stop pondering and return the last result for the reply the opponent played, if any;
+        None when the opponent's move is unknown """
+        self.stop.fill(1)
+        self.thread.join()
+        return self.results.get(col)
@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import struct
+import sys
+import numpy as np
+from typing import Iterable, Optional, Tuple
+
+# A file that holds the persistent position store: engine results saved to disk and read back through mmap.
+#
+# A store belongs to one engine. The file is a 32 byte header followed by fixed width records sorted by key:
+#
+#   header: magic "C4PS", version (uint16), record size (uint16), engine name (16 bytes), record count (uint64)
+#   record: key (uint64), score (float64), move (int8, column 0-6), depth (int8), 6 bytes padding
+#
+# The key of a position is position + mask in the bitboard layout, with `position` the stones of the side
+# to move, so it is the same for every engine and never collides. Readers map the file read-only, so any
+# number of processes share one copy in the page cache. Stores are built offline from analyze.py output
+# and replaced atomically, so a reader never sees a half written file.
+
+MAGIC = b"C4PS"
+VERSION = 1
+HEADER = struct.Struct("<4sHH16sQ")
+RECORD = np.dtype({"names": ["key", "score", "move", "depth"],
+                   "formats": ["<u8", "<f8", "i1", "i1"],
+                   "offsets": [0, 8, 16, 17],
+                   "itemsize": 24})
+STORE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def store_path(engine:str) -> str:
+    """ Default file of an engine's store, next to this file """
+    return os.path.join(STORE_DIR, f"{engine}_positions.c4ps")
+
+def position_key(position:np.uint64, mask:np.uint64) -> int:
+    """ Store key of a position; `position` holds the stones of the side to move """
+    return int(position) + int(mask)
+
+class PositionStore:
+    """ Read-only view of a store file, with hit and miss counts """
+
+    def __init__(self, path:str):
+        with open(path, "rb") as f:
+            magic, version, record_size, engine, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or record_size != RECORD.itemsize:
+            raise ValueError(f"{path} is not a version {VERSION} position store")
+        self.path = path
+        self.engine = engine.rstrip(b"\0").decode()
+        self.records = np.memmap(path, dtype=RECORD, mode="r", offset=HEADER.size, shape=(count,)) if count \
+            else np.zeros(0, dtype=RECORD)
+        self.keys = self.records["key"]
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def lookup(self, key:int) -> Optional[Tuple[int, float, int]]:
+        """ The stored (move, score, depth) of a position key, or None """
+        i = int(np.searchsorted(self.keys, np.uint64(key)))
+        if i < len(self.keys) and self.keys[i] == key:
+            self.hits += 1
+            record = self.records[i]
+            return int(record["move"]), float(record["score"]), int(record["depth"])
+        self.misses += 1
+        return None
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+def open_store(path:str) -> Optional[PositionStore]:
+    """ Open a store if the file exists, else None (engines then always search) """
+    return PositionStore(path) if os.path.exists(path) else None
+
+def build_store(results:Iterable[dict], path:str, engine:str) -> int:
+    """ Write a store from analyze.py results, keeping the deepest result of every position
+
+    Args:
+        results (Iterable[dict]): analyze.analyze_position() results; errors and other engines are skipped
+        path (str): the store file, replaced atomically
+        engine (str): engine whose results go into the store
+
+    Returns:
+        int: number of positions written
+    """
+    from analyze import parse_position, relabel, AI_PIECE
+    from bitboard import from_array
+
+    entries = {}
+    for result in results:
+        if result.get("engine") != engine or "error" in result:
+            continue
+        board = relabel(parse_position(result["position"]))
+        key = position_key(*from_array(board, AI_PIECE))
+        if key not in entries or result["depth"] > entries[key][2]:
+            entries[key] = (result["move"] - 1, result["score"], result["depth"])
+
+    records = np.zeros(len(entries), dtype=RECORD)
+    for i, key in enumerate(sorted(entries)):
+        move, score, depth = entries[key]
+        records[i] = (key, score, move, min(depth, 127))
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.itemsize, engine.encode()[:16], len(records)))
+        f.write(records.tobytes())
+    os.replace(temp_path, path)
+    return len(records)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query a persistent position store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a store from analyze.py JSON lines")
+    build.add_argument("input", nargs="?", default="-", help="analyze.py output, - for stdin")
+    build.add_argument("--engine", default="alphabeta", help="engine whose results to keep")
+    build.add_argument("--output", help="store file (default: <engine>_positions.c4ps)")
+    lookup = commands.add_parser("lookup", help="look up a position")
+    lookup.add_argument("store", help="store file")
+    lookup.add_argument("moves", nargs="?", default="", help="move sequence, columns 1-7")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        lines = sys.stdin if args.input == "-" else open(args.input)
+        with lines:
+            count = build_store((json.loads(line) for line in lines if line.strip()), args.output or store_path(args.engine), args.engine)
+        print(f"{count} positions written to {args.output or store_path(args.engine)}")
+    else:
+        from analyze import parse_position, relabel, AI_PIECE
+        from bitboard import from_array
+        store = PositionStore(args.store)
+        result = store.lookup(position_key(*from_array(relabel(parse_position(args.moves)), AI_PIECE)))
+        print(f"{store.engine} store, {len(store)} positions")
+        if result is None:
+            print("Not found")
+        else:
+            move, score, depth = result
+            print(f"Move: {move + 1}, score: {score:g}, depth: {depth}")
@@ -0,0 +1,219 @@
+import json
+import time
+import numpy as np
+from numba import njit
+from typing import Dict, List, Optional, Tuple
+from bitboard import popcount
+from incremental_evaluation import OWN, create_evaluator, add_stone, remove_stone, current_score
+from base_game import SCORE_WEIGHTS
+
+# A file that holds the search statistics shared by the engines.
+#
+# A search counts into a stats table with one row per ply of the game (stones on the board, 0-42)
+# and one column per counter below. The numba searches take the table as an argument and update it
+# with count(), a few integer adds per node, so statistics can stay on in every game. A table with no
+# rows (create_stats(False)) turns every count() into one branch that is never taken, for callers that
+# want no statistics at all. Connect4-Bitboard's Python search cannot share numba's arrays cheaply and
+# counts into create_counters() instead: plain lists by counter name.
+#
+# SearchStats turns a table into what people look at (nodes per depth, cutoff rates, leaf evaluations,
+# terminal hits, effective branching factor and cache hits) and exports it as JSON or Prometheus text.
+# numba code cannot read a clock, so the evaluation time of the numba engines is estimated from their
+# leaf count and the measured cost of one incremental evaluation; the Python engine times its own.
+
+NODES = 0 # Nodes entered
+EXPANDED = 1 # Nodes whose children were searched
+CUTOFFS = 2 # Expanded nodes left early by a beta cutoff
+FIRST_MOVE_CUTOFFS = 3 # Cutoffs by the first child searched
+LEAF_EVALS = 4 # Leaves scored by the evaluator
+TERMINALS = 5 # Nodes decided by the rules without searching: a full board, a win at once or a forced loss
+CACHE_HITS = 6 # Transposition table probes that found the position
+CACHE_MISSES = 7
+COUNTERS = ("nodes", "expanded", "cutoffs", "first_move_cutoffs", "leaf_evals", "terminals", "cache_hits", "cache_misses")
+PLIES = 43 # Rows of a stats table: 0 to 42 stones on the board
+
+def create_stats(enabled:bool=True) -> np.ndarray:
+    """ An empty stats table for the numba searches; disabled tables have no rows and count nothing """
+    return np.zeros((PLIES if enabled else 0, len(COUNTERS)), dtype=np.int64)
+
+def create_counters() -> Dict[str, list]:
+    """ Empty counters for Connect4-Bitboard's alphabeta_search: a list by ply per counter, plus eval_time in seconds """
+    counters = {name: [0] * PLIES for name in COUNTERS}
+    counters["eval_time"] = [0.0]
+    return counters
+
+@njit(cache=True)
+def stats_ply(stats:np.ndarray, mask:np.uint64) -> int:
+    """ The row of a node in the stats table: its number of stones, or 0 when the table is disabled """
+    return np.int64(popcount(mask)) if stats.shape[0] > 0 else 0 # np.int64: popcount() is unsigned
+
+@njit(cache=True)
+def count(stats:np.ndarray, ply:int, counter:int) -> None:
+    """ Add one to a counter at `ply`, unless the table is disabled """
+    if stats.shape[0] > 0:
+        stats[ply, counter] += 1
+
+@njit(cache=True)
+def run_leaf_evals(evaluator, num_evals:int) -> int:
+    """ The evaluation work of num_evals leaves: place a stone, score the board, take the stone back """
+    total = 0
+    for i in range(num_evals):
+        bit = 7 * (i % 7) + (i // 7) % 6
+        add_stone(evaluator, bit, OWN)
+        total += current_score(evaluator)
+        remove_stone(evaluator, bit, OWN)
+    return total
+
+_eval_cost = None
+
+def eval_cost() -> float:
+    """ Seconds of one incremental leaf evaluation, measured once per process """
+    global _eval_cost
+    if _eval_cost is None:
+        evaluator = create_evaluator(np.uint64(0), np.uint64(0), SCORE_WEIGHTS)
+        run_leaf_evals(evaluator, 1) # Compile (or load) before timing
+        num_evals = 100000
+        t1 = time.perf_counter()
+        run_leaf_evals(evaluator, num_evals)
+        _eval_cost = (time.perf_counter() - t1) / num_evals
+    return _eval_cost
+
+class SearchStats:
+    """ Statistics of one search, or of many added together
+
+    Rows are counted from the root (row 0), so the statistics of searches from different positions add up.
+    """
+
+    def __init__(self, table:np.ndarray, root_ply:int=0, search_time:float=0.0, eval_time:Optional[float]=None, searches:int=1):
+        """
+        Args:
+            table (np.ndarray): stats table of the search, one row per ply of the game
+            root_ply (int): stones on the board at the root
+            search_time (float): seconds the search took
+            eval_time (float): seconds spent evaluating leaves; None to estimate it with eval_cost()
+            searches (int): number of searches counted in the table
+        """
+        self.table = np.zeros((PLIES, len(COUNTERS)), dtype=np.int64)
+        rows = table[root_ply:]
+        self.table[:len(rows)] = rows
+        self.search_time = search_time
+        self.searches = searches
+        leaf_evals = int(self.table[:, LEAF_EVALS].sum())
+        self.eval_time = eval_time if eval_time is not None else leaf_evals * eval_cost() if leaf_evals else 0.0
+
+    @classmethod
+    def from_counters(cls, counters:Dict[str, list], root_ply:int=0, search_time:float=0.0) -> "SearchStats":
+        """ Statistics of Connect4-Bitboard's alphabeta_search from its create_counters() """
+        table = np.array([counters[name] for name in COUNTERS], dtype=np.int64).T
+        return cls(table, root_ply, search_time, counters["eval_time"][0])
+
+    @classmethod
+    def from_dict(cls, stats:dict) -> "SearchStats":
+        """ Rebuild statistics from to_dict(), to add up the answers of worker processes.
+        Only the nodes keep their depths; every other counter is kept as a total. """
+        table = np.zeros((PLIES, len(COUNTERS)), dtype=np.int64)
+        table[:len(stats["nodes_per_depth"]), NODES] = stats["nodes_per_depth"]
+        for counter, key in ((EXPANDED, "expanded"), (CUTOFFS, "cutoffs"), (FIRST_MOVE_CUTOFFS, "first_move_cutoffs"),
+                             (LEAF_EVALS, "leaf_evals"), (TERMINALS, "terminal_hits"), (CACHE_HITS, "cache_hits"),
+                             (CACHE_MISSES, "cache_misses")):
+            table[0, counter] = stats[key]
+        return cls(table, 0, stats["search_time"], stats["eval_time"], stats["searches"])
+
+    def __add__(self, other:"SearchStats") -> "SearchStats":
+        return SearchStats(self.table + other.table, 0, self.search_time + other.search_time,
+                           self.eval_time + other.eval_time, self.searches + other.searches)
+
+    def total(self, counter:int) -> int:
+        return int(self.table[:, counter].sum())
+
+    @property
+    def nodes_per_depth(self) -> List[int]:
+        """ Nodes entered at each depth from the root, up to the deepest one searched """
+        nodes = self.table[:, NODES]
+        searched = np.flatnonzero(nodes)
+        return [int(n) for n in nodes[:searched[-1] + 1]] if len(searched) else []
+
+    @property
+    def branching_factor(self) -> float:
+        """ Effective branching factor: the mean growth of the node count from one depth to the next """
+        nodes = self.nodes_per_depth
+        if len(nodes) < 2:
+            return 0.0
+        return (nodes[-1] / nodes[0]) ** (1 / (len(nodes) - 1))
+
+    def to_dict(self) -> dict:
+        """ Every statistic by name, rates as fractions and times in seconds """
+        nodes = self.total(NODES)
+        expanded = self.total(EXPANDED)
+        cutoffs = self.total(CUTOFFS)
+        probes = self.total(CACHE_HITS) + self.total(CACHE_MISSES)
+        return {"searches": self.searches,
+                "nodes": nodes,
+                "nodes_per_depth": self.nodes_per_depth,
+                "nodes_per_second": round(nodes / self.search_time) if self.search_time > 0 else None,
+                "expanded": expanded,
+                "cutoffs": cutoffs,
+                "first_move_cutoffs": self.total(FIRST_MOVE_CUTOFFS),
+                "cutoff_rate": round(cutoffs / expanded, 4) if expanded else None,
+                "first_move_cutoff_ratio": round(self.total(FIRST_MOVE_CUTOFFS) / cutoffs, 4) if cutoffs else None,
+                "leaf_evals": self.total(LEAF_EVALS),
+                "eval_time": round(self.eval_time, 6),
+                "terminal_hits": self.total(TERMINALS),
+                "branching_factor": round(self.branching_factor, 3),
+                "cache_hits": self.total(CACHE_HITS),
+                "cache_misses": self.total(CACHE_MISSES),
+                "cache_hit_rate": round(self.total(CACHE_HITS) / probes, 4) if probes else None,
+                "search_time": round(self.search_time, 6)}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def to_prometheus(self, labels:Optional[Dict[str, str]]=None, prefix:str="connect4_search") -> str:
+        """ The statistics in the Prometheus text exposition format, see prometheus_text() """
+        return prometheus_text([(labels or {}, self)], prefix)
+
+# Prometheus metrics: name, type, help and the to_dict() key of the value
+PROMETHEUS_METRICS = (
+    ("searches_total", "counter", "Searches counted", "searches"),
+    ("nodes_total", "counter", "Nodes entered, by depth from the root", "nodes_per_depth"),
+    ("expanded_total", "counter", "Nodes whose children were searched", "expanded"),
+    ("cutoffs_total", "counter", "Expanded nodes left early by a beta cutoff", "cutoffs"),
+    ("first_move_cutoffs_total", "counter", "Cutoffs by the first move searched", "first_move_cutoffs"),
+    ("leaf_evals_total", "counter", "Leaves scored by the evaluator", "leaf_evals"),
+    ("eval_seconds_total", "counter", "Seconds spent evaluating leaves, estimated for the numba engines", "eval_time"),
+    ("terminal_hits_total", "counter", "Nodes decided by the rules without searching", "terminal_hits"),
+    ("cache_hits_total", "counter", "Transposition table probes that found the position", "cache_hits"),
+    ("cache_misses_total", "counter", "Transposition table probes that did not", "cache_misses"),
+    ("seconds_total", "counter", "Seconds spent searching", "search_time"),
+    ("cutoff_rate", "gauge", "Fraction of expanded nodes with a beta cutoff", "cutoff_rate"),
+    ("first_move_cutoff_ratio", "gauge", "Fraction of cutoffs by the first move searched", "first_move_cutoff_ratio"),
+    ("branching_factor", "gauge", "Effective branching factor", "branching_factor"),
+    ("cache_hit_rate", "gauge", "Fraction of transposition table probes that hit", "cache_hit_rate"),
+)
+
+def prometheus_text(samples:List[Tuple[Dict[str, str], SearchStats]], prefix:str="connect4_search") -> str:
+    """ Search statistics in the Prometheus text exposition format
+
+    Args:
+        samples (List[Tuple[Dict[str, str], SearchStats]]): labels and statistics, such as one pair per engine
+        prefix (str): start of every metric name
+
+    Returns:
+        str: one HELP and TYPE line per metric, then its samples; ends with a newline
+    """
+    def sample(name:str, labels:Dict[str, str], value) -> str:
+        text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+        return f"{prefix}_{name}{{{text}}} {value}" if text else f"{prefix}_{name} {value}"
+
+    dicts = [(labels, stats.to_dict()) for labels, stats in samples]
+    lines = []
+    for name, kind, help_text, key in PROMETHEUS_METRICS:
+        values = []
+        for labels, stats in dicts:
+            if key == "nodes_per_depth":
+                values += [sample(name, {**labels, "depth": str(depth)}, n) for depth, n in enumerate(stats[key])]
+            elif stats[key] is not None:
+                values.append(sample(name, labels, stats[key]))
+        if values:
+            lines += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} {kind}"] + values
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,302 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from numba import njit
+from bitboard import WIDTH, HEIGHT, MOVE_ORDER, can_play, play, is_win, column_mask, \
+    winning_cells, can_win_next, non_losing_moves, mirror, popcount, from_moves
+
+# A file that holds the perfect-play solver: bitboard negamax with null-window searches,
+# a transposition table and an optional opening book.
+#
+# Scores follow Connect4-Bitboard/game_state.State.calculate_heuristic: a win with your k-th stone is
+# worth 22 - k, a draw 0 and a loss the negative of the opponent's win. They are always from
+# the point of view of the side to move.
+
+MIN_SCORE = -(WIDTH * HEIGHT) // 2 + 3
+MAX_SCORE = (WIDTH * HEIGHT + 1) // 2 - 3
+
+TABLE_SIZE = 8388593 # Prime, so (key % size, low 32 bits of key) identifies a 49 bit key
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening_book.npz")
+
+@njit(cache=True)
+def table_get(keys:np.ndarray, values:np.ndarray, key:np.uint64) -> int:
+    """ Stored upper bound of a position, encoded as value - MIN_SCORE + 1; 0 when missing """
+    index = key % np.uint64(keys.shape[0])
+    if keys[index] == np.uint32(key & np.uint64(0xFFFFFFFF)):
+        return values[index]
+    return 0
+
+@njit(cache=True)
+def table_put(keys:np.ndarray, values:np.ndarray, key:np.uint64, value:int) -> None:
+    """ Always-replace store of an encoded upper bound """
+    index = key % np.uint64(keys.shape[0])
+    keys[index] = np.uint32(key & np.uint64(0xFFFFFFFF))
+    values[index] = value
+
+@njit(cache=True)
+def book_get(book_keys:np.ndarray, book_values:np.ndarray, position:np.uint64, mask:np.uint64) -> Tuple[bool, int]:
+    """ Look a position (or its mirror image) up in the sorted opening book """
+    key = min(position + mask, mirror(position) + mirror(mask))
+    index = np.searchsorted(book_keys, key)
+    if index < book_keys.shape[0] and book_keys[index] == key:
+        return True, int(book_values[index])
+    return False, 0
+
+@njit # Recursive: numba segfaults loading recursive functions from its cache
+def negamax(position:np.uint64, mask:np.uint64, moves:int, alpha:int, beta:int, keys:np.ndarray, values:np.ndarray,
+            book_keys:np.ndarray, book_values:np.ndarray, book_plies:int, node_count:np.ndarray) -> int:
+    """ Negamax Alpha Beta Pruning for exact scores. The side to move must not be able to win at once.
+
+    Args:
+        position (np.uint64): bitboard of the side to move
+        mask (np.uint64): bitboard of every stone on the board
+        moves (int): number of stones on the board
+        alpha (int): lower bound of the window
+        beta (int): upper bound of the window
+        keys (np.ndarray): transposition table keys
+        values (np.ndarray): transposition table upper bounds
+        book_keys (np.ndarray): sorted opening book keys
+        book_values (np.ndarray): opening book scores
+        book_plies (int): deepest ply stored in the book
+        node_count (np.ndarray): node_count[0] is incremented for every node
+
+    Returns:
+        int: the score if it lies inside (alpha, beta), otherwise a bound on the side it fell out
+    """
+    node_count[0] += 1
+
+    possible = non_losing_moves(position, mask)
+    if possible == 0: # Every move lets the opponent win next turn
+        return -((WIDTH * HEIGHT - moves) // 2)
+    if moves >= WIDTH * HEIGHT - 2: # Nobody can win with the last two stones
+        return 0
+
+    # The opponent cannot win next turn, so the score is at least this
+    lower = -((WIDTH * HEIGHT - 2 - moves) // 2)
+    if alpha < lower:
+        alpha = lower
+        if alpha >= beta:
+            return alpha
+
+    # We cannot win this turn, so the score is at most this
+    upper = (WIDTH * HEIGHT - 1 - moves) // 2
+    key = position + mask
+    value = table_get(keys, values, key)
+    if value:
+        upper = value + MIN_SCORE - 1
+    if moves <= book_plies:
+        found, score = book_get(book_keys, book_values, position, mask)
+        if found:
+            return score
+    if beta > upper:
+        beta = upper
+        if alpha >= beta:
+            return beta
+
+    # Order the columns by how many winning cells they give us, middle columns first on ties
+    order = np.empty(WIDTH, dtype=np.int64)
+    order_scores = np.empty(WIDTH, dtype=np.int64)
+    num_moves = 0
+    for i in range(WIDTH):
+        col = MOVE_ORDER[WIDTH - 1 - i]
+        move = possible & column_mask(col)
+        if move:
+            move_score = popcount(winning_cells(position | move, mask))
+            j = num_moves
+            while j > 0 and order_scores[j - 1] <= move_score:
+                order[j] = order[j - 1]
+                order_scores[j] = order_scores[j - 1]
+                j -= 1
+            order[j] = col
+            order_scores[j] = move_score
+            num_moves += 1
+
+    for i in range(num_moves):
+        child_position, child_mask = play(position, mask, order[i])
+        score = -negamax(child_position, child_mask, moves + 1, -beta, -alpha, keys, values,
+                         book_keys, book_values, book_plies, node_count)
+        if score >= beta:
+            return score
+        if score > alpha:
+            alpha = score
+
+    table_put(keys, values, key, alpha - MIN_SCORE + 1)
+    return alpha
+
+@njit # Calls negamax, which cannot be cached
+def solve_position(position:np.uint64, mask:np.uint64, weak:bool, keys:np.ndarray, values:np.ndarray,
+                   book_keys:np.ndarray, book_values:np.ndarray, book_plies:int, node_count:np.ndarray) -> int:
+    """ Narrow the score down with null-window searches (MTD style) """
+    moves = popcount(mask)
+    if can_win_next(position, mask):
+        return 1 if weak else (WIDTH * HEIGHT + 1 - moves) // 2
+
+    lower = -((WIDTH * HEIGHT - moves) // 2)
+    upper = (WIDTH * HEIGHT + 1 - moves) // 2
+    if weak: # Only win, draw or loss
+        lower = -1
+        upper = 1
+    while lower < upper:
+        # Probe near zero first, where most positions are decided
+        middle = lower + (upper - lower) // 2
+        if middle <= 0 and lower // 2 < middle:
+            middle = lower // 2
+        elif middle >= 0 and upper // 2 > middle:
+            middle = upper // 2
+        score = negamax(position, mask, moves, middle, middle + 1, keys, values,
+                        book_keys, book_values, book_plies, node_count)
+        if score <= middle:
+            upper = score
+        else:
+            lower = score
+    if weak:
+        return max(-1, min(1, lower))
+    return lower
+
+def plies_to_result(score:int, moves:int) -> int:
+    """ Number of plies until the game ends with perfect play from a position with `moves` stones """
+    if score == 0:
+        return WIDTH * HEIGHT - moves
+    # The winner's last move is played with this many stones already on the board
+    stones_before = WIDTH * HEIGHT + 1 - 2 * abs(score)
+    winner_parity = moves % 2 if score > 0 else (moves + 1) % 2
+    if stones_before % 2 != winner_parity:
+        stones_before -= 1
+    return stones_before - moves + 1
+
+class Solver:
+    """ Exact Connect 4 solver. The transposition table is kept between calls. """
+
+    def __init__(self, table_size:int=TABLE_SIZE, book_path:Optional[str]=BOOK_PATH):
+        self.keys = np.zeros(table_size, dtype=np.uint32)
+        self.values = np.zeros(table_size, dtype=np.int8)
+        self.book_keys = np.zeros(0, dtype=np.uint64)
+        self.book_values = np.zeros(0, dtype=np.int8)
+        self.book_plies = -1
+        self.node_count = np.zeros(1, dtype=np.int64)
+        if book_path and os.path.exists(book_path):
+            self.load_book(book_path)
+
+    def load_book(self, path:str) -> None:
+        book = np.load(path)
+        self.book_keys = book["keys"]
+        self.book_values = book["values"]
+        self.book_plies = int(book["plies"])
+
+    def score(self, position:np.uint64, mask:np.uint64, weak:bool=False) -> int:
+        """ Exact score of the side to move (sign only when weak) """
+        return solve_position(position, mask, weak, self.keys, self.values,
+                              self.book_keys, self.book_values, self.book_plies, self.node_count)
+
+    def solve(self, position:np.uint64, mask:np.uint64, weak:bool=False) -> List[Optional[int]]:
+        """ Score of playing each column for the side to move, None for full columns
+
+        Args:
+            position (np.uint64): bitboard of the side to move
+            mask (np.uint64): bitboard of every stone on the board
+            weak (bool): only tell win (1), draw (0) and loss (-1) apart, which is much faster
+
+        Returns:
+            List[Optional[int]]: one score per column
+        """
+        moves = popcount(mask)
+        scores = []
+        for col in range(WIDTH):
+            if not can_play(mask, col):
+                scores.append(None)
+                continue
+            child_position, child_mask = play(position, mask, col)
+            child_position, child_mask = np.uint64(child_position), np.uint64(child_mask)
+            if is_win(child_position ^ child_mask):
+                scores.append(1 if weak else (WIDTH * HEIGHT + 1 - moves) // 2)
+            elif popcount(child_mask) == WIDTH * HEIGHT:
+                scores.append(0)
+            else:
+                scores.append(-self.score(child_position, child_mask, weak))
+        return scores
+
+    def best_move(self, position:np.uint64, mask:np.uint64) -> Tuple[int, int, int]:
+        """ Best column, its score and the number of plies until the result """
+        scores = self.solve(position, mask)
+        col = max((c for c in MOVE_ORDER if scores[c] is not None), key=lambda c: scores[c])
+        return int(col), scores[col], plies_to_result(scores[col], popcount(mask))
+
+def solve(moves:str, weak:bool=False) -> List[Optional[int]]:
+    """ Score of every column after a move sequence such as "4453" (columns 1-7) """
+    return Solver().solve(*from_moves(moves), weak)
+
+def book_positions(plies:int) -> List[Tuple[np.uint64, np.uint64]]:
+    """ Every non-terminal position with `plies` stones, one per mirror pair """
+    frontier = [(np.uint64(0), np.uint64(0))]
+    for _ in range(plies):
+        next_frontier = {}
+        for position, mask in frontier:
+            for col in range(WIDTH):
+                if can_play(mask, col):
+                    child_position, child_mask = (np.uint64(x) for x in play(position, mask, col))
+                    if is_win(child_position ^ child_mask) or can_win_next(child_position, child_mask):
+                        continue # Decided at once, no need for the book
+                    key = min(int(child_position + child_mask), int(mirror(child_position) + mirror(child_mask)))
+                    next_frontier[key] = (child_position, child_mask)
+        frontier = list(next_frontier.values())
+    return frontier
+
+worker_solver = None
+
+def init_worker(book_path:str) -> None:
+    """ Give each book worker process its own solver with the book built so far """
+    global worker_solver
+    worker_solver = Solver(book_path=book_path)
+
+def solve_chunk(chunk:List[Tuple[np.uint64, np.uint64]]) -> List[Tuple[int, int]]:
+    """ Worker: solve a list of positions and return (book key, score) pairs """
+    results = []
+    for position, mask in chunk:
+        key = min(int(position + mask), int(mirror(position) + mirror(mask)))
+        results.append((key, worker_solver.score(position, mask)))
+    return results
+
+def save_book(entries:dict, plies:int, path:str) -> None:
+    """ Write the book as sorted keys and int8 scores """
+    keys = np.array(sorted(entries), dtype=np.uint64)
+    values = np.array([entries[int(k)] for k in keys], dtype=np.int8)
+    np.savez(path, keys=keys, values=values, plies=plies)
+
+def generate_book(plies:int, path:str=BOOK_PATH, workers:int=os.cpu_count() or 1, chunk_size:int=64) -> None:
+    """ Solve every position with up to `plies` stones and save the book to `path`.
+    The deepest ply is solved first so every shallower ply is answered from the book entries below it.
+    A book of 8-12 plies takes hours to days of CPU time. """
+    entries = {}
+    for ply in range(plies, -1, -1):
+        save_book(entries, plies, path)
+        positions = book_positions(ply)
+        chunks = [positions[i:i + chunk_size] for i in range(0, len(positions), chunk_size)]
+        t1 = time.time()
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(path,)) as pool:
+            for results in pool.map(solve_chunk, chunks):
+                entries.update(results)
+        print(f"ply {ply}: {len(positions)} positions in {round(time.time() - t1, 2)} sec")
+    save_book(entries, plies, path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve Connect 4 positions exactly.")
+    parser.add_argument("moves", nargs="?", default="", help="move sequence, columns 1-7, e.g. 4453")
+    parser.add_argument("--weak", action="store_true", help="only tell win, draw and loss apart")
+    parser.add_argument("--book", type=int, metavar="PLIES", help="generate the opening book up to PLIES stones")
+    args = parser.parse_args()
+
+    if args.book is not None:
+        generate_book(args.book)
+        sys.exit()
+
+    solver = Solver()
+    position, mask = from_moves(args.moves)
+    t1 = time.time()
+    scores = solver.solve(position, mask, args.weak)
+    print("Scores:", " ".join("-" if s is None else str(s) for s in scores))
+    print(f"Nodes searched: {solver.node_count[0]}")
+    print(f"Computation time: {round(time.time() - t1, 2)} sec")
@@ -0,0 +1,117 @@
+import numpy as np
+from typing import Tuple
+from numba import njit
+
+# A file that holds the Zobrist hashing and the fixed-size transposition table used by the numba engines.
+
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# Columns of a table entry
+VALUE = 0
+DEPTH = 1
+FLAG = 2
+MOVE = 3
+AGE = 4
+
+# Slots of the table statistics
+PROBES = 0
+HITS = 1
+STORES = 2
+CURRENT_AGE = 3
+
+# One random 64-bit key per (piece, row, col) plus one for the side to move.
+# The generator is seeded so the keys are identical in every process.
+_rng = np.random.default_rng(5100)
+ZOBRIST_KEYS = _rng.integers(0, 2**64, size=(3, 6, 7), dtype=np.uint64)
+ZOBRIST_SIDE = _rng.integers(0, 2**64, dtype=np.uint64)
+
+def create_table(size_bits:int=19) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Create an empty transposition table with 2**size_bits entries
+
+    Args:
+        size_bits (int): log2 of the number of entries
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: keys, entries, stats
+    """
+    size = 1 << size_bits
+    keys = np.zeros(size, dtype=np.uint64)
+    entries = np.zeros((size, 5), dtype=np.int32)
+    entries[:, DEPTH] = -1 # Mark every slot as empty
+    stats = np.zeros(4, dtype=np.int64)
+    return keys, entries, stats
+
+def new_search(table:Tuple[np.ndarray, np.ndarray, np.ndarray]) -> None:
+    """ Age the table and reset the probe counters before searching a new move """
+    stats = table[2]
+    stats[CURRENT_AGE] += 1
+    stats[PROBES] = 0
+    stats[HITS] = 0
+    stats[STORES] = 0
+
+def hit_rate(table:Tuple[np.ndarray, np.ndarray, np.ndarray]) -> float:
+    """ Fraction of probes since the last new_search() that found their position """
+    stats = table[2]
+    if stats[PROBES] == 0:
+        return 0.0
+    return stats[HITS] / stats[PROBES]
+
+def zobrist_hash(board:np.ndarray, maxTurn:bool) -> np.uint64:
+    """ Hash a whole board from scratch. Searches update the key incrementally instead. """
+    key = np.uint64(0)
+    for r in range(6):
+        for c in range(7):
+            piece = int(board[r, c])
+            if piece != 0:
+                key ^= ZOBRIST_KEYS[piece, r, c]
+    if maxTurn:
+        key ^= ZOBRIST_SIDE
+    return key
+
+@njit(cache=True)
+def probe_table(table, key:np.uint64) -> Tuple[bool, int, int, int, int]:
+    """ Look up a position in the transposition table
+
+    Args:
+        table (Tuple[np.ndarray, np.ndarray, np.ndarray]): keys, entries, stats
+        key (np.uint64): zobrist key of the position
+
+    Returns:
+        Tuple[bool, int, int, int, int]: found, value, depth, flag, best_column
+    """
+    keys, entries, stats = table
+    index = key & np.uint64(keys.shape[0] - 1)
+    stats[PROBES] += 1
+    if keys[index] == key and entries[index, DEPTH] >= 0:
+        stats[HITS] += 1
+        entry = entries[index]
+        return True, int(entry[VALUE]), int(entry[DEPTH]), int(entry[FLAG]), int(entry[MOVE])
+    return False, 0, -1, EXACT, -1
+
+@njit(cache=True)
+def store_table(table, key:np.uint64, value:int, depth:int, flag:int, best_column:int) -> None:
+    """ Store a search result. Replacement policy: an entry is overwritten when it is empty,
+    holds the same position, comes from an older move's search, or was searched shallower.
+
+    Args:
+        table (Tuple[np.ndarray, np.ndarray, np.ndarray]): keys, entries, stats
+        key (np.uint64): zobrist key of the position
+        value (int): the minimax value (or bound) of the position
+        depth (int): remaining search depth the value was computed with
+        flag (int): EXACT, LOWER_BOUND or UPPER_BOUND
+        best_column (int): best column found at this position
+    """
+    keys, entries, stats = table
+    index = key & np.uint64(keys.shape[0] - 1)
+    entry = entries[index]
+    age = stats[CURRENT_AGE]
+    if entry[DEPTH] < 0 or keys[index] == key or entry[AGE] != age or depth >= entry[DEPTH]:
+        keys[index] = key
+        entry[VALUE] = value
+        entry[DEPTH] = depth
+        entry[FLAG] = flag
+        entry[MOVE] = best_column
+        entry[AGE] = age
+        stats[STORES] += 1
@@ -0,0 +1,67 @@
+import threading
+import time
+from typing import Callable
+from numba import config
+from base_game import create_board, is_valid_column, get_valid_columns, get_next_open_row, check_for_win, \
+    check_for_win_at, evaluate_position
+
+# A file that holds the start-up warm-up of the numba functions.
+#
+# Every @njit function is compiled with cache=True: the first run of a script writes the machine code
+# to __pycache__ and later runs load it instead of compiling again (numba recompiles by itself when
+# a source file changes). Loading still costs a moment, and the very first run compiles everything,
+# so the games call each jitted function once on a throwaway board in a background thread while the
+# human thinks about their first move. The AI's first move then only waits for what is left, and
+# that wait is reported as compile time instead of search time.
+#
+# The parallel functions then start numba's threading layer from a background thread (and the pondering
+# threads search in the background too). The TBB layer hangs the interpreter at exit when it was started
+# that way, so OpenMP, which is just as thread safe, is preferred; this must run before the first prange.
+config.THREADING_LAYER_PRIORITY = ["omp", "tbb", "workqueue"]
+
+def warm_up_base_game() -> None:
+    """ Compile the array helpers of base_game shared by every game """
+    board = create_board()
+    is_valid_column(board, 3)
+    get_valid_columns(board)
+    get_next_open_row(board, 3)
+    check_for_win(board, 1)
+    check_for_win_at(board, 0, 3)
+    evaluate_position(board, 2)
+
+class Warmup:
+    """ Runs a warm-up function in a daemon thread and times it """
+
+    def __init__(self, warm_up:Callable[[], None]):
+        self.warm_up = warm_up
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.compile_time = 0.0 # Seconds the warm-up took
+        self.error = None
+
+    def start(self) -> "Warmup":
+        self.thread.start()
+        return self
+
+    def run(self) -> None:
+        t1 = time.time()
+        try:
+            self.warm_up()
+        except Exception as error: # Compiling again on first use still works, so only report it
+            self.error = error
+        self.compile_time = time.time() - t1
+
+    def wait(self) -> float:
+        """ Block until the warm-up is done
+
+        Returns:
+            float: seconds spent waiting, 0 when it had already finished
+        """
+        if not self.thread.is_alive():
+            return 0.0
+        t1 = time.time()
+        self.thread.join()
+        return time.time() - t1
+
+    def summary(self, waited:float) -> str:
+        """ Compile time line for the game output """
+        return f"{waited:.2f} sec waited, {self.compile_time:.2f} sec in the background"